@@ -2,26 +2,710 @@ import os
 import time
 import random
 import json
-import pandas as pd
+import queue
+import argparse
+import base64
+import csv
+import hashlib
+import io
 import shutil
+import socket
+import sqlite3
+import zlib
+import tempfile
+import re
+import unicodedata
+import math
+import functools
+from contextlib import contextmanager
+import threading
+import urllib3
+from html.parser import HTMLParser
+from urllib.parse import urlencode, urljoin, urlsplit
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support.wait import POLL_FREQUENCY as DEFAULT_POLL_FREQUENCY
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.selenium_manager import SeleniumManager
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
 
-def setup_driver(download_path):
+# Página de login de AFIP/ARCA
+LOGIN_URL = "https://auth.afip.gob.ar/contribuyente_/login.xhtml"
+
+# Elementos de la página de Mis Retenciones (formulario de consulta y página de resultados)
+_MIS_RET_BASE_XPATH = "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td"
+FECHA_DESDE_XPATH = _MIS_RET_BASE_XPATH + "/form/table[2]/tbody/tr[8]/td[2]/input[1]"
+FECHA_HASTA_XPATH = _MIS_RET_BASE_XPATH + "/form/table[2]/tbody/tr[8]/td[2]/input[2]"
+CONSULTAR_XPATH = _MIS_RET_BASE_XPATH + "/form/table[2]/tbody/tr[13]/td/input"
+VOLVER_XPATH = _MIS_RET_BASE_XPATH + "/table[2]/tbody/tr[2]/td/input"
+EXPORTAR_XPATH = _MIS_RET_BASE_XPATH + "/table[3]/tbody/tr/td[2]/table/tbody/tr/td[8]/a"
+RESULTADOS_XPATH = _MIS_RET_BASE_XPATH + "/table[2]"
+
+# Estados de un trabajo (CUIT, código, período) en el manifiesto de la corrida
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_EMPTY = "empty"
+JOB_FAILED = "failed"
+JOB_FINAL_STATES = (JOB_DONE, JOB_EMPTY)
+
+# Estados de la sesión de un CUIT, del más lejano al más cercano a una consulta. "results" cubre
+# los resultados en pantalla, exportados o no: en ambos casos se sigue volviendo al formulario.
+STATE_UNKNOWN = "unknown"
+STATE_LOGGED_OUT = "logged_out"
+STATE_LOGGED_IN = "logged_in"
+STATE_MIS_RET_OPEN = "mis_retenciones_open"
+STATE_FORM_READY = "form_ready"
+STATE_RESULTS = "results"
+SESSION_STATES = [STATE_LOGGED_OUT, STATE_LOGGED_IN, STATE_MIS_RET_OPEN, STATE_FORM_READY, STATE_RESULTS]
+RECOVERY_MAX_STEPS = 8
+
+# Pesos del dígito verificador del CUIT (módulo 11)
+CUIT_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+# Formato con el que el formulario guarda las fechas (se escriben ddmmaaaa y la máscara agrega las barras);
+# se usa al completarlas por script y en la consulta directa por HTTP
+FORM_DATE_FORMAT = "%d/%m/%Y"
+
+# Consulta directa por HTTP (engine "http"): patrón del enlace de exportación y
+# tamaño del pool de conexiones compartido
+HTTP_EXPORT_LINK_PATTERN = r"(?i)(export|excel|xls)"
+# Tipos de contenido que se aceptan como exportación (sin distinguir mayúsculas); una respuesta que no
+# es un adjunto ni tiene uno de estos tipos (página de login, error HTML) no se guarda como archivo
+EXPORT_CONTENT_TYPE_PATTERN = r"excel|spreadsheet|officedocument|csv"
+HTTP_POOL_SIZE = 8
+HTTP_POOL = None
+_HTTP_POOL_LOCK = threading.Lock()
+
+# Dataset consolidado (Parquet): columnas que identifican cada retención (en orden de preferencia)
+# y fragmentos de nombre de las columnas de importes
+DATASET_CERTIFICATE_COLUMNS = ["certificado", "numero_de_retencion", "nro_retencion", "comprobante"]
+DATASET_AMOUNT_COLUMNS = ["importe", "monto", "base"]
+
+# Trazas de tiempos: archivo JSON-lines, spans acumulados por paso y contadores de reintentos/fallas
+_TRACE = {"file": None, "run": None, "spans": {}, "events": {}}
+_TRACE_LOCK = threading.Lock()
+_TRACE_CONTEXT = threading.local()
+
+# Sufijos de los archivos que Chrome usa mientras la descarga está en curso
+PARTIAL_DOWNLOAD_SUFFIXES = (".crdownload", ".tmp", ".part")
+
+# Hashes SHA-256 ya calculados, por (ruta, tamaño, fecha de modificación)
+_HASH_CACHE = {}
+_HASH_CACHE_LOCK = threading.Lock()
+
+# Perfiles de ritmo: rango (mínimo, máximo) en segundos de cada pausa con nombre.
+# "conservative" reproduce el comportamiento humano original; "fast" no agrega
+# pausas y cada paso espera solo su condición de carga (elemento, pestaña, readyState).
+PACING_PROFILES = {
+    "conservative": {
+        "keystroke": (0.1, 0.3),        # entre tecla y tecla
+        "think": (0.2, 0.5),            # pausa ocasional mientras se escribe
+        "hover": (0.5, 1.0),            # con el mouse sobre el elemento antes del clic
+        "before_next": (0.5, 1.0),      # antes de "Siguiente" en el login
+        "before_password": (1.5, 2.5),  # antes de escribir la clave
+        "before_login": (0.7, 1.2),     # antes de "Ingresar"
+        "after_login": (4.0, 6.0),      # después de ingresar al portal
+        "portal_ready": (3.0, 5.0),     # antes de usar el buscador del portal
+        "search_click": (1.0, 2.0),     # después de hacer clic en el buscador
+        "search_results": (2.0, 3.0),   # después de escribir en el buscador
+        "open_tab": (4.0, 6.0),         # después de abrir Mis Retenciones
+        "switch_tab": (2.0, 3.0),       # después de cambiar o cerrar pestañas
+        "select": (1.0, 2.0),           # alrededor de cada select del formulario
+        "date": (1.0, 2.0),             # después de completar cada fecha
+        "submit": (4.0, 6.0),           # después de "Consultar"
+        "volver": (2.0, 3.0),           # después de "VOLVER"
+        "back": (3.0, 5.0),             # después de driver.back()
+        "user_menu": (1.0, 2.0),        # después de abrir el menú de usuario
+        "logout": (2.0, 3.0),           # después de cerrar sesión
+        "recover": (3.0, 5.0),          # después de volver a la página de login
+        "close_tab": (1.0, 1.0),        # entre pestañas cerradas durante la recuperación
+    },
+}
+PACING_PROFILES["fast"] = {paso: (0.0, 0.0) for paso in PACING_PROFILES["conservative"]}
+
+# Tiempos máximos (segundos) de las esperas por condición
+DEFAULT_TIMEOUTS = {
+    "default": 20,          # espera explícita general (WebDriverWait)
+    "short": 3,             # búsqueda del botón VOLVER cuando no aparecieron resultados
+    "download": 60,         # tiempo máximo de una descarga
+    "download_poll": 0.1,   # frecuencia con la que se revisa la carpeta de descarga
+}
+
+# Limitador compartido por todos los workers para las operaciones contra el portal (login,
+# navegación, consultas): token bucket con tope de concurrencia. Sube de a poco mientras el portal
+# responde bien y baja a la mitad ante 401, 429, timeouts o errores (AIMD). La latencia de una
+# operación no incluye las pausas del perfil de ritmo (son del script, no del portal).
+DEFAULT_RATE_LIMIT = {
+    "enabled": True,
+    "rate": 1.0,                # operaciones por segundo al empezar
+    "min_rate": 0.05,
+    "max_rate": 5.0,
+    "burst": 2,                 # operaciones que pueden salir juntas
+    "max_concurrency": None,    # operaciones simultáneas como máximo; por defecto, la cantidad de workers
+    "min_concurrency": 1,
+    "increase": 0.05,           # suma al ritmo por cada operación exitosa
+    "decrease": 0.5,            # factor del ritmo ante un 401, timeout o error
+    "slow_decrease": 0.9,       # factor del ritmo ante una respuesta lenta
+    "target_latency": 15.0,     # segundos a partir de los cuales una operación se considera lenta
+    "success_streak": 10,       # éxitos seguidos para habilitar una operación simultánea más
+    "cooldown": 5.0,            # segundos sin operaciones nuevas después de un 401 o timeout
+    "base_backoff": 2.0,        # espera base (exponencial, con jitter) entre reintentos
+    "max_backoff": 30.0,
+}
+
+# Pool de drivers: Chrome iniciados de antemano y limpiados entre usos en lugar de relanzarse
+DEFAULT_DRIVER_POOL = {
+    "enabled": True,
+    "spares": 1,                    # drivers de repuesto listos además de uno por worker
+    "chromedriver_path": None,      # sin ruta, se resuelve una sola vez con Selenium Manager
+    "chrome_binary": None,
+    "profile_template": None,       # perfil plantilla; por defecto, en la carpeta temporal del sistema
+    "recycle_max_jobs": 200,        # consultas terminadas tras las cuales se reinicia el driver (0: sin límite)
+    "recycle_max_rss_mb": 1500,     # memoria de chromedriver + Chrome a partir de la cual se reinicia (0: sin límite);
+                                    # se mide con psutil (opcional) o /proc, así que en Windows requiere psutil
+}
+
+# Postproceso en segundo plano: validar, normalizar y guardar cada descarga mientras el navegador sigue
+DEFAULT_POSTPROCESS = {
+    "enabled": True,
+    "workers": 2,                   # hilos que terminan las descargas
+    "queue_size": 8,                # descargas en espera como máximo; con la cola llena el navegador espera
+    "validate": False,              # leer el archivo completo (filas y totales); requiere pandas (y xlrd para .xls binarios)
+}
+
+# Consulta única por CUIT y período con la opción "todos los impuestos", separada después por código
+DEFAULT_MULTI_CODE = {
+    "enabled": False,
+    "option": "Todos",              # texto de la opción del select "impuestos" que abarca todos
+    "column": "impuesto",           # columna del resultado con el código de cada retención
+}
+
+# Esperas adaptativas: tiempos máximos y sondeo aprendidos de las latencias de corridas anteriores
+DEFAULT_WAIT_POLICY = {
+    "enabled": True,
+    "percentile": 99,               # percentil de las latencias observadas que cubre el tiempo máximo
+    "margin": 2.0,                  # factor sobre ese percentil
+    "min_timeout": 2.0,             # ninguna espera aprendida baja de este tiempo (segundos)
+    "min_samples": 20,              # muestras necesarias antes de reemplazar los TIMEOUTS
+    "max_samples": 500,             # muestras que se conservan por espera
+    "min_poll": 0.05,               # sondeo más frecuente posible (segundos)
+    "max_poll": 0.5,                # sondeo más espaciado (el de Selenium por defecto)
+}
+
+# Recursos que no se usan y se bloquean en modo liviano (imágenes, fuentes, medios y seguimiento).
+# Las hojas de estilo no se bloquean: sin ellas cambia la visibilidad de los elementos.
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*hotjar.com*",
+]
+
+# Configuración por defecto; se puede reemplazar con un archivo JSON (--config)
+DEFAULT_CONFIG = {
+    "login_url": LOGIN_URL,         # se puede apuntar al sitio simulado de mock_arca.py
+    "excel_path": r"C:\Users\eze\Downloads\CREDENCIALES.xlsx",  # también .csv, .jsonl, "env:VARIABLE" o "secret:ruta"
+    "download_path": r"C:\Users\eze\Downloads",
+    "codigos_retencion": ["216", "767"],
+    "jobs": [],                     # matriz de trabajos: [{"cuits": [...], "codigos": [...], "desde": aaaamm, "hasta": aaaamm}]
+    "workers": 1,
+    "pacing": "conservative",
+    "pacing_overrides": {},
+    "timeouts": {},
+    "engine": "browser",
+    "manifest_path": None,
+    "periodo_desde": None,          # aaaamm; sin rango se consulta el mes anterior
+    "periodo_hasta": None,
+    "meses_por_consulta": 1,
+    "trace_path": None,             # spans JSON-lines; por defecto, en la carpeta de descargas
+    "dataset_path": None,           # si se indica, se consolida lo descargado en un dataset Parquet
+    "headless": False,
+    "block_resources": False,
+    "blocked_urls": BLOCKED_URL_PATTERNS,
+    "extraction": "export",         # "export" descarga el Excel; "capture" lo trae en memoria; "table" lee la tabla
+    "max_result_pages": 50,         # páginas de resultados que se leen como máximo en modo "table"
+    "rate_limit": {},               # ajustes de DEFAULT_RATE_LIMIT
+    "driver_pool": {},              # ajustes de DEFAULT_DRIVER_POOL (incluye los límites de reciclado)
+    "postprocess": {},              # ajustes de DEFAULT_POSTPROCESS
+    "multi_code": {},               # ajustes de DEFAULT_MULTI_CODE (una consulta para todos los códigos)
+    "wait_policy": {},              # ajustes de DEFAULT_WAIT_POLICY
+    "wait_stats_path": None,        # latencias aprendidas (JSON); por defecto, en la carpeta de descargas
+    "shard": None,                  # "i/n": procesar solo la parte i (1..n) de los CUIT
+    "queue_path": None,             # cola de trabajos SQLite compartida entre nodos
+    "queue_lease": 300,             # segundos que un nodo retiene un CUIT sin renovar su lease
+    "queue_max_attempts": 3,        # intentos de un trabajo fallido antes de abandonarlo
+    "incremental": True,            # sin --desde, consultar desde la marca de cada (CUIT, código)
+    "watermarks_path": None,        # marcas JSON; por defecto, en la carpeta de descargas
+    "empty_probe_after": 3,         # meses vacíos seguidos a partir de los cuales se espacia el sondeo
+    "empty_probe_max_interval": 12, # meses máximos entre sondeos de una combinación vacía
+}
+
+# Perfil de ritmo y tiempos máximos activos (ver set_pacing)
+PACING = dict(PACING_PROFILES["conservative"])
+TIMEOUTS = dict(DEFAULT_TIMEOUTS)
+
+# Opciones del navegador activas (ver set_browser_options)
+BROWSER = {"headless": False, "block_resources": False, "blocked_urls": list(BLOCKED_URL_PATTERNS)}
+
+# Cómo se obtienen los resultados de una consulta con datos (ver set_extraction)
+EXTRACTION = {"mode": "export", "max_pages": 50}
+
+# Consulta combinada de códigos activa (ver set_multi_code)
+MULTI_CODE = dict(DEFAULT_MULTI_CODE)
+
+def load_config(config_path=None):
+    """Leer la configuración desde un archivo JSON, completando con los valores por defecto"""
+    config = dict(DEFAULT_CONFIG)
+    if config_path:
+        with open(config_path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    return config
+
+def set_pacing(profile, overrides=None, timeouts=None):
+    """Activar un perfil de ritmo y ajustar pausas y tiempos máximos puntuales"""
+    if profile not in PACING_PROFILES:
+        raise ValueError(f"Perfil de ritmo desconocido: {profile} (opciones: {', '.join(PACING_PROFILES)})")
+    
+    PACING.clear()
+    PACING.update(PACING_PROFILES[profile])
+    for paso, rango in (overrides or {}).items():
+        PACING[paso] = tuple(rango)
+    
+    TIMEOUTS.clear()
+    TIMEOUTS.update(DEFAULT_TIMEOUTS)
+    TIMEOUTS.update(timeouts or {})
+
+def set_browser_options(headless=False, block_resources=False, blocked_urls=None):
+    """Configurar el modo del navegador que usarán los drivers nuevos"""
+    BROWSER["headless"] = headless
+    BROWSER["block_resources"] = block_resources
+    BROWSER["blocked_urls"] = list(blocked_urls if blocked_urls is not None else BLOCKED_URL_PATTERNS)
+
+def set_multi_code(overrides=None):
+    """Activar o ajustar la consulta única para todos los códigos de un CUIT y período"""
+    MULTI_CODE.clear()
+    MULTI_CODE.update(DEFAULT_MULTI_CODE)
+    MULTI_CODE.update(overrides or {})
+
+def set_extraction(mode="export", max_pages=50):
+    """Elegir entre exportar el Excel (descarga o captura en memoria) o leer la tabla de resultados"""
+    if mode not in ("export", "capture", "table"):
+        raise ValueError(f"Modo de extracción desconocido: {mode} (opciones: export, capture, table)")
+    EXTRACTION["mode"] = mode
+    EXTRACTION["max_pages"] = max_pages
+
+# Segundos de pausa del perfil de ritmo acumulados por hilo (el limitador los descuenta de la latencia)
+_PAUSED = threading.local()
+
+def paused_seconds():
+    """Segundos de pausa acumulados por el hilo actual"""
+    return getattr(_PAUSED, "total", 0.0)
+
+def _add_pause(segundos):
+    _PAUSED.total = paused_seconds() + segundos
+
+def pause(step):
+    """Hacer la pausa configurada para un paso en el perfil de ritmo activo"""
+    minimo, maximo = PACING.get(step, (0.0, 0.0))
+    if maximo > 0:
+        segundos = random.uniform(minimo, maximo)
+        time.sleep(segundos)
+        _add_pause(segundos)
+
+def hover(driver, element):
+    """Mover el mouse al elemento antes de hacer clic (solo si el perfil tiene pausa de hover)"""
+    minimo, maximo = PACING["hover"]
+    if maximo > 0:
+        segundos = random.uniform(minimo, maximo)
+        actions = ActionChains(driver)
+        actions.move_to_element(element).pause(segundos).perform()
+        _add_pause(segundos)
+
+class WaitPolicy:
+    """Latencias observadas por paso y localizador, guardadas entre corridas (JSON)
+    
+    Con suficientes muestras, el tiempo máximo de una espera es el percentil alto observado por
+    un margen (sin pasar del configurado) y la frecuencia de sondeo, una fracción de la mediana:
+    los pasos rápidos se revisan más seguido. Sin muestras se usan TIMEOUTS y el sondeo de Selenium.
+    """
+    
+    def __init__(self, path=None, **config):
+        self.lock = threading.Lock()
+        self.configure(path, **config)
+    
+    def configure(self, path=None, **config):
+        self.path = path
+        self.config = dict(DEFAULT_WAIT_POLICY)
+        self.config.update(config)
+        self.samples = {}
+        self.timeouts = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.samples = json.load(f).get("samples", {})
+            except (OSError, ValueError) as e:
+                print(f"No se pudieron leer las latencias guardadas: {str(e)}")
+    
+    @property
+    def enabled(self):
+        return self.config["enabled"]
+    
+    def timing(self, key, default):
+        """Tiempo máximo y frecuencia de sondeo para una espera"""
+        with self.lock:
+            muestras = sorted(self.samples.get(key, []))
+        if len(muestras) < self.config["min_samples"]:
+            return default, DEFAULT_POLL_FREQUENCY
+        alto = _percentile(muestras, self.config["percentile"]) * self.config["margin"]
+        timeout = min(default, max(self.config["min_timeout"], alto))
+        sondeo = min(self.config["max_poll"], max(self.config["min_poll"], _percentile(muestras, 50) / 10))
+        return timeout, sondeo
+    
+    def observe(self, key, duracion, timed_out=False):
+        """Registrar cuánto tardó una espera (las agotadas también cuentan: suben el percentil)"""
+        with self.lock:
+            muestras = self.samples.setdefault(key, [])
+            muestras.append(round(duracion, 3))
+            del muestras[:-self.config["max_samples"]]
+            if timed_out:
+                self.timeouts[key] = self.timeouts.get(key, 0) + 1
+    
+    def save(self):
+        """Guardar las latencias para la próxima corrida (escritura atómica)"""
+        if not self.path:
+            return
+        with self.lock:
+            datos = {"updated_at": _now(), "samples": self.samples}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(tmp_path, self.path)
+    
+    def summary(self):
+        """Tiempo máximo y sondeo actuales por espera, con las que se agotaron en esta corrida"""
+        with self.lock:
+            claves = sorted(self.samples)
+            agotadas = dict(self.timeouts)
+        resumen = {}
+        for key in claves:
+            timeout, sondeo = self.timing(key, TIMEOUTS["default"])
+            resumen[key] = {"timeout": round(timeout, 2), "poll": round(sondeo, 3)}
+            if agotadas.get(key):
+                resumen[key]["agotadas"] = agotadas[key]
+        return resumen
+
+# Política de esperas activa (ver set_wait_policy)
+WAITS = WaitPolicy()
+
+def set_wait_policy(path=None, overrides=None):
+    """Configurar la política de esperas y cargar las latencias de corridas anteriores"""
+    WAITS.configure(path, **(overrides or {}))
+
+class AdaptiveWait(WebDriverWait):
+    """WebDriverWait que, con key, usa el tiempo máximo y el sondeo aprendidos para esa espera"""
+    
+    def until(self, method, message="", key=None):
+        if key is None or not WAITS.enabled:
+            return super().until(method, message)
+        timeout, sondeo = WAITS.timing(key, self._timeout)
+        inicio = time.monotonic()
+        try:
+            resultado = WebDriverWait(self._driver, timeout, poll_frequency=sondeo).until(method, message)
+        except TimeoutException:
+            WAITS.observe(key, time.monotonic() - inicio, timed_out=True)
+            raise
+        WAITS.observe(key, time.monotonic() - inicio)
+        return resultado
+
+def first_of(**condiciones):
+    """Condición que espera varias a la vez y devuelve (nombre, resultado) de la primera que se cumple
+    
+    Como EC.any_of, pero indicando cuál ganó.
+    """
+    def condicion(driver):
+        for nombre, esperada in condiciones.items():
+            try:
+                resultado = esperada(driver)
+            except (NoSuchElementException, StaleElementReferenceException):
+                resultado = False
+            if resultado:
+                return nombre, resultado
+        return False
+    return condicion
+
+def wait_page_ready(driver, wait, old_element=None):
+    """Esperar a que la página termine de cargar y, si se indica, a que reemplace a la anterior"""
+    if old_element is not None:
+        try:
+            wait.until(EC.staleness_of(old_element), key="page_unload")
+        except TimeoutException:
+            # La página no se recargó (por ejemplo, un error mostrado en la misma página)
+            pass
+    wait.until(lambda d: d.execute_script("return document.readyState") == "complete", key="page_ready")
+
+def wait_new_tab(driver, wait, tabs_before):
+    """Esperar a que se abra una pestaña nueva (sin error si no aparece)"""
+    try:
+        wait.until(EC.number_of_windows_to_be(tabs_before + 1), key="new_tab")
+    except TimeoutException:
+        pass
+
+class AdaptiveRateLimiter:
+    """Token bucket con tope de concurrencia compartido entre workers, ajustado según los errores y la latencia"""
+    
+    def __init__(self, **config):
+        self._cond = threading.Condition()
+        self.reset(**config)
+    
+    def reset(self, workers=1, **config):
+        """Volver al estado inicial con la configuración indicada (sin max_concurrency, una por worker)"""
+        with self._cond:
+            self.config = dict(DEFAULT_RATE_LIMIT)
+            self.config.update(config)
+            if self.config["max_concurrency"] is None:
+                self.config["max_concurrency"] = max(workers, self.config["min_concurrency"])
+            self.rate = self.config["rate"]
+            self.concurrency = self.config["max_concurrency"]
+            self.tokens = float(self.config["burst"])
+            self.last_refill = time.monotonic()
+            self.cooldown_until = 0.0
+            self.in_flight = 0
+            self.successes = 0
+            self.stats = {"ops": 0, "auth_errors": 0, "timeouts": 0, "errors": 0, "slow": 0, "backoffs": 0,
+                          "wait_s": 0.0}
+            self._cond.notify_all()
+    
+    def _refill(self, ahora):
+        self.tokens = min(self.config["burst"], self.tokens + (ahora - self.last_refill) * self.rate)
+        self.last_refill = ahora
+    
+    def acquire(self):
+        """Esperar un token y un lugar libre; devuelve el momento de inicio de la operación"""
+        inicio = time.monotonic()
+        if not self.config["enabled"]:
+            return inicio
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                self._refill(ahora)
+                if self.in_flight < self.concurrency and self.tokens >= 1 and ahora >= self.cooldown_until:
+                    break
+                if self.in_flight >= self.concurrency:
+                    # Se despierta al liberarse un lugar; el tope evita quedar esperando si se pierde el aviso
+                    espera = 1.0
+                else:
+                    espera = max((1 - self.tokens) / self.rate, self.cooldown_until - ahora, 0.01)
+                self._cond.wait(espera)
+            self.tokens -= 1
+            self.in_flight += 1
+            ahora = time.monotonic()
+            self.stats["wait_s"] += ahora - inicio
+        return ahora
+    
+    def release(self, inicio, signal="ok", paused=0.0):
+        """Liberar el lugar y ajustar el ritmo según lo observado (ok, slow, auth_error, timeout, error)
+        
+        paused son los segundos de pausas del perfil de ritmo dentro de la operación: no cuentan
+        como demora del portal.
+        """
+        if not self.config["enabled"]:
+            return
+        ahora = time.monotonic()
+        if signal == "ok" and ahora - inicio - paused > self.config["target_latency"]:
+            signal = "slow"
+        with self._cond:
+            self.in_flight -= 1
+            self.stats["ops"] += 1
+            if signal == "ok":
+                # Aumento aditivo, salvo durante la pausa posterior a un error
+                self.successes += 1
+                if ahora >= self.cooldown_until:
+                    self.rate = min(self.config["max_rate"], self.rate + self.config["increase"])
+                    if (self.successes >= self.config["success_streak"]
+                            and self.concurrency < self.config["max_concurrency"]):
+                        self.concurrency += 1
+                        self.successes = 0
+            elif signal == "slow":
+                self.stats["slow"] += 1
+                self.successes = 0
+                self.rate = max(self.config["min_rate"], self.rate * self.config["slow_decrease"])
+            else:
+                # Disminución multiplicativa: menos ritmo, menos concurrencia y una pausa para todos
+                self.stats[{"auth_error": "auth_errors", "timeout": "timeouts"}.get(signal, "errors")] += 1
+                self.stats["backoffs"] += 1
+                self.successes = 0
+                self.rate = max(self.config["min_rate"], self.rate * self.config["decrease"])
+                self.concurrency = max(self.config["min_concurrency"], self.concurrency - 1)
+                self.tokens = min(self.tokens, 0.0)
+                if signal in ("auth_error", "timeout"):
+                    self.cooldown_until = max(self.cooldown_until, ahora + self.config["cooldown"])
+            self._cond.notify_all()
+    
+    @contextmanager
+    def slot(self):
+        """Ocupar un lugar para una operación; el bloque puede indicar la señal en operacion["signal"]"""
+        operacion = {"signal": "ok"}
+        inicio = self.acquire()
+        pausas = paused_seconds()
+        try:
+            yield operacion
+        except TimeoutException:
+            operacion["signal"] = "timeout"
+            raise
+        except Exception:
+            operacion["signal"] = "error"
+            raise
+        finally:
+            self.release(inicio, operacion["signal"], paused_seconds() - pausas)
+    
+    def backoff(self, attempt):
+        """Esperar antes de un reintento (exponencial con jitter, acotada)"""
+        if self.config["enabled"]:
+            time.sleep(random.uniform(0, min(self.config["max_backoff"], self.config["base_backoff"] * 2 ** attempt)))
+    
+    def summary(self):
+        """Estado final del limitador para el resumen de la corrida"""
+        with self._cond:
+            resumen = dict(self.stats)
+            resumen["wait_s"] = round(resumen["wait_s"], 1)
+            resumen["rate"] = round(self.rate, 2)
+            resumen["concurrency"] = self.concurrency
+            return resumen
+
+# Limitador activo (ver set_rate_limit)
+RATE_LIMITER = AdaptiveRateLimiter()
+
+def set_rate_limit(overrides=None, workers=1):
+    """Configurar el limitador compartido que usarán todos los workers"""
+    overrides = overrides or {}
+    if overrides.get("max_concurrency") and overrides["max_concurrency"] < workers:
+        print(f"Aviso: el limitador permite {overrides['max_concurrency']} operaciones simultáneas "
+              f"para {workers} workers (rate_limit.max_concurrency)")
+    RATE_LIMITER.reset(workers, **overrides)
+
+def configure_tracing(path):
+    """Activar la escritura de spans (JSON-lines) en el archivo indicado"""
+    with _TRACE_LOCK:
+        if _TRACE["file"]:
+            _TRACE["file"].close()
+        _TRACE["file"] = open(path, "a", encoding="utf-8") if path else None
+        _TRACE["run"] = datetime.now().strftime("%Y%m%d%H%M%S")
+        _TRACE["spans"] = {}
+        _TRACE["events"] = {}
+
+def close_tracing():
+    """Cerrar el archivo de spans (los tiempos acumulados para el resumen se conservan)"""
+    with _TRACE_LOCK:
+        if _TRACE["file"]:
+            _TRACE["file"].close()
+        _TRACE["file"] = None
+
+def set_trace_context(**attrs):
+    """Datos (worker, CUIT, código) que se agregan a los spans del hilo actual"""
+    contexto = getattr(_TRACE_CONTEXT, "attrs", {})
+    contexto.update(attrs)
+    _TRACE_CONTEXT.attrs = {clave: valor for clave, valor in contexto.items() if valor is not None}
+
+def start_span(step, driver=None, **attrs):
+    """Empezar a medir un paso"""
+    return {
+        "step": step,
+        "ts": _now(),
+        "start": time.monotonic(),
+        "attrs": attrs,
+        "driver": driver,
+        "commands_before": getattr(driver, "command_count", None),
+    }
+
+def end_span(span, status=None, **attrs):
+    """Terminar un span y registrarlo (llamarlo de nuevo no tiene efecto)"""
+    if span is None or span.get("ended"):
+        return None
+    span["ended"] = True
+    duracion = time.monotonic() - span["start"]
+    status = status or span.get("status", "ok")
+    
+    registro = {"run": _TRACE["run"], "ts": span["ts"], "step": span["step"], "duration_s": round(duracion, 3),
+                "status": status}
+    registro.update(getattr(_TRACE_CONTEXT, "attrs", {}))
+    registro.update(span["attrs"])
+    registro.update(attrs)
+    if span["commands_before"] is not None:
+        registro["commands"] = span["driver"].command_count - span["commands_before"]
+    
+    with _TRACE_LOCK:
+        _TRACE["spans"].setdefault(span["step"], []).append((duracion, status))
+        if _TRACE["file"]:
+            _TRACE["file"].write(json.dumps(registro, default=str) + "\n")
+            _TRACE["file"].flush()
+    return registro
+
+@contextmanager
+def trace_span(step, driver=None, **attrs):
+    """Medir un bloque como un span; si el bloque lanza una excepción, el span queda con error"""
+    span = start_span(step, driver, **attrs)
+    try:
+        yield span
+    except Exception:
+        span["status"] = "error"
+        raise
+    finally:
+        end_span(span)
+
+def record_event(kind, step):
+    """Contar un reintento o una falla de un paso para el resumen"""
+    with _TRACE_LOCK:
+        _TRACE["events"].setdefault(kind, {}).setdefault(step, 0)
+        _TRACE["events"][kind][step] += 1
+
+def _percentile(valores, p):
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not valores:
+        return 0.0
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+def trace_summary():
+    """Resumen de la corrida: p50, p95 y máximo por paso, más reintentos y fallas"""
+    with _TRACE_LOCK:
+        pasos = {}
+        for step, medidas in _TRACE["spans"].items():
+            duraciones = sorted(duracion for duracion, _ in medidas)
+            pasos[step] = {
+                "n": len(duraciones),
+                "p50": _percentile(duraciones, 50),
+                "p95": _percentile(duraciones, 95),
+                "max": duraciones[-1],
+                "total": sum(duraciones),
+                "no_ok": sum(1 for _, status in medidas if status != "ok"),
+            }
+        return {"steps": pasos, "events": {kind: dict(conteo) for kind, conteo in _TRACE["events"].items()}}
+
+def print_trace_summary():
+    """Imprimir el resumen de tiempos de la corrida"""
+    resumen = trace_summary()
+    print("\nTiempos por paso (segundos):")
+    print(f"{'Paso':<22}{'n':>6}{'p50':>9}{'p95':>9}{'máx':>9}{'total':>10}{'no ok':>7}")
+    for step, datos in sorted(resumen["steps"].items(), key=lambda item: -item[1]["total"]):
+        print(f"{step:<22}{datos['n']:>6}{datos['p50']:>9.2f}{datos['p95']:>9.2f}{datos['max']:>9.2f}"
+              f"{datos['total']:>10.1f}{datos['no_ok']:>7}")
+    for kind, titulo in (("retry", "Reintentos"), ("failure", "Fallas"), ("recovery", "Recuperaciones")):
+        conteo = resumen["events"].get(kind, {})
+        print(f"{titulo}: {sum(conteo.values())}" + (f" {conteo}" if conteo else ""))
+
+def setup_driver(download_path, driver_path=None, chrome_binary=None, profile_dir=None):
     """Configurar el driver de Chrome con las opciones necesarias"""
     chrome_options = Options()
     
     # Configurar la carpeta de descargas (versión optimizada)
     prefs = {
-        "download.default_directory": download_path,
         "download.prompt_for_download": False,
         "plugins.always_open_pdf_externally": True,
         "safebrowsing.enabled": True,
@@ -30,8 +714,31 @@ def setup_driver(download_path):
         # Asegurarse de que los archivos Excel se descarguen correctamente
         "browser.helperApps.neverAsk.saveToDisk": "application/vnd.ms-excel;application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;application/csv;text/csv"
     }
+    
+    if download_path:
+        prefs["download.default_directory"] = download_path
+    
+    if BROWSER["block_resources"]:
+        # No descargar imágenes en ninguna pestaña
+        prefs["profile.managed_default_content_settings.images"] = 2
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    
     chrome_options.add_experimental_option("prefs", prefs)
     
+    if BROWSER["headless"]:
+        # Sin ventana: se fija el tamaño porque maximize_window no aplica
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--window-size=1920,1080")
+        chrome_options.add_argument("--disable-gpu")
+    
+    if BROWSER["headless"] or BROWSER["block_resources"]:
+        # Desactivar funciones de Chrome que no se usan para bajar memoria y tráfico
+        for argument in ("--disable-extensions", "--disable-background-networking", "--disable-sync",
+                         "--disable-default-apps", "--disable-component-update", "--no-first-run",
+                         "--disable-dev-shm-usage", "--mute-audio", "--metrics-recording-only",
+                         "--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication"):
+            chrome_options.add_argument(argument)
+    
     # Eliminar el mensaje "Un software automatizado está controlando Chrome"
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option("useAutomationExtension", False)
@@ -39,8 +746,17 @@ def setup_driver(download_path):
     # Agregar argumento para eliminar el banner de automatización
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     
-    # Inicializar el driver
-    driver = webdriver.Chrome(options=chrome_options)
+    # Perfil propio (copia de la plantilla del pool) y binario ya resuelto
+    if profile_dir:
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+    if chrome_binary:
+        chrome_options.binary_location = chrome_binary
+    
+    # Inicializar el driver (con la ruta de chromedriver ya resuelta no se consulta a Selenium Manager)
+    if driver_path:
+        driver = webdriver.Chrome(service=Service(driver_path), options=chrome_options)
+    else:
+        driver = webdriver.Chrome(options=chrome_options)
     
     # Ejecutar JavaScript para eliminar el banner de automatización
     driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
@@ -51,80 +767,618 @@ def setup_driver(download_path):
         """
     })
     
+    apply_resource_blocking(driver)
+    
     return driver
 
-def read_credentials(excel_path):
-    """Leer credenciales desde el archivo Excel"""
+def apply_resource_blocking(driver):
+    """Bloquear fuentes, medios y seguimiento en la pestaña actual (el bloqueo es por pestaña)"""
+    if not BROWSER["block_resources"]:
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BROWSER["blocked_urls"]})
+    except Exception as e:
+        print(f"No se pudo activar el bloqueo de recursos: {str(e)}")
+
+def _origin(url):
+    partes = urlsplit(url or "")
+    return f"{partes.scheme}://{partes.netloc}" if partes.scheme in ("http", "https") else None
+
+def reset_driver(driver):
+    """Dejar el navegador limpio (una pestaña, sin cookies ni almacenamiento) sin relanzarlo"""
+    with trace_span("driver_reset", driver):
+        origenes = {_origin(LOGIN_URL)}
+        while len(driver.window_handles) > 1:
+            driver.switch_to.window(driver.window_handles[-1])
+            origenes.add(_origin(driver.current_url))
+            driver.close()
+        driver.switch_to.window(driver.window_handles[0])
+        origenes.add(_origin(driver.current_url))
+        
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origen in origenes - {None}:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origen, "storageTypes": "all"})
+        driver.get("about:blank")
+
+def _process_tree_pids(pid):
+    """PID del proceso y de todos sus descendientes (psutil si está instalado; si no, /proc)"""
+    try:
+        import psutil
+        proceso = psutil.Process(pid)
+        return [pid] + [hijo.pid for hijo in proceso.children(recursive=True)]
+    except ImportError:
+        pass
+    
+    # Sin psutil: armar el árbol con el padre de cada proceso en /proc (solo Linux)
+    hijos = {}
+    for nombre in os.listdir("/proc"):
+        if not nombre.isdigit():
+            continue
+        try:
+            with open(f"/proc/{nombre}/stat", encoding="utf-8") as f:
+                # El nombre del proceso va entre paréntesis y puede tener espacios
+                padre = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        hijos.setdefault(padre, []).append(int(nombre))
+    pids, pendientes = [], [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        pids.append(actual)
+        pendientes.extend(hijos.get(actual, []))
+    return pids
+
+def _process_rss(pid):
+    """Memoria residente (bytes) de un proceso; 0 si ya terminó"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return 0
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _rss_measurable():
+    """Si hay forma de medir la memoria de los procesos (psutil o /proc)"""
+    try:
+        import psutil  # noqa: F401
+        return True
+    except ImportError:
+        return os.path.isdir("/proc")
+
+def driver_rss_mb(driver):
+    """Memoria residente de chromedriver y sus procesos de Chrome (MB); None si no se puede medir"""
     try:
-        df = pd.read_excel(excel_path)
-        # Verificar que existan las columnas necesarias
-        if 'CUIT' not in df.columns or 'Clave' not in df.columns:
-            print(f"Error: El archivo Excel debe contener las columnas 'CUIT' y 'Clave'")
-            return []
+        pid = driver.service.process.pid
+        return round(sum(_process_rss(hijo) for hijo in _process_tree_pids(pid)) / 2**20, 1)
+    except Exception:
+        # Driver remoto, proceso ya terminado o sistema sin psutil ni /proc
+        return None
+
+class DriverPool:
+    """Drivers de Chrome iniciados de antemano y reutilizados entre trabajos (se limpian en vez de relanzarse)
+    
+    Cada driver cuenta sus consultas terminadas; entre CUIT se mide su memoria y, si supera los
+    límites de reciclado, se reemplaza por uno nuevo (ver recycle_reason).
+    """
+    
+    def __init__(self, **config):
+        self._lock = threading.Lock()
+        # Solo ordena la preparación (Chrome de la plantilla): no bloquea al resto del pool mientras tanto
+        self._prepare_lock = threading.Lock()
+        self.idle = queue.Queue()
+        self.drivers = set()
+        self.pending = 0
+        self.memory = []
+        self.recycled = {}
+        self.configure(**config)
+    
+    def configure(self, **config):
+        """Aplicar la configuración; el chromedriver y la plantilla se resuelven al iniciar el primer driver"""
+        self.config = dict(DEFAULT_DRIVER_POOL)
+        self.config.update(config)
+        self.driver_path = None
+        self.chrome_binary = None
+        self.template = None
+        self.prepared = False
+        self.closed = False
+        self.memory = []
+        self.recycled = {}
+        self.rss_warned = False
+    
+    def _prepare(self):
+        """Resolver una sola vez chromedriver, el binario de Chrome y el perfil plantilla
         
-        # Convertir CUIT a string para asegurar formato correcto
-        df['CUIT'] = df['CUIT'].astype(str)
+        Los hilos que necesitan un driver esperan a que termine; el lock del pool se toma solo para
+        publicar el resultado, así liberar o descartar drivers no espera el arranque de Chrome.
+        """
+        if self.prepared:
+            return
+        with self._prepare_lock:
+            if self.prepared:
+                return
+            
+            driver_path = self.config["chromedriver_path"]
+            chrome_binary = self.config["chrome_binary"]
+            if not driver_path:
+                try:
+                    rutas = SeleniumManager().binary_paths(["--browser", "chrome"])
+                    driver_path = rutas.get("driver_path")
+                    chrome_binary = chrome_binary or rutas.get("browser_path")
+                except Exception as e:
+                    print(f"No se pudo resolver chromedriver de antemano: {str(e)}")
+            
+            # Perfil plantilla: se crea una vez (primer arranque de Chrome) y cada driver usa una copia
+            plantilla = self.config["profile_template"] or os.path.join(tempfile.gettempdir(), "mis_ret_chrome_profile")
+            if not os.path.isdir(plantilla):
+                temporal = tempfile.mkdtemp(prefix="mis_ret_template_")
+                try:
+                    with trace_span("profile_template"):
+                        setup_driver(None, driver_path, chrome_binary, temporal).quit()
+                    os.replace(temporal, plantilla)
+                except Exception as e:
+                    print(f"No se pudo crear el perfil plantilla: {str(e)}")
+                    shutil.rmtree(temporal, ignore_errors=True)
+            
+            with self._lock:
+                self.driver_path = driver_path
+                self.chrome_binary = chrome_binary
+                self.template = plantilla if os.path.isdir(plantilla) else None
+                self.prepared = True
+    
+    def _launch(self):
+        """Iniciar un driver nuevo con una copia del perfil plantilla"""
+        self._prepare()
+        perfil = None
+        if self.template:
+            perfil = tempfile.mkdtemp(prefix="mis_ret_profile_")
+            shutil.copytree(self.template, perfil, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns("Singleton*", "lockfile", "*Cache*"))
+        try:
+            with trace_span("driver_startup", pooled=True):
+                driver = instrument_driver(setup_driver(None, self.driver_path, self.chrome_binary, perfil))
+        except Exception:
+            if perfil:
+                shutil.rmtree(perfil, ignore_errors=True)
+            raise
+        driver.profile_dir = perfil
+        driver.jobs_done = 0
+        with self._lock:
+            self.drivers.add(driver)
+        return driver
+    
+    def _launch_idle(self):
+        try:
+            driver = self._launch()
+            if self.closed:
+                # El pool se cerró mientras el driver iniciaba
+                self.discard(driver)
+            else:
+                self.idle.put(driver)
+        except Exception as e:
+            print(f"No se pudo iniciar un driver de repuesto: {str(e)}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+    
+    def warm(self, cantidad):
+        """Iniciar drivers en segundo plano para que estén listos cuando se pidan"""
+        if not self.config["enabled"]:
+            return
+        with self._lock:
+            self.pending += cantidad
+        for _ in range(cantidad):
+            threading.Thread(target=self._launch_idle, daemon=True).start()
+    
+    def acquire(self, download_path):
+        """Obtener un driver listo para usar (del pool si hay uno disponible)"""
+        with trace_span("driver_acquire") as span:
+            if not self.config["enabled"]:
+                span["attrs"]["source"] = "new"
+                with trace_span("driver_startup"):
+                    driver = instrument_driver(setup_driver(download_path))
+                driver.jobs_done = 0
+                return driver
+            
+            driver = None
+            while driver is None:
+                with self._lock:
+                    pendientes = self.pending
+                try:
+                    # Si hay drivers iniciándose conviene esperarlos antes que lanzar otro
+                    driver = self.idle.get(block=pendientes > 0, timeout=0.2)
+                    span["attrs"]["source"] = "pool"
+                except queue.Empty:
+                    if pendientes:
+                        continue
+                    driver = self._launch()
+                    span["attrs"]["source"] = "new"
+                try:
+                    driver.current_url
+                except Exception:
+                    # El driver dejó de responder mientras esperaba: se reemplaza
+                    self.discard(driver)
+                    driver = None
+            
+            # Mantener repuestos listos para el próximo pedido
+            with self._lock:
+                faltantes = self.config["spares"] - self.idle.qsize() - self.pending
+            if faltantes > 0:
+                self.warm(faltantes)
+            
+            set_download_dir(driver, download_path)
+            return driver
+    
+    def release(self, driver):
+        """Devolver un driver al pool, limpio para el próximo trabajo"""
+        if not self.config["enabled"]:
+            driver.quit()
+            return
+        try:
+            reset_driver(driver)
+            self.idle.put(driver)
+        except Exception as e:
+            print(f"No se pudo limpiar el navegador, se descarta: {str(e)}")
+            self.discard(driver)
+    
+    def replace(self, driver, download_path):
+        """Descartar un driver que quedó inutilizable y obtener otro listo"""
+        self.discard(driver)
+        return self.acquire(download_path)
+    
+    def count_job(self, driver):
+        """Sumar una consulta terminada al driver"""
+        driver.jobs_done = getattr(driver, "jobs_done", 0) + 1
+    
+    def recycle_reason(self, driver):
+        """Medir la memoria del driver y decidir si hay que reciclarlo ("jobs", "rss" o None)"""
+        with trace_span("driver_memory") as span:
+            rss = driver_rss_mb(driver)
+            trabajos = getattr(driver, "jobs_done", 0)
+            span["attrs"].update(driver=driver.session_id[:8], rss_mb=rss, jobs=trabajos)
+        with self._lock:
+            self.memory.append((_now(), driver.session_id[:8], trabajos, rss))
+            avisar = rss is None and self.config["recycle_max_rss_mb"] and not self.rss_warned
+            if avisar:
+                self.rss_warned = True
+        if avisar:
+            # Se avisa una sola vez por corrida: sin medición el límite de memoria no se aplica
+            motivo = ("instale psutil para medirla en este sistema" if not _rss_measurable()
+                      else "no se pudo medir la memoria del driver")
+            print(f"Aviso: reciclado por memoria (recycle_max_rss_mb) desactivado: {motivo}. "
+                  f"Los drivers se reciclan solo por cantidad de consultas.")
         
-        return df[['CUIT', 'Clave']].values.tolist()
+        if self.config["recycle_max_jobs"] and trabajos >= self.config["recycle_max_jobs"]:
+            return "jobs"
+        if self.config["recycle_max_rss_mb"] and rss is not None and rss >= self.config["recycle_max_rss_mb"]:
+            return "rss"
+        return None
+    
+    def recycle(self, driver, download_path, reason):
+        """Reemplazar un driver sano pero gastado por uno nuevo (o uno de repuesto ya iniciado)"""
+        with trace_span("driver_recycle", reason=reason, jobs=getattr(driver, "jobs_done", 0)):
+            with self._lock:
+                self.recycled[reason] = self.recycled.get(reason, 0) + 1
+            return self.replace(driver, download_path)
+    
+    def summary(self):
+        """Reciclados por motivo y memoria medida (MB) entre CUIT"""
+        with self._lock:
+            medidas = sorted(rss for _, _, _, rss in self.memory if rss is not None)
+            return {
+                "reciclados": dict(self.recycled),
+                "mediciones": len(self.memory),
+                "rss_p50_mb": _percentile(medidas, 50),
+                "rss_max_mb": medidas[-1] if medidas else None,
+            }
+    
+    def discard(self, driver):
+        """Cerrar un driver y borrar su copia del perfil"""
+        with self._lock:
+            self.drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        if getattr(driver, "profile_dir", None):
+            shutil.rmtree(driver.profile_dir, ignore_errors=True)
+    
+    def close(self):
+        """Cerrar todos los drivers del pool"""
+        self.closed = True
+        with self._lock:
+            drivers = list(self.drivers)
+        for driver in drivers:
+            self.discard(driver)
+        self.idle = queue.Queue()
+
+# Pool de drivers activo (ver set_driver_pool)
+DRIVER_POOL = DriverPool()
+
+def set_driver_pool(overrides=None):
+    """Configurar el pool de drivers que usarán todos los workers"""
+    DRIVER_POOL.configure(**(overrides or {}))
+
+def cuit_check_digit(base):
+    """Dígito verificador (módulo 11) de los primeros 10 dígitos de un CUIT; None si no existe"""
+    resto = 11 - sum(int(digito) * peso for digito, peso in zip(base, CUIT_WEIGHTS)) % 11
+    if resto == 10:
+        return None
+    return 0 if resto == 11 else resto
+
+def normalize_cuit(valor):
+    """Llevar un CUIT a 11 dígitos sin separadores; None si el formato o el dígito verificador no son válidos"""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    # Una celda numérica leída como texto llega como "20123456789.0"
+    texto = re.sub(r"\.0+$", "", str(valor if valor is not None else "").strip())
+    texto = re.sub(r"[\s./-]", "", texto)
+    if not re.fullmatch(r"\d{11}", texto):
+        return None
+    if cuit_check_digit(texto[:10]) != int(texto[10]):
+        return None
+    return texto
+
+def _credential_columns(encabezado):
+    """Posiciones de las columnas CUIT y Clave en un encabezado (sin distinguir mayúsculas)"""
+    nombres = [str(nombre or "").strip().lower() for nombre in encabezado]
+    if "cuit" not in nombres or "clave" not in nombres:
+        raise ValueError("el origen de credenciales debe tener las columnas 'CUIT' y 'Clave'")
+    return nombres.index("cuit"), nombres.index("clave")
+
+def iter_credentials_xlsx(path):
+    """Filas (CUIT, clave) de un Excel, leídas de a una con openpyxl en modo solo lectura"""
+    from openpyxl import load_workbook
+    libro = load_workbook(path, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        columna_cuit, columna_clave = _credential_columns(next(filas, ()))
+        for fila in filas:
+            if fila and max(columna_cuit, columna_clave) < len(fila):
+                yield fila[columna_cuit], fila[columna_clave]
+    finally:
+        libro.close()
+
+def iter_credentials_csv(path):
+    """Filas (CUIT, clave) de un CSV (separador detectado automáticamente)"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t|")
+        except csv.Error:
+            dialecto = csv.excel
+        filas = csv.reader(f, dialecto)
+        columna_cuit, columna_clave = _credential_columns(next(filas, ()))
+        for fila in filas:
+            if max(columna_cuit, columna_clave) < len(fila):
+                yield fila[columna_cuit], fila[columna_clave]
+
+def iter_credentials_jsonl(path):
+    """Filas (CUIT, clave) de un archivo JSON-lines con objetos {"cuit": ..., "clave": ...}"""
+    with open(path, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                registro = {clave.lower(): valor for clave, valor in json.loads(linea).items()}
+                yield registro.get("cuit"), registro.get("clave")
+
+def _iter_credential_lines(texto):
+    """Filas (CUIT, clave) de un texto con una credencial por línea: "CUIT:clave" (también con , ; o tab)"""
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if linea and not linea.startswith("#"):
+            partes = re.split(r"[:,;\t]", linea, maxsplit=1)
+            yield partes[0].strip(), partes[1].strip() if len(partes) > 1 else None
+
+def iter_credentials_env(variable):
+    """Filas (CUIT, clave) de una variable de entorno con una credencial por línea"""
+    yield from _iter_credential_lines(os.environ.get(variable, ""))
+
+def iter_credentials_secret(path):
+    """Filas (CUIT, clave) de un archivo de secretos con una credencial por línea"""
+    with open(path, encoding="utf-8") as f:
+        yield from _iter_credential_lines(f.read())
+
+# Backends de credenciales: por prefijo ("env:VARIABLE", "secret:ruta") o por extensión del archivo
+CREDENTIAL_SOURCES = {
+    "xlsx": iter_credentials_xlsx,
+    "xlsm": iter_credentials_xlsx,
+    "csv": iter_credentials_csv,
+    "jsonl": iter_credentials_jsonl,
+    "env": iter_credentials_env,
+    "secret": iter_credentials_secret,
+}
+
+def open_credential_source(source):
+    """Elegir el backend de credenciales según el prefijo ("env:", "secret:", ...) o la extensión"""
+    prefijo, separador, resto = source.partition(":")
+    if separador and prefijo.lower() in CREDENTIAL_SOURCES:
+        return CREDENTIAL_SOURCES[prefijo.lower()](resto)
+    extension = os.path.splitext(source)[1].lower().lstrip(".")
+    if extension not in CREDENTIAL_SOURCES:
+        raise ValueError(f"origen de credenciales no soportado: {source}")
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"no se encontró el archivo {source}")
+    return CREDENTIAL_SOURCES[extension](source)
+
+def read_credentials(source):
+    """Leer credenciales (Excel, CSV, JSON-lines, variable de entorno o archivo de secretos)
+    
+    Los CUIT se normalizan y validan, y los repetidos se descartan antes de abrir cualquier navegador.
+    """
+    credenciales = {}
+    try:
+        for numero, (cuit, clave) in enumerate(open_credential_source(source), start=1):
+            normalizado = normalize_cuit(cuit)
+            clave = "" if clave is None else str(clave)
+            if not normalizado:
+                print(f"Fila {numero}: CUIT inválido ({cuit}). Se ignora.")
+            elif not clave:
+                print(f"Fila {numero}: el CUIT {normalizado} no tiene clave. Se ignora.")
+            elif normalizado in credenciales:
+                if credenciales[normalizado] != clave:
+                    print(f"Fila {numero}: el CUIT {normalizado} está repetido con otra clave. Se usa la primera.")
+            else:
+                credenciales[normalizado] = clave
     except Exception as e:
-        print(f"Error al leer el archivo Excel: {str(e)}")
+        print(f"Error al leer las credenciales: {str(e)}")
         return []
+    return list(credenciales.items())
 
 def type_like_human(element, text):
     """Simular escritura humana tecla por tecla con pausas aleatorias"""
+    # Sin pausas entre teclas no tiene sentido enviar carácter por carácter
+    if PACING["keystroke"][1] <= 0:
+        element.send_keys(text)
+        return
+    
     for char in text:
-        # Pausa aleatoria entre 0.1 y 0.3 segundos entre cada tecla
-        time.sleep(random.uniform(0.1, 0.3))
+        # Pausa aleatoria entre cada tecla
+        pause("keystroke")
         element.send_keys(char)
         # Pausa adicional aleatoria ocasional para simular pensamiento
         if random.random() < 0.2:  # 20% de probabilidad
-            time.sleep(random.uniform(0.2, 0.5))
+            pause("think")
 
 def login_afip(driver, cuit, clave, wait):
     """Realizar el login en AFIP simulando comportamiento humano"""
     try:
         # Ingresar CUIT
-        cuit_input = wait.until(EC.element_to_be_clickable((By.ID, "F1:username")))
+        cuit_input = wait.until(EC.element_to_be_clickable((By.ID, "F1:username")), key="login:username")
         cuit_input.clear()
         # Escribir CUIT tecla por tecla
         type_like_human(cuit_input, cuit)
         
         # Pequeña pausa antes de hacer clic en el botón
-        time.sleep(random.uniform(0.5, 1.0))
+        pause("before_next")
         
         # Click en botón siguiente
-        next_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnSiguiente")))
+        next_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnSiguiente")), key="login:siguiente")
         next_button.click()
         
-        # Esperar a que aparezca el campo de contraseña
-        time.sleep(random.uniform(1.5, 2.5))
+        # Esperar a que aparezca el campo de contraseña (la espera del elemento es la condición)
+        pause("before_password")
         
         # Ingresar Clave
-        clave_input = wait.until(EC.element_to_be_clickable((By.ID, "F1:password")))
+        clave_input = wait.until(EC.element_to_be_clickable((By.ID, "F1:password")), key="login:password")
         clave_input.clear()
         # Escribir clave tecla por tecla
         type_like_human(clave_input, clave)
         
         # Pequeña pausa antes de hacer clic en el botón de login
-        time.sleep(random.uniform(0.7, 1.2))
+        pause("before_login")
         
         # Click en botón de login
-        login_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnIngresar")))
+        login_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnIngresar")), key="login:ingresar")
         login_button.click()
         
         # Esperar a que cargue la página después del login
-        time.sleep(random.uniform(4.0, 6.0))
+        wait_page_ready(driver, wait, login_button)
+        pause("after_login")
         return True
     except Exception as e:
         print(f"Error en el login: {str(e)}")
         return False
 
+# Scripts que resuelven en una sola llamada lo que antes eran varios comandos WebDriver
+_AUTH_ERROR_SCRIPT = """
+var texto = document.body ? document.body.textContent : '';
+return texto.indexOf('HTTP Status 401') >= 0 && texto.indexOf('AUTHENTICATION_ALREADY_PRESENT') >= 0;
+"""
+
+_SELECT_OPTION_SCRIPT = """
+var select = arguments[0], buscado = arguments[1];
+select.focus();
+for (var i = 0; i < select.options.length; i++) {
+    if (select.options[i].text.indexOf(buscado) >= 0) {
+        select.selectedIndex = i;
+        select.dispatchEvent(new Event('input', {bubbles: true}));
+        select.dispatchEvent(new Event('change', {bubbles: true}));
+        return select.options[i].text;
+    }
+}
+return null;
+"""
+
+_FILL_INPUTS_SCRIPT = """
+var campos = arguments[0], completados = 0;
+for (var i = 0; i < campos.length; i++) {
+    var input = document.evaluate(campos[i][0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!input) continue;
+    input.focus();
+    input.value = campos[i][1];
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+    input.dispatchEvent(new Event('change', {bubbles: true}));
+    input.blur();
+    completados++;
+}
+return completados;
+"""
+
+# Función JS común a los scripts de página: primer elemento que coincide con un XPath (o null)
+_POR_XPATH_JS = """
+var porXpath = function(xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+};
+"""
+
+# Script que lee lo que tiene cargado el formulario (opciones elegidas y fechas) en una sola llamada
+_FORM_STATE_SCRIPT = _POR_XPATH_JS + """
+var texto = function(select) {
+    var opcion = select && select.options[select.selectedIndex];
+    return opcion ? opcion.text : null;
+};
+var desde = porXpath(arguments[0]), hasta = porXpath(arguments[1]);
+return {
+    cuit: texto(document.getElementById('cuitRetenido')),
+    impuesto: texto(document.getElementById('impuestos')),
+    desde: desde ? desde.value : null,
+    hasta: hasta ? hasta.value : null
+};
+"""
+
+def read_form_state(driver):
+    """Opciones elegidas y fechas del formulario de Mis Retenciones (None si no se pudo leer)"""
+    try:
+        return driver.execute_script(_FORM_STATE_SCRIPT, FECHA_DESDE_XPATH, FECHA_HASTA_XPATH)
+    except Exception:
+        return None
+
+def select_option_js(driver, select_element, texto):
+    """Elegir la primera opción cuyo texto contenga el buscado, en un solo comando; devuelve su texto"""
+    return driver.execute_script(_SELECT_OPTION_SCRIPT, select_element, texto)
+
+def fill_inputs_js(driver, valores):
+    """Completar varios campos (lista de (xpath, valor)) en un solo comando; devuelve cuántos completó"""
+    return driver.execute_script(_FILL_INPUTS_SCRIPT, [list(par) for par in valores])
+
+def instrument_driver(driver):
+    """Contar los comandos WebDriver (cada uno es un pedido HTTP a chromedriver)"""
+    execute = driver.execute
+    driver.command_count = 0
+    
+    def counted_execute(driver_command, params=None):
+        driver.command_count += 1
+        return execute(driver_command, params)
+    
+    driver.execute = counted_execute
+    return driver
+
 def check_authentication_error(driver):
     """Verificar si hay un error de autenticación en la página"""
     try:
-        # Verificar si hay un mensaje de error de autenticación
-        error_text = driver.find_element(By.TAG_NAME, "body").text
-        if "HTTP Status 401" in error_text and "AUTHENTICATION_ALREADY_PRESENT" in error_text:
+        # Verificar si hay un mensaje de error de autenticación (se busca en el navegador,
+        # sin traer el texto de toda la página)
+        if driver.execute_script(_AUTH_ERROR_SCRIPT):
             print("Detectado error de autenticación: HTTP Status 401 - AUTHENTICATION_ALREADY_PRESENT")
             return True
         return False
@@ -134,132 +1388,252 @@ def check_authentication_error(driver):
 def navigate_to_mis_retenciones(driver, wait, cuit, max_attempts=3):
     """Navegar a Mis Retenciones usando el buscador con reintentos"""
     for attempt in range(1, max_attempts + 1):
-        try:
-            print(f"Navegando a Mis Retenciones para CUIT: {cuit} (Intento {attempt}/{max_attempts})")
+        # Espera creciente entre intentos para no insistir mientras el portal rechaza sesiones
+        if attempt > 1:
+            RATE_LIMITER.backoff(attempt - 1)
+        with trace_span("navigate_attempt", driver, attempt=attempt) as span, RATE_LIMITER.slot() as operacion:
+            try:
+                print(f"Navegando a Mis Retenciones para CUIT: {cuit} (Intento {attempt}/{max_attempts})")
             
-            # Esperar a que la página principal cargue completamente
-            time.sleep(random.uniform(3.0, 5.0))
+                # Esperar a que la página principal cargue completamente
+                wait_page_ready(driver, wait)
+                pause("portal_ready")
             
-            # Buscar el campo de búsqueda
-            print("Buscando el campo de búsqueda...")
-            search_input = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='buscadorInput']")))
+                # Buscar el campo de búsqueda
+                print("Buscando el campo de búsqueda...")
+                search_input = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='buscadorInput']")), key="navigate:buscador")
             
-            # Mover el mouse al elemento antes de hacer clic
-            actions = ActionChains(driver)
-            actions.move_to_element(search_input).pause(random.uniform(0.5, 1.0)).perform()
-            search_input.click()
-            time.sleep(random.uniform(1.0, 2.0))
+                # Mover el mouse al elemento antes de hacer clic
+                hover(driver, search_input)
+                search_input.click()
+                pause("search_click")
             
-            # Limpiar el campo de búsqueda
-            search_input.clear()
+                # Limpiar el campo de búsqueda
+                search_input.clear()
             
-            # Escribir "MIS RETENCIONES" tecla por tecla
-            print("Escribiendo 'MIS RETENCIONES' en el buscador...")
-            type_like_human(search_input, "MIS RETENCIONES")
-            time.sleep(random.uniform(2.0, 3.0))
+                # Escribir "MIS RETENCIONES" tecla por tecla
+                print("Escribiendo 'MIS RETENCIONES' en el buscador...")
+                type_like_human(search_input, "MIS RETENCIONES")
+                pause("search_results")
             
-            # Esperar a que aparezcan los resultados de búsqueda
-            print("Esperando resultados de búsqueda...")
+                # Esperar a que aparezcan los resultados de búsqueda
+                print("Esperando resultados de búsqueda...")
             
-            # Buscar y hacer clic en el resultado de "MIS RETENCIONES"
-            try:
-                # Intentar encontrar el resultado específico
-                result_item = wait.until(EC.element_to_be_clickable(
-                    (By.XPATH, "//*[@id='rbt-menu-item-0']/a/div/div/div[1]/div/p")))
+                # Buscar y hacer clic en el resultado de "MIS RETENCIONES"
+                try:
+                    # Intentar encontrar el resultado específico
+                    result_item = wait.until(EC.element_to_be_clickable(
+                        (By.XPATH, "//*[@id='rbt-menu-item-0']/a/div/div/div[1]/div/p")), key="navigate:resultado")
                 
-                # Verificar que el texto del resultado sea "Mis Retenciones"
-                if "Mis Retenciones" in result_item.text:
-                    print(f"Resultado encontrado: {result_item.text}")
+                    # Verificar que el texto del resultado sea "Mis Retenciones"
+                    if "Mis Retenciones" in result_item.text:
+                        print(f"Resultado encontrado: {result_item.text}")
                     
-                    # Mover el mouse al elemento antes de hacer clic
-                    actions = ActionChains(driver)
-                    actions.move_to_element(result_item).pause(random.uniform(0.5, 1.0)).perform()
-                    result_item.click()
-                    time.sleep(random.uniform(4.0, 6.0))
+                        # Mover el mouse al elemento antes de hacer clic
+                        hover(driver, result_item)
+                        tabs_before = len(driver.window_handles)
+                        result_item.click()
+                        wait_new_tab(driver, wait, tabs_before)
+                        pause("open_tab")
                     
-                    # Cambiar a la nueva pestaña que se abre
-                    print("Cambiando a la nueva pestaña...")
-                    if len(driver.window_handles) > 1:
-                        driver.switch_to.window(driver.window_handles[-1])
-                        time.sleep(random.uniform(2.0, 3.0))
+                        # Cambiar a la nueva pestaña que se abre
+                        print("Cambiando a la nueva pestaña...")
+                        if len(driver.window_handles) > 1:
+                            driver.switch_to.window(driver.window_handles[-1])
+                            apply_resource_blocking(driver)
+                            wait_page_ready(driver, wait)
+                            pause("switch_tab")
                         
-                        # Verificar si hay error de autenticación
-                        if check_authentication_error(driver):
-                            print("Cerrando pestaña con error y reintentando...")
-                            driver.close()
-                            driver.switch_to.window(driver.window_handles[0])
-                            time.sleep(random.uniform(2.0, 3.0))
-                            continue  # Reintentar
+                            # Verificar si hay error de autenticación
+                            if check_authentication_error(driver):
+                                print("Cerrando pestaña con error y reintentando...")
+                                span["status"] = "auth_error"
+                                operacion["signal"] = "auth_error"
+                                record_event("retry", "navigate")
+                                driver.close()
+                                driver.switch_to.window(driver.window_handles[0])
+                                pause("switch_tab")
+                                continue  # Reintentar
                         
-                        return True
+                            return True
+                        else:
+                            print("No se abrió una nueva pestaña para Mis Retenciones")
+                            return False
                     else:
-                        print("No se abrió una nueva pestaña para Mis Retenciones")
+                        print(f"El resultado no coincide con 'Mis Retenciones': {result_item.text}")
                         return False
-                else:
-                    print(f"El resultado no coincide con 'Mis Retenciones': {result_item.text}")
-                    return False
                     
-            except TimeoutException:
-                print("No se encontró el resultado específico. Buscando alternativas...")
+                except TimeoutException:
+                    print("No se encontró el resultado específico. Buscando alternativas...")
                 
-                # Intentar encontrar cualquier resultado que contenga "Mis Retenciones"
-                try:
-                    # Buscar todos los resultados
-                    results = driver.find_elements(By.XPATH, "//p[contains(text(), 'Mis Retenciones')]")
+                    # Intentar encontrar cualquier resultado que contenga "Mis Retenciones"
+                    try:
+                        # Buscar todos los resultados
+                        results = driver.find_elements(By.XPATH, "//p[contains(text(), 'Mis Retenciones')]")
                     
-                    if results:
-                        # Hacer clic en el primer resultado que contenga "Mis Retenciones"
-                        for result in results:
-                            if "Mis Retenciones" in result.text and "Reclamos" not in result.text:
-                                print(f"Resultado alternativo encontrado: {result.text}")
+                        if results:
+                            # Hacer clic en el primer resultado que contenga "Mis Retenciones"
+                            for result in results:
+                                if "Mis Retenciones" in result.text and "Reclamos" not in result.text:
+                                    print(f"Resultado alternativo encontrado: {result.text}")
                                 
-                                # Mover el mouse al elemento antes de hacer clic
-                                actions = ActionChains(driver)
-                                actions.move_to_element(result).pause(random.uniform(0.5, 1.0)).perform()
-                                result.click()
-                                time.sleep(random.uniform(4.0, 6.0))
+                                    # Mover el mouse al elemento antes de hacer clic
+                                    hover(driver, result)
+                                    tabs_before = len(driver.window_handles)
+                                    result.click()
+                                    wait_new_tab(driver, wait, tabs_before)
+                                    pause("open_tab")
                                 
-                                # Cambiar a la nueva pestaña que se abre
-                                print("Cambiando a la nueva pestaña...")
-                                if len(driver.window_handles) > 1:
-                                    driver.switch_to.window(driver.window_handles[-1])
-                                    time.sleep(random.uniform(2.0, 3.0))
+                                    # Cambiar a la nueva pestaña que se abre
+                                    print("Cambiando a la nueva pestaña...")
+                                    if len(driver.window_handles) > 1:
+                                        driver.switch_to.window(driver.window_handles[-1])
+                                        apply_resource_blocking(driver)
+                                        wait_page_ready(driver, wait)
+                                        pause("switch_tab")
                                     
-                                    # Verificar si hay error de autenticación
-                                    if check_authentication_error(driver):
-                                        print("Cerrando pestaña con error y reintentando...")
-                                        driver.close()
-                                        driver.switch_to.window(driver.window_handles[0])
-                                        time.sleep(random.uniform(2.0, 3.0))
-                                        continue  # Reintentar
+                                        # Verificar si hay error de autenticación
+                                        if check_authentication_error(driver):
+                                            print("Cerrando pestaña con error y reintentando...")
+                                            span["status"] = "auth_error"
+                                            operacion["signal"] = "auth_error"
+                                            record_event("retry", "navigate")
+                                            driver.close()
+                                            driver.switch_to.window(driver.window_handles[0])
+                                            pause("switch_tab")
+                                            continue  # Reintentar
                                     
-                                    return True
-                                else:
-                                    print("No se abrió una nueva pestaña para Mis Retenciones")
-                                    return False
+                                        return True
+                                    else:
+                                        print("No se abrió una nueva pestaña para Mis Retenciones")
+                                        return False
                         
-                        print("No se encontró ningún resultado que coincida exactamente con 'Mis Retenciones'")
-                        return False
-                    else:
-                        print("No se encontraron resultados para 'Mis Retenciones'")
-                        return False
+                            print("No se encontró ningún resultado que coincida exactamente con 'Mis Retenciones'")
+                            return False
+                        else:
+                            print("No se encontraron resultados para 'Mis Retenciones'")
+                            return False
                         
-                except Exception as e:
-                    print(f"Error al buscar resultados alternativos: {str(e)}")
-                    return False
+                    except Exception as e:
+                        print(f"Error al buscar resultados alternativos: {str(e)}")
+                        return False
             
-        except Exception as e:
-            print(f"Error al navegar a Mis Retenciones (Intento {attempt}): {str(e)}")
+            except Exception as e:
+                print(f"Error al navegar a Mis Retenciones (Intento {attempt}): {str(e)}")
+                span["status"] = "error"
+                operacion["signal"] = "timeout" if isinstance(e, TimeoutException) else "error"
+                record_event("retry", "navigate")
             
-            # Si hay pestañas abiertas, cerrarlas y volver a la principal
-            if len(driver.window_handles) > 1:
-                driver.close()
-                driver.switch_to.window(driver.window_handles[0])
-                time.sleep(random.uniform(2.0, 3.0))
+                # Si hay pestañas abiertas, cerrarlas y volver a la principal
+                if len(driver.window_handles) > 1:
+                    driver.close()
+                    driver.switch_to.window(driver.window_handles[0])
+                    pause("switch_tab")
     
     print(f"No se pudo navegar a Mis Retenciones después de {max_attempts} intentos")
     return False
 
+def period_key(start_date):
+    """Obtener el período (aaaamm) de una fecha en formato ddmmaaaa"""
+    return start_date[4:8] + start_date[2:4]
+
+def parse_period(periodo):
+    """Validar un período aaaamm y devolver (año, mes); ValueError si no tiene ese formato"""
+    periodo = str(periodo).strip()
+    if len(periodo) != 6 or not periodo.isdigit() or not 1 <= int(periodo[4:6]) <= 12:
+        raise ValueError(f"Período inválido: '{periodo}' (se espera aaaamm, por ejemplo 202401)")
+    return int(periodo[:4]), int(periodo[4:6])
+
+def get_period_ranges(desde, hasta, months_per_query=1):
+    """Dividir un rango de períodos (aaaamm) en consultas de hasta N meses con fechas ddmmaaaa
+    
+    Devuelve una lista de (fecha_desde, fecha_hasta, período); el período de una consulta de
+    varios meses es "aaaamm-aaaamm". Los meses futuros se descartan (el rango termina hoy).
+    ValueError si algún período no tiene formato aaaamm.
+    """
+    año, mes = parse_period(desde)
+    fin = parse_period(hasta)
+    hoy = datetime.now()
+    
+    rangos = []
+    while (año, mes) <= fin:
+        primer_dia = datetime(año, mes, 1)
+        # El portal no acepta fechas futuras: no se generan consultas de meses que no empezaron
+        if primer_dia > hoy:
+            break
+        
+        # Avanzar hasta N-1 meses más sin pasar del final del rango
+        for _ in range(months_per_query - 1):
+            if (año, mes) == fin:
+                break
+            año, mes = (año + 1, 1) if mes == 12 else (año, mes + 1)
+        
+        año_siguiente, mes_siguiente = (año + 1, 1) if mes == 12 else (año, mes + 1)
+        ultimo_dia = datetime(año_siguiente, mes_siguiente, 1) - timedelta(days=1)
+        # El portal no acepta fechas futuras: el mes en curso se consulta hasta hoy
+        ultimo_dia = min(ultimo_dia, datetime(hoy.year, hoy.month, hoy.day))
+        
+        start_date = primer_dia.strftime("%d%m%Y")
+        end_date = ultimo_dia.strftime("%d%m%Y")
+        periodo = period_key(start_date)
+        if period_key(end_date) != periodo:
+            periodo = f"{periodo}-{period_key(end_date)}"
+        rangos.append((start_date, end_date, periodo))
+        
+        año, mes = año_siguiente, mes_siguiente
+    
+    return rangos
+
+def build_job_matrix(spec, cuits, codigos_retencion, months_per_query=1):
+    """Armar la matriz de trabajos (CUIT x códigos x períodos) a partir de la especificación "jobs"
+    
+    Cada entrada puede indicar "cuits", "codigos", "desde" y "hasta" (aaaamm); lo que falta toma el
+    valor general (todos los CUIT, codigos_retencion, el rango de la corrida). Devuelve un dict
+    CUIT -> lista de (códigos, períodos o None); None si no hay especificación.
+    """
+    if not spec:
+        return None
+    matriz = {}
+    for entrada in spec:
+        codigos = [str(codigo) for codigo in entrada.get("codigos") or codigos_retencion]
+        periodos = None
+        if entrada.get("desde"):
+            periodos = get_period_ranges(str(entrada["desde"]), str(entrada.get("hasta") or entrada["desde"]),
+                                         months_per_query)
+        destino = cuits
+        if entrada.get("cuits"):
+            destino = [normalize_cuit(cuit) for cuit in entrada["cuits"]]
+            ajenos = [str(original) for original, cuit in zip(entrada["cuits"], destino) if cuit not in cuits]
+            if ajenos:
+                print(f"La especificación de trabajos incluye CUIT sin credenciales: {', '.join(ajenos)}")
+        for cuit in destino:
+            if cuit in cuits:
+                matriz.setdefault(cuit, []).append((codigos, periodos))
+    return matriz
+
+def order_jobs(trabajos):
+    """Ordenar las consultas de un CUIT para que cambie un solo campo del formulario entre una y otra
+    
+    Se agrupan por rango de fechas (en orden cronológico) y, dentro de cada rango, cada grupo
+    empieza por el código con el que terminó el anterior: así al cambiar de período solo cambian
+    las fechas y dentro del período solo cambia el impuesto. Se descartan los repetidos.
+    """
+    por_rango = {}
+    for start_date, end_date, periodo, codigo in trabajos:
+        codigos = por_rango.setdefault((start_date, end_date, periodo), [])
+        if codigo not in codigos:
+            codigos.append(codigo)
+    
+    ordenados, anterior = [], None
+    for rango in sorted(por_rango, key=lambda r: (datetime.strptime(r[0], "%d%m%Y"), datetime.strptime(r[1], "%d%m%Y"))):
+        codigos = sorted(por_rango[rango])
+        if anterior in codigos:
+            codigos.remove(anterior)
+            codigos.insert(0, anterior)
+        ordenados.extend(rango + (codigo,) for codigo in codigos)
+        anterior = codigos[-1]
+    return ordenados
+
 def get_previous_month_dates():
     """Obtener el rango de fechas del mes anterior en formato ddmmaaaa"""
     today = datetime.now()
@@ -273,236 +1647,886 @@ def get_previous_month_dates():
     
     return start_date, end_date
 
-def consultar_retenciones(driver, wait, cuit, codigo_retencion, download_path):
-    """Consultar retenciones para un código específico"""
-    try:
-        print(f"Consultando retenciones para CUIT: {cuit}, Código: {codigo_retencion}")
-        
-        # 1. Seleccionar CUIT del retenido
-        print("Seleccionando CUIT del retenido...")
-        cuit_retenido_select = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='cuitRetenido']")))
-        
-        # Mover el mouse al elemento antes de hacer clic
-        actions = ActionChains(driver)
-        actions.move_to_element(cuit_retenido_select).pause(random.uniform(0.5, 1.0)).perform()
-        cuit_retenido_select.click()
-        time.sleep(random.uniform(1.0, 2.0))
-        
-        # Seleccionar el CUIT del dropdown (debe coincidir con el CUIT de la base de datos)
-        select = Select(cuit_retenido_select)
-        
-        # Buscar la opción que contiene el CUIT
-        found = False
-        for option in select.options:
-            if cuit in option.text:
-                select.select_by_visible_text(option.text)
-                found = True
-                break
-        
-        if not found:
-            print(f"No se encontró el CUIT {cuit} en las opciones disponibles")
-            return False
-        
-        time.sleep(random.uniform(1.0, 2.0))
-        
-        # 2. Seleccionar impuesto retenido
-        print(f"Seleccionando impuesto retenido: {codigo_retencion}...")
-        impuesto_select = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='impuestos']")))
-        
-        # Mover el mouse al elemento antes de hacer clic
-        actions = ActionChains(driver)
-        actions.move_to_element(impuesto_select).pause(random.uniform(0.5, 1.0)).perform()
-        impuesto_select.click()
-        time.sleep(random.uniform(1.0, 2.0))
-        
-        # Seleccionar el código de impuesto
-        select = Select(impuesto_select)
-        
-        # Buscar la opción que contiene el código de impuesto
-        found = False
-        for option in select.options:
-            if f"{codigo_retencion} -" in option.text:
-                select.select_by_visible_text(option.text)
-                found = True
-                break
-        
-        if not found:
-            print(f"No se encontró el código de impuesto {codigo_retencion} en las opciones disponibles")
-            return False
-        
-        time.sleep(random.uniform(1.0, 2.0))
-        
-        # 3. Completar fechas (mes anterior) en formato ddmmaaaa
-        start_date, end_date = get_previous_month_dates()
+def set_download_dir(driver, path):
+    """Redirigir las descargas del navegador a la carpeta indicada"""
+    driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+        "behavior": "allow",
+        "downloadPath": os.path.abspath(path),
+        "eventsEnabled": True
+    })
+
+def wait_for_download(job_dir, timeout=None, poll_interval=None):
+    """Esperar a que termine la descarga en la carpeta del trabajo y devolver la ruta del archivo"""
+    if timeout is None:
+        timeout = TIMEOUTS["download"]
+    if poll_interval is None:
+        poll_interval = TIMEOUTS["download_poll"]
+    limite = time.monotonic() + timeout
+    
+    while time.monotonic() < limite:
+        archivos = os.listdir(job_dir)
         
-        # Fecha desde
-        print(f"Completando fecha desde: {start_date}...")
-        fecha_desde = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/form/table[2]/tbody/tr[8]/td[2]/input[1]")))
-        fecha_desde.clear()
-        type_like_human(fecha_desde, start_date)
-        time.sleep(random.uniform(1.0, 2.0))
-        
-        # Fecha hasta
-        print(f"Completando fecha hasta: {end_date}...")
-        fecha_hasta = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/form/table[2]/tbody/tr[8]/td[2]/input[2]")))
-        fecha_hasta.clear()
-        type_like_human(fecha_hasta, end_date)
-        time.sleep(random.uniform(1.0, 2.0))
+        # Chrome descarga a un archivo temporal (.crdownload) y lo renombra al terminar,
+        # así que el archivo final solo aparece cuando la descarga está completa
+        en_curso = [f for f in archivos if f.endswith(PARTIAL_DOWNLOAD_SUFFIXES)]
+        terminados = [f for f in archivos if not f.endswith(PARTIAL_DOWNLOAD_SUFFIXES) and not f.startswith('.')]
         
-        # 4. Hacer clic en consultar
-        print("Haciendo clic en 'Consultar'...")
-        consultar_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/form/table[2]/tbody/tr[13]/td/input")))
+        if terminados and not en_curso:
+            return os.path.join(job_dir, terminados[0])
+        
+        time.sleep(poll_interval)
+    
+    return None
+
+def wait_for_download_start(job_dir, timeout=None, poll_interval=None):
+    """Esperar a que Chrome cree el archivo de la descarga (en curso o terminado) en la carpeta del trabajo"""
+    if timeout is None:
+        timeout = TIMEOUTS["download"]
+    if poll_interval is None:
+        poll_interval = TIMEOUTS["download_poll"]
+    limite = time.monotonic() + timeout
+    
+    while time.monotonic() < limite:
+        if any(not f.startswith('.') for f in os.listdir(job_dir)):
+            return True
+        time.sleep(poll_interval)
+    
+    return False
+
+def _hash_key(path):
+    estado = os.stat(path)
+    return os.path.abspath(path), estado.st_size, estado.st_mtime_ns
+
+def file_sha256(path):
+    """SHA-256 del contenido de un archivo (se recuerda mientras el archivo no cambie)"""
+    clave = _hash_key(path)
+    with _HASH_CACHE_LOCK:
+        if clave in _HASH_CACHE:
+            return _HASH_CACHE[clave]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            digest.update(bloque)
+    with _HASH_CACHE_LOCK:
+        _HASH_CACHE[clave] = digest.hexdigest()
+    return _HASH_CACHE[clave]
+
+def _remember_hash(path, digest):
+    with _HASH_CACHE_LOCK:
+        _HASH_CACHE[_hash_key(path)] = digest
+
+def export_path(output_path, cuit, codigo_retencion, periodo, extension):
+    """Ruta final de un archivo exportado: <salida>/<período>/<CUIT>/<CUIT>_MisRetenciones_<código>_<período>"""
+    return os.path.join(output_path, str(periodo), str(cuit),
+                        f"{cuit}_MisRetenciones_{codigo_retencion}_{periodo}{extension}")
+
+def store_export(origen, output_path, cuit, codigo_retencion, periodo, extension):
+    """Dejar un archivo exportado en su lugar definitivo sin copiarlo
+    
+    origen es la ruta del archivo descargado (se mueve con os.replace, que es atómico) o su
+    contenido en bytes (se escribe en un temporal de la misma carpeta y se mueve). Si el destino ya
+    tiene el mismo contenido, no se reescribe. Devuelve (ruta, sha256, cambió).
+    """
+    destino = export_path(output_path, cuit, codigo_retencion, periodo, extension)
+    carpeta = os.path.dirname(destino)
+    os.makedirs(carpeta, exist_ok=True)
+    
+    if isinstance(origen, bytes):
+        digest = hashlib.sha256(origen).hexdigest()
+    else:
+        digest = file_sha256(origen)
+    
+    # Misma descarga que la anterior: se conserva el archivo existente tal cual
+    if os.path.exists(destino) and file_sha256(destino) == digest:
+        if not isinstance(origen, bytes):
+            os.remove(origen)
+        print(f"Sin cambios respecto de la descarga anterior: {os.path.basename(destino)}")
+        return destino, digest, False
+    
+    if isinstance(origen, bytes):
+        descriptor, temporal = tempfile.mkstemp(prefix=".", suffix=".part", dir=carpeta)
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(origen)
+        os.replace(temporal, destino)
+    else:
+        try:
+            os.replace(origen, destino)
+        except OSError:
+            # Otra unidad: se copia a un temporal junto al destino y se reemplaza de una vez,
+            # así nunca queda un archivo a medio copiar con el nombre final
+            descriptor, temporal = tempfile.mkstemp(prefix=".", suffix=".part", dir=carpeta)
+            os.close(descriptor)
+            shutil.copyfile(origen, temporal)
+            os.replace(temporal, destino)
+            os.remove(origen)
+    _remember_hash(destino, digest)
+    print(f"Archivo guardado como: {os.path.relpath(destino, output_path)}")
+    return destino, digest, True
+
+# Script asíncrono que pide la exportación con fetch (con las cookies de la sesión) y devuelve el
+# contenido en base64, sin pasar por el administrador de descargas de Chrome
+_CAPTURE_EXPORT_SCRIPT = """
+var enlace = arguments[0], tipos = new RegExp(arguments[1], 'i'), listo = arguments[arguments.length - 1];
+var href = enlace.href, atributo = (enlace.getAttribute('href') || '').trim();
+// Enlaces que no apuntan a la exportación (href="#" o javascript: con la acción en onclick, como en JSF)
+if (!href || !/^https?:/i.test(href) || !atributo || atributo.charAt(0) === '#' || enlace.hasAttribute('onclick')) {
+    listo(null);
+    return;
+}
+fetch(href, {credentials: 'include'}).then(function(respuesta) {
+    if (!respuesta.ok) { listo({error: 'HTTP ' + respuesta.status}); return; }
+    var disposicion = respuesta.headers.get('Content-Disposition') || '';
+    var tipo = respuesta.headers.get('Content-Type') || '';
+    // Una página HTML (los resultados otra vez, el login) no es la exportación: se descarga como siempre
+    if (!/^\\s*attachment/i.test(disposicion) && !tipos.test(tipo)) { listo(null); return; }
+    return respuesta.arrayBuffer().then(function(buffer) {
+        var bytes = new Uint8Array(buffer), partes = [];
+        for (var i = 0; i < bytes.length; i += 0x8000) {
+            partes.push(String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000)));
+        }
+        listo({data: btoa(partes.join('')), disposition: disposicion});
+    });
+}).catch(function(e) { listo({error: String(e)}); });
+"""
+
+def capture_export(driver, exportar_link):
+    """Traer la exportación en memoria desde la página de resultados
+    
+    Devuelve (contenido, extensión) o None si el enlace no es una URL (por ejemplo, un
+    javascript: o "#" con onclick), la respuesta falla o no es un archivo (ver
+    is_export_response); en ese caso se descarga como siempre.
+    """
+    driver.set_script_timeout(TIMEOUTS["download"])
+    resultado = driver.execute_async_script(_CAPTURE_EXPORT_SCRIPT, exportar_link, EXPORT_CONTENT_TYPE_PATTERN)
+    if not resultado:
+        return None
+    if resultado.get("error"):
+        print(f"No se pudo capturar la exportación: {resultado['error']}")
+        return None
+    contenido = base64.b64decode(resultado["data"])
+    if not contenido:
+        return None
+    nombre = re.search(r"filename\*?=(?:UTF-8'')?[\"']?([^\"';]+)", resultado["disposition"], re.IGNORECASE)
+    extension = os.path.splitext(nombre.group(1))[1] if nombre else ""
+    return contenido, export_extension(contenido, extension or ".xls")
+
+# Script asíncrono que lee la tabla de resultados y, si hay paginado, trae las páginas siguientes
+# con fetch (con las cookies de la sesión) sin salir de la página actual
+_EXTRACT_TABLE_SCRIPT = """
+var xpath = arguments[0], maxPaginas = arguments[1], callback = arguments[arguments.length - 1];
+var celdas = function(fila) {
+    return Array.prototype.map.call(fila.cells, function(c) { return c.textContent.replace(/\\s+/g, ' ').trim(); });
+};
+var valida = function(t) {
+    return t && t.rows && t.rows.length > 1 && t.rows[0].cells.length > 1 && !t.querySelector('table');
+};
+var tabla = function(doc) {
+    var t = doc.evaluate(xpath, doc, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (valida(t)) return t;
+    var mejor = null;
+    Array.prototype.forEach.call(doc.querySelectorAll('table'), function(c) {
+        if (valida(c) && c.querySelector('th') && (!mejor || c.rows.length > mejor.rows.length)) mejor = c;
+    });
+    return mejor;
+};
+var siguiente = function(doc, base) {
+    var enlaces = doc.querySelectorAll('a[href]');
+    for (var i = 0; i < enlaces.length; i++) {
+        var texto = (enlaces[i].textContent || '').trim();
+        if (/^(siguiente|pr[oó]xima|next|>|>>|»|›)$/i.test(texto) || /siguiente/i.test(enlaces[i].title || '')) {
+            return new URL(enlaces[i].getAttribute('href'), base).href;
+        }
+    }
+    return null;
+};
+var resultado = {headers: null, rows: [], pages: 0};
+var extraer = function(doc) {
+    var t = tabla(doc);
+    if (!t) return false;
+    var filas = Array.prototype.slice.call(t.rows);
+    if (!resultado.headers) resultado.headers = celdas(filas[0]);
+    filas.slice(1).forEach(function(f) {
+        var valores = celdas(f);
+        if (valores.some(function(v) { return v; })) resultado.rows.push(valores);
+    });
+    resultado.pages += 1;
+    return true;
+};
+if (!extraer(document)) { callback(null); return; }
+var vistas = {};
+vistas[location.href] = true;
+var seguir = function(url) {
+    if (!url || vistas[url] || resultado.pages >= maxPaginas) { callback(resultado); return; }
+    vistas[url] = true;
+    fetch(url, {credentials: 'include'}).then(function(r) { return r.text(); }).then(function(html) {
+        var doc = new DOMParser().parseFromString(html, 'text/html');
+        if (!extraer(doc)) { resultado.error = 'página sin tabla: ' + url; callback(resultado); return; }
+        seguir(siguiente(doc, url));
+    }).catch(function(e) { resultado.error = String(e); callback(resultado); });
+};
+seguir(siguiente(document, location.href));
+"""
+
+def extract_result_records(driver):
+    """Leer la tabla de resultados (todas sus páginas) en una sola llamada y devolver registros con tipos"""
+    driver.set_script_timeout(TIMEOUTS["download"])
+    resultado = driver.execute_async_script(_EXTRACT_TABLE_SCRIPT, RESULTADOS_XPATH, EXTRACTION["max_pages"])
+    if not resultado or not resultado.get("rows"):
+        return None
+    if resultado.get("error"):
+        print(f"No se pudieron leer todas las páginas de resultados: {resultado['error']}")
+        return None
+    print(f"Tabla de resultados leída: {len(resultado['rows'])} filas en {resultado['pages']} páginas")
+    return parse_result_records(resultado["headers"], resultado["rows"])
+
+def _parse_date(valor):
+    for formato in ("%d/%m/%Y", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            pass
+    return None
+
+def _parse_float(valor):
+    try:
+        return float(_parse_amount(valor))
+    except (TypeError, ValueError):
+        return None
+
+def parse_result_records(encabezado, filas):
+    """Convertir las filas de la tabla en registros (columnas normalizadas, fechas e importes con tipo)"""
+    columnas = [_normalize_column(nombre) or f"columna_{i + 1}" for i, nombre in enumerate(encabezado)]
+    registros = []
+    for fila in filas:
+        registro = {}
+        for columna, valor in zip(columnas, fila):
+            if columna.startswith("fecha"):
+                registro[columna] = _parse_date(valor)
+            elif any(clave in columna for clave in DATASET_AMOUNT_COLUMNS):
+                registro[columna] = _parse_float(valor)
+            else:
+                registro[columna] = valor
+        registros.append(registro)
+    return registros
+
+def records_to_csv(registros):
+    """CSV (fechas ISO, importes con punto decimal) con los registros de una consulta"""
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=list(registros[0]), extrasaction="ignore")
+    writer.writeheader()
+    for registro in registros:
+        writer.writerow({clave: "" if valor is None else valor for clave, valor in registro.items()})
+    return salida.getvalue().encode("utf-8")
+
+def consultar_retenciones(driver, wait, cuit, codigo_retencion, download_path, output_path=None,
+                          start_date=None, end_date=None, periodo=None, defer=False, impuesto=None):
+    """Consultar retenciones para un código específico
+    
+    Devuelve (estado, archivo): JOB_DONE con la ruta del archivo exportado, JOB_EMPTY si el
+    portal no tiene datos para la consulta o JOB_FAILED si no se pudo completar. Sin fechas se
+    consulta el mes anterior. El archivo queda en <salida>/<período>/<CUIT>/ (ver store_export).
+    
+    Con defer, apenas empieza la descarga se vuelve al formulario y se devuelve (JOB_RUNNING,
+    carpeta de la descarga), o (JOB_RUNNING, (contenido, extensión)) si se capturó en memoria,
+    para que el postproceso la termine (ver PostProcessor). impuesto es el texto de la opción a
+    elegir (por defecto "<código> -").
+    """
+    impuesto = impuesto or f"{codigo_retencion} -"
+    # Si no se indica otra carpeta, el archivo queda junto a las descargas
+    if output_path is None:
+        output_path = download_path
+    
+    # Cada fase (formulario, consulta, exportación, descarga, regreso) se mide como un span
+    fase = None
+    
+    try:
+        print(f"Consultando retenciones para CUIT: {cuit}, Código: {codigo_retencion}")
+        fase = start_span("form_fill", driver)
+        
+        # Estado actual del formulario en un solo comando: solo se cambian los campos que difieren
+        # de la consulta anterior (el CUIT y las fechas suelen quedar completos al volver)
+        if start_date is None or end_date is None:
+            start_date, end_date = get_previous_month_dates()
+        periodo = periodo or period_key(start_date)
+        cuit_retenido_select = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='cuitRetenido']")), key="form:cuit")
+        formulario = read_form_state(driver) or {}
+        
+        # 1. Seleccionar CUIT del retenido
+        if cuit in (formulario.get("cuit") or ""):
+            print("CUIT del retenido ya seleccionado.")
+        else:
+            print("Seleccionando CUIT del retenido...")
+            
+            # Mover el mouse al elemento (el script de selección le da el foco; un clic
+            # abriría la lista nativa, que la selección por script no cierra)
+            hover(driver, cuit_retenido_select)
+            pause("select")
+            
+            # Seleccionar el CUIT del dropdown (debe coincidir con el CUIT de la base de datos);
+            # la búsqueda y la selección se hacen en el navegador, en un solo comando
+            if select_option_js(driver, cuit_retenido_select, cuit) is None:
+                print(f"No se encontró el CUIT {cuit} en las opciones disponibles")
+                end_span(fase, "failed")
+                return JOB_FAILED, None
+            
+            pause("select")
+        
+        # 2. Seleccionar impuesto retenido
+        if impuesto in (formulario.get("impuesto") or ""):
+            print(f"Impuesto retenido {codigo_retencion} ya seleccionado.")
+        else:
+            print(f"Seleccionando impuesto retenido: {codigo_retencion}...")
+            impuesto_select = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='impuestos']")), key="form:impuesto")
+            
+            # Mover el mouse al elemento (el script de selección le da el foco; un clic
+            # abriría la lista nativa, que la selección por script no cierra)
+            hover(driver, impuesto_select)
+            pause("select")
+            
+            # Seleccionar la opción que contiene el código de impuesto
+            if select_option_js(driver, impuesto_select, impuesto) is None:
+                print(f"No se encontró el código de impuesto {codigo_retencion} en las opciones disponibles")
+                end_span(fase, "failed")
+                return JOB_FAILED, None
+            
+            pause("select")
+        
+        # 3. Completar fechas (por defecto, mes anterior) en formato ddmmaaaa; el campo puede
+        # mostrarlas con barras, así que se comparan solo los dígitos
+        desde_ok = re.sub(r"\D", "", formulario.get("desde") or "") == start_date
+        hasta_ok = re.sub(r"\D", "", formulario.get("hasta") or "") == end_date
+        if desde_ok and hasta_ok:
+            print(f"Fechas ya completas: {start_date} a {end_date}.")
+        elif PACING["keystroke"][1] <= 0:
+            # Sin escritura humana: las fechas se completan en un solo comando
+            print(f"Completando fechas: {start_date} a {end_date}...")
+            wait.until(EC.element_to_be_clickable((By.XPATH, FECHA_HASTA_XPATH)), key="form:fechas")
+            fill_inputs_js(driver, [
+                (xpath, datetime.strptime(fecha, "%d%m%Y").strftime(FORM_DATE_FORMAT))
+                for xpath, fecha, completa in ((FECHA_DESDE_XPATH, start_date, desde_ok),
+                                               (FECHA_HASTA_XPATH, end_date, hasta_ok))
+                if not completa
+            ])
+        else:
+            # Fecha desde
+            if not desde_ok:
+                print(f"Completando fecha desde: {start_date}...")
+                fecha_desde = wait.until(EC.element_to_be_clickable(
+                    (By.XPATH, FECHA_DESDE_XPATH)), key="form:fechas")
+                fecha_desde.clear()
+                type_like_human(fecha_desde, start_date)
+                pause("date")
+            
+            # Fecha hasta
+            if not hasta_ok:
+                print(f"Completando fecha hasta: {end_date}...")
+                fecha_hasta = wait.until(EC.element_to_be_clickable(
+                    (By.XPATH, FECHA_HASTA_XPATH)), key="form:fechas")
+                fecha_hasta.clear()
+                type_like_human(fecha_hasta, end_date)
+                pause("date")
+        
+        end_span(fase)
+        
+        # 4. Hacer clic en consultar
+        fase = start_span("query", driver)
+        print("Haciendo clic en 'Consultar'...")
+        consultar_button = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, CONSULTAR_XPATH)), key="form:consultar")
         
         # Mover el mouse al elemento antes de hacer clic
-        actions = ActionChains(driver)
-        actions.move_to_element(consultar_button).pause(random.uniform(0.5, 1.0)).perform()
+        hover(driver, consultar_button)
         consultar_button.click()
-        time.sleep(random.uniform(4.0, 6.0))
+        wait_page_ready(driver, wait, consultar_button)
+        pause("submit")
         
-        # 5. Verificar si hay un mensaje de "No se han encontrado datos"
+        # 5. Esperar a la vez la página sin datos (botón VOLVER) y la de resultados (exportar):
+        # gana la que aparece primero, sin agotar la espera de una antes de mirar la otra
         try:
-            # Intentar encontrar el botón "VOLVER" que aparece cuando no hay resultados
-            volver_button = WebDriverWait(driver, 3).until(EC.element_to_be_clickable(
-                (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/table[2]/tbody/tr[2]/td/input")))
-            
+            pagina, boton = wait.until(first_of(
+                sin_datos=EC.element_to_be_clickable((By.XPATH, VOLVER_XPATH)),
+                resultados=EC.element_to_be_clickable((By.XPATH, EXPORTAR_XPATH)),
+            ), key="query:resultado")
+        except TimeoutException:
+            pagina, boton = None, None
+        
+        if pagina == "sin_datos":
+            volver_button = boton
             print(f"No se encontraron retenciones para el código {codigo_retencion}. Haciendo clic en 'VOLVER'...")
             
             # Mover el mouse al botón VOLVER antes de hacer clic
-            actions = ActionChains(driver)
-            actions.move_to_element(volver_button).pause(random.uniform(0.5, 1.0)).perform()
+            hover(driver, volver_button)
             volver_button.click()
-            time.sleep(random.uniform(2.0, 3.0))
+            wait_page_ready(driver, wait, volver_button)
+            pause("volver")
+            end_span(fase, "empty")
             
-            return False
-        except TimeoutException:
-            # No se encontró el botón VOLVER, lo que significa que probablemente hay resultados
-            pass
+            return JOB_EMPTY, None
         
         # 6. Verificar si hay resultados (botón de exportar a Excel)
         try:
-            # Intentar encontrar el botón de exportar a Excel
-            exportar_button = wait.until(EC.element_to_be_clickable(
-                (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/table[3]/tbody/tr/td[2]/table/tbody/tr/td[8]/a")))
+            if pagina != "resultados":
+                raise TimeoutException("No apareció la página de resultados ni la de sin datos")
+            exportar_button = boton
+            
+            # Si llegamos aquí, hay resultados. En modo "table" se leen directo de la página
+            # (sin exportar ni descargar); si la tabla no se puede leer, se exporta igual.
+            if EXTRACTION["mode"] == "table":
+                end_span(fase)
+                fase = start_span("extract", driver)
+                registros = extract_result_records(driver)
+                if registros:
+                    new_path, _, _ = store_export(records_to_csv(registros), output_path, cuit, codigo_retencion,
+                                                  periodo, ".csv")
+                    end_span(fase, rows=len(registros))
+                    
+                    print("Volviendo a la página anterior...")
+                    fase = start_span("back", driver)
+                    driver.back()
+                    wait_page_ready(driver, wait)
+                    pause("back")
+                    end_span(fase)
+                    
+                    return JOB_DONE, new_path
+                print("No se pudo leer la tabla de resultados. Se exporta el archivo...")
+                end_span(fase, "fallback")
+                fase = None
+            
+            # En modo "capture" la exportación se trae en memoria: sin carpeta de descarga ni archivos
+            # temporales; si no se puede, se descarga igual
+            if EXTRACTION["mode"] == "capture":
+                end_span(fase)
+                fase = start_span("capture", driver)
+                capturado = capture_export(driver, exportar_button)
+                if capturado:
+                    contenido, extension = capturado
+                    end_span(fase, bytes=len(contenido))
+                    if defer:
+                        resultado = (JOB_RUNNING, (contenido, extension))
+                    else:
+                        new_path, _, _ = store_export(contenido, output_path, cuit, codigo_retencion, periodo,
+                                                      extension)
+                        resultado = (JOB_DONE, new_path)
+                    
+                    print("Volviendo a la página anterior...")
+                    fase = start_span("back", driver)
+                    driver.back()
+                    wait_page_ready(driver, wait)
+                    pause("back")
+                    end_span(fase)
+                    
+                    return resultado
+                print("No se pudo capturar la exportación en memoria. Se descarga el archivo...")
+                end_span(fase, "fallback")
+                fase = None
             
-            # Si llegamos aquí, hay resultados
             print("Resultados encontrados. Exportando a Excel...")
+            end_span(fase)
+            fase = start_span("export", driver)
             
-            # Obtener la lista de archivos antes de la descarga
-            files_before = set(os.listdir(download_path))
+            # Carpeta exclusiva para esta descarga: solo puede aparecer el archivo exportado
+            job_dir = tempfile.mkdtemp(prefix=f"_job_{cuit}_{codigo_retencion}_", dir=download_path)
+            set_download_dir(driver, job_dir)
             
             # Mover el mouse al elemento antes de hacer clic
-            actions = ActionChains(driver)
-            actions.move_to_element(exportar_button).pause(random.uniform(0.5, 1.0)).perform()
+            hover(driver, exportar_button)
             exportar_button.click()
+            end_span(fase)
             
-            # Esperar a que se descargue el archivo (tiempo más largo)
-            print("Esperando a que se complete la descarga...")
-            time.sleep(random.uniform(8.0, 12.0))  # Aumentar el tiempo de espera
-            
-            # Verificar que se haya descargado el archivo
-            files_after = set(os.listdir(download_path))
-            new_files = list(files_after - files_before)
+            if defer:
+                # Solo se espera a que la descarga empiece: volver atrás antes cancelaría la navegación
+                fase = start_span("download_start")
+                iniciada = wait_for_download_start(job_dir)
+                end_span(fase, "ok" if iniciada else "timeout")
+                if iniciada:
+                    print("Descarga en curso: se valida y se guarda en segundo plano.")
+                    print("Volviendo a la página anterior...")
+                    fase = start_span("back", driver)
+                    driver.back()
+                    wait_page_ready(driver, wait)
+                    pause("back")
+                    end_span(fase)
+                    
+                    return JOB_RUNNING, job_dir
+                file_path = None
+            else:
+                # Esperar a que Chrome termine la descarga (sin tiempo fijo, con tiempo máximo)
+                print("Esperando a que se complete la descarga...")
+                fase = start_span("download")
+                file_path = wait_for_download(job_dir)
+                end_span(fase, "ok" if file_path else "timeout")
             
-            if new_files:
-                # Renombrar el archivo descargado
-                for file in new_files:
-                    file_path = os.path.join(download_path, file)
+            try:
+                if file_path:
+                    file = os.path.basename(file_path)
                     
-                    # Verificar que el archivo sea un Excel válido antes de renombrarlo
+                    # Verificar que el archivo sea un Excel válido antes de moverlo
                     if file.endswith('.xls') or file.endswith('.xlsx') or file.endswith('.csv'):
-                        # Esperar a que el archivo esté completamente descargado
-                        time.sleep(2.0)
-                        
-                        # Comprobar que el archivo no esté bloqueado y sea accesible
                         try:
-                            # Intentar abrir el archivo para verificar que esté completo
-                            with open(file_path, 'rb') as f:
-                                # Solo leer algunos bytes para verificar acceso
-                                f.read(10)
-                                
-                            # Crear el nuevo nombre de archivo
-                            new_filename = f"{cuit}_MisRetenciones_{codigo_retencion}{os.path.splitext(file)[1]}"
-                            new_path = os.path.join(download_path, new_filename)
-                            
-                            # Si ya existe un archivo con ese nombre, eliminarlo
-                            if os.path.exists(new_path):
-                                os.remove(new_path)
-                            
-                            # Copiar el archivo en lugar de renombrarlo
-                            shutil.copy2(file_path, new_path)
-                            print(f"Archivo copiado como: {new_filename}")
-                            
-                            # Eliminar el archivo original después de copiarlo
-                            try:
-                                os.remove(file_path)
-                                print(f"Archivo original eliminado: {file}")
-                            except Exception as e:
-                                print(f"No se pudo eliminar el archivo original: {str(e)}")
+                            # Mover el archivo a su lugar definitivo (sin copiarlo; si no cambió, no se reescribe)
+                            new_path, _, _ = store_export(file_path, output_path, cuit, codigo_retencion, periodo,
+                                                          os.path.splitext(file)[1])
                             
                             # Usar el botón "Atrás" del navegador para volver a la página anterior
                             print("Volviendo a la página anterior...")
+                            fase = start_span("back", driver)
                             driver.back()
-                            time.sleep(random.uniform(3.0, 5.0))
+                            wait_page_ready(driver, wait)
+                            pause("back")
+                            end_span(fase)
                             
-                            return True
+                            return JOB_DONE, new_path
                         except Exception as e:
                             print(f"Error al procesar el archivo descargado: {str(e)}")
-                            # Continuar con el siguiente archivo si hay más de uno
                     
-                print("No se pudo procesar correctamente el archivo Excel descargado")
-                
-                # Usar el botón "Atrás" del navegador para volver a la página anterior
-                print("Volviendo a la página anterior...")
-                driver.back()
-                time.sleep(random.uniform(3.0, 5.0))
-                
-                return False
-            else:
-                print("No se detectó ningún archivo descargado")
-                
-                # Usar el botón "Atrás" del navegador para volver a la página anterior
-                print("Volviendo a la página anterior...")
-                driver.back()
-                time.sleep(random.uniform(3.0, 5.0))
-                
-                return False
+                    print("No se pudo procesar correctamente el archivo Excel descargado")
+                else:
+                    print(f"No se detectó ningún archivo descargado en {TIMEOUTS['download']} segundos")
+            finally:
+                # La carpeta del trabajo es temporal: se elimina con lo que haya quedado
+                shutil.rmtree(job_dir, ignore_errors=True)
+            
+            # Usar el botón "Atrás" del navegador para volver a la página anterior
+            print("Volviendo a la página anterior...")
+            fase = start_span("back", driver)
+            driver.back()
+            wait_page_ready(driver, wait)
+            pause("back")
+            end_span(fase)
+            
+            return JOB_FAILED, None
             
         except TimeoutException:
             # No hay resultados o no se encontró el botón de exportar
             print(f"No se encontraron resultados para el código {codigo_retencion} o no se pudo encontrar el botón de exportar")
+            end_span(fase, "timeout")
+            fase = start_span("back", driver)
             
             # Intentar hacer clic en el botón VOLVER si está presente
             try:
-                volver_button = WebDriverWait(driver, 3).until(EC.element_to_be_clickable(
-                    (By.XPATH, "/html/body/table/tbody/tr/td/table/tbody/tr[2]/td/table/tbody/tr[2]/td[2]/table/tbody/tr/td/table[2]/tbody/tr[2]/td/input")))
+                volver_button = AdaptiveWait(driver, TIMEOUTS["short"]).until(EC.element_to_be_clickable(
+                    (By.XPATH, VOLVER_XPATH)), key="query:volver")
                 
                 print("Haciendo clic en 'VOLVER'...")
-                actions = ActionChains(driver)
-                actions.move_to_element(volver_button).pause(random.uniform(0.5, 1.0)).perform()
+                hover(driver, volver_button)
                 volver_button.click()
-                time.sleep(random.uniform(2.0, 3.0))
+                wait_page_ready(driver, wait, volver_button)
+                pause("volver")
             except:
                 # Si no hay botón VOLVER, usar el botón "Atrás" del navegador
                 print("Volviendo a la página anterior...")
                 driver.back()
-                time.sleep(random.uniform(3.0, 5.0))
+                wait_page_ready(driver, wait)
+                pause("back")
+            end_span(fase)
             
-            return False
+            return JOB_FAILED, None
         
     except Exception as e:
         print(f"Error al consultar retenciones: {str(e)}")
+        end_span(fase, "error")
         
-        # Intentar volver a la página anterior en caso de error
-        try:
-            driver.back()
-            time.sleep(random.uniform(3.0, 5.0))
-        except:
-            pass
-            
-        return False
+        # No se navega a ciegas: quien llama retoma desde el estado en que quedó la pestaña (recover_session)
+        return JOB_FAILED, None
+
+def export_records(path):
+    """Registros (como los de parse_result_records) de un archivo exportado"""
+    df = read_export_file(path)
+    for columna in df.columns:
+        if columna.startswith("fecha"):
+            df[columna] = df[columna].dt.date
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+def split_records_by_code(registros, codigos, columna=None):
+    """Separar los registros de una consulta combinada por código de impuesto (código -> registros)
+    
+    Los registros de otros códigos se descartan. ValueError si la columna no existe o algún valor
+    no empieza con un código (por ejemplo, solo la descripción del impuesto): en ese caso no se
+    puede saber a qué código corresponde y hay que consultar código por código.
+    """
+    columna = columna or MULTI_CODE["column"]
+    campo = next((nombre for nombre in (registros[0] if registros else {}) if columna in nombre), None)
+    if campo is None:
+        raise ValueError(f"el resultado no tiene la columna '{columna}' para separar por código")
+    separados = {codigo: [] for codigo in codigos}
+    por_texto = {str(codigo): codigo for codigo in codigos}
+    for registro in registros:
+        valor = str(registro.get(campo) or "").strip()
+        # "216" o "216 - IVA", pero no "2160"
+        encontrado = re.match(r"(\d+)(\D|$)", valor)
+        if not encontrado:
+            raise ValueError(f"valor de '{campo}' sin código de impuesto: '{valor}'")
+        if encontrado.group(1) in por_texto:
+            separados[por_texto[encontrado.group(1)]].append(registro)
+    return separados
+
+def consultar_retenciones_multi(driver, wait, cuit, codigos, download_path, output_path=None,
+                                start_date=None, end_date=None, periodo=None):
+    """Consultar todos los códigos de un período con una sola consulta y separar el resultado
+    
+    Devuelve {código: (estado, archivo)} con los mismos nombres de archivo que una consulta por
+    código (en CSV), o None si la consulta combinada no se pudo hacer (se consulta código por código).
+    """
+    if output_path is None:
+        output_path = download_path
+    # El resultado combinado se deja en una carpeta temporal: solo quedan los archivos por código
+    temporal = tempfile.mkdtemp(prefix=f"_multi_{cuit}_", dir=download_path)
+    try:
+        estado, archivo = consultar_retenciones(driver, wait, cuit, "todos", download_path, temporal,
+                                                start_date, end_date, periodo, impuesto=MULTI_CODE["option"])
+        if estado == JOB_EMPTY:
+            return {codigo: (JOB_EMPTY, None) for codigo in codigos}
+        if estado != JOB_DONE:
+            return None
+        
+        periodo = periodo or period_key(start_date or get_previous_month_dates()[0])
+        with trace_span("split", codigos=len(codigos)) as span:
+            registros = export_records(archivo)
+            separados = split_records_by_code(registros, codigos)
+            span["attrs"]["rows"] = len(registros)
+        if registros and not any(separados.values()):
+            # Ningún registro es de los códigos pedidos: por las dudas se consulta código por código
+            # antes que marcarlos a todos como vacíos
+            print("Ningún registro de la consulta combinada coincide con los códigos pedidos")
+            return None
+        
+        resultados = {}
+        for codigo, parte in separados.items():
+            if parte:
+                destino, _, _ = store_export(records_to_csv(parte), output_path, cuit, codigo, periodo, ".csv")
+                resultados[codigo] = (JOB_DONE, destino)
+            else:
+                resultados[codigo] = (JOB_EMPTY, None)
+        otros = len(registros) - sum(len(parte) for parte in separados.values())
+        if otros:
+            print(f"{otros} retenciones de otros impuestos en la consulta combinada (no se guardan)")
+        return resultados
+    except Exception as e:
+        print(f"Error al separar la consulta combinada: {str(e)}")
+        return None
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+# Script que lee el estado del formulario de Mis Retenciones en una sola llamada
+_READ_FORM_SCRIPT = _POR_XPATH_JS + """
+var cuitSelect = document.getElementById('cuitRetenido');
+var impuestoSelect = document.getElementById('impuestos');
+if (!cuitSelect || !impuestoSelect || !cuitSelect.form) {
+    return null;
+}
+var form = cuitSelect.form;
+var campos = [];
+for (var i = 0; i < form.elements.length; i++) {
+    var el = form.elements[i];
+    var tipo = (el.type || '').toLowerCase();
+    if (!el.name || el.disabled) continue;
+    if (['submit', 'button', 'image', 'reset', 'file'].indexOf(tipo) >= 0) continue;
+    if ((tipo === 'checkbox' || tipo === 'radio') && !el.checked) continue;
+    campos.push([el.name, el.value]);
+}
+var opciones = function(select) {
+    return Array.prototype.map.call(select.options, function(o) { return [o.value, o.text]; });
+};
+var nombre = function(el) { return el ? el.name : null; };
+var boton = porXpath(arguments[2]);
+return {
+    action: form.action,
+    method: (form.method || 'post').toLowerCase(),
+    fields: campos,
+    cuit_field: cuitSelect.name,
+    cuit_options: opciones(cuitSelect),
+    impuesto_field: impuestoSelect.name,
+    impuesto_options: opciones(impuestoSelect),
+    desde_field: nombre(porXpath(arguments[0])),
+    hasta_field: nombre(porXpath(arguments[1])),
+    submit: boton && boton.name ? [boton.name, boton.value] : null,
+    user_agent: navigator.userAgent
+};
+"""
+
+class _ResultPageParser(HTMLParser):
+    """Extraer los enlaces y el botón VOLVER de la página de resultados"""
+    
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.volver = False
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "a" and attrs.get("href"):
+            self.links.append(attrs["href"])
+        elif tag == "input" and (attrs.get("value") or "").strip().upper() == "VOLVER":
+            self.volver = True
+
+def get_http_pool():
+    """Obtener el pool de conexiones HTTP compartido por todos los workers"""
+    global HTTP_POOL
+    with _HTTP_POOL_LOCK:
+        if HTTP_POOL is None:
+            HTTP_POOL = urllib3.PoolManager(num_pools=4, maxsize=HTTP_POOL_SIZE, block=False,
+                                            timeout=urllib3.Timeout(connect=10, read=TIMEOUTS["default"]),
+                                            retries=urllib3.Retry(total=2, backoff_factor=0.5, allowed_methods=None))
+    return HTTP_POOL
+
+def create_http_session(driver):
+    """Copiar la sesión autenticada del navegador (cookies y formulario) a un cliente HTTP"""
+    try:
+        form = driver.execute_script(_READ_FORM_SCRIPT, FECHA_DESDE_XPATH, FECHA_HASTA_XPATH, CONSULTAR_XPATH)
+        if not form:
+            print("No se encontró el formulario de Mis Retenciones para la consulta directa")
+            return None
+        
+        cookies = {cookie["name"]: cookie["value"] for cookie in driver.get_cookies()}
+        return {
+            "form": form,
+            "cookies": cookies,
+            "headers": {"User-Agent": form["user_agent"], "Referer": driver.current_url},
+        }
+    except Exception as e:
+        print(f"Error al copiar la sesión del navegador: {str(e)}")
+        return None
+
+def _http_request(sesion, method, url, fields=None):
+    """Hacer un pedido HTTP con las cookies de la sesión y actualizarlas con la respuesta
+    
+    El código de estado queda en sesion["last_status"] (None si el pedido no llegó a responder).
+    """
+    sesion["last_status"] = None
+    headers = dict(sesion["headers"])
+    if sesion["cookies"]:
+        headers["Cookie"] = "; ".join(f"{nombre}={valor}" for nombre, valor in sesion["cookies"].items())
+    
+    if fields is not None and method == "post":
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        response = get_http_pool().request("POST", url, body=urlencode(fields), headers=headers)
+    elif fields is not None:
+        response = get_http_pool().request("GET", f"{url}?{urlencode(fields)}", headers=headers)
+    else:
+        response = get_http_pool().request(method.upper(), url, headers=headers)
+    sesion["last_status"] = response.status
+    
+    # El portal puede renovar la cookie de sesión en cualquier respuesta
+    for set_cookie in response.headers.getlist("Set-Cookie"):
+        nombre, _, resto = set_cookie.partition("=")
+        sesion["cookies"][nombre.strip()] = resto.split(";", 1)[0]
+    
+    return response
+
+def http_signal(sesion, estado):
+    """Señal para el limitador según la última respuesta HTTP de la sesión y el resultado de la consulta
+    
+    401/403: sesión rechazada; 429, 503 y 504: el portal pide bajar el ritmo; otros 5xx, un pedido
+    sin respuesta o una consulta fallida: error.
+    """
+    status = sesion.get("last_status")
+    if status in (401, 403):
+        return "auth_error"
+    if status in (429, 503, 504):
+        return "timeout"
+    if status is None or status >= 500 or estado == JOB_FAILED:
+        return "error"
+    return "ok"
+
+def _decode_html(response):
+    """Decodificar una respuesta HTML con el charset que indique el servidor"""
+    match = re.search(r"charset=([\w-]+)", response.headers.get("Content-Type", ""))
+    return response.data.decode(match.group(1) if match else "latin-1", errors="replace")
+
+def _find_option(options, predicate):
+    """Buscar el valor de la primera opción cuyo texto cumpla la condición"""
+    for value, text in options:
+        if predicate(text):
+            return value
+    return None
+
+def is_export_response(content_type, disposition):
+    """Si los encabezados corresponden a un archivo exportado (adjunto, planilla o CSV)"""
+    if re.match(r"\s*attachment", disposition or "", re.IGNORECASE):
+        return True
+    return bool(re.search(EXPORT_CONTENT_TYPE_PATTERN, content_type or "", re.IGNORECASE))
+
+def consultar_retenciones_http(sesion, cuit, codigo_retencion, output_path, start_date=None, end_date=None,
+                               periodo=None):
+    """Consultar y exportar retenciones llamando directamente a los endpoints de Mis Retenciones
+    
+    Devuelve (estado, archivo) como consultar_retenciones, con estado None si la respuesta no
+    se pudo interpretar y conviene repetir la consulta con el navegador.
+    """
+    try:
+        form = sesion["form"]
+        print(f"Consultando retenciones (HTTP) para CUIT: {cuit}, Código: {codigo_retencion}")
+        
+        # Mismas reglas de selección que en el formulario: CUIT en el texto y "código -" en el impuesto
+        cuit_value = _find_option(form["cuit_options"], lambda text: cuit in text)
+        impuesto_value = _find_option(form["impuesto_options"], lambda text: f"{codigo_retencion} -" in text)
+        if cuit_value is None:
+            print(f"No se encontró el CUIT {cuit} en las opciones disponibles")
+            return JOB_FAILED, None
+        if impuesto_value is None:
+            print(f"No se encontró el código de impuesto {codigo_retencion} en las opciones disponibles")
+            return JOB_FAILED, None
+        
+        if start_date is None or end_date is None:
+            start_date, end_date = get_previous_month_dates()
+        periodo = periodo or period_key(start_date)
+        
+        # Las fechas se escriben como ddmmaaaa; el campo las muestra con barras
+        valores = {
+            form["cuit_field"]: cuit_value,
+            form["impuesto_field"]: impuesto_value,
+            form["desde_field"]: datetime.strptime(start_date, "%d%m%Y").strftime(FORM_DATE_FORMAT),
+            form["hasta_field"]: datetime.strptime(end_date, "%d%m%Y").strftime(FORM_DATE_FORMAT),
+        }
+        campos_form = dict(form["fields"])
+        fields = [(nombre, valores.get(nombre, valor)) for nombre, valor in form["fields"]]
+        fields += [(nombre, valor) for nombre, valor in valores.items() if nombre and nombre not in campos_form]
+        if form["submit"]:
+            fields.append(tuple(form["submit"]))
+        
+        # 1. Consulta
+        with trace_span("http_query"):
+            response = _http_request(sesion, form["method"], form["action"], fields)
+        if response.status != 200:
+            print(f"La consulta devolvió HTTP {response.status}")
+            return None, None
+        
+        parser = _ResultPageParser()
+        parser.feed(_decode_html(response))
+        
+        export_links = [href for href in parser.links if re.search(HTTP_EXPORT_LINK_PATTERN, href)]
+        if not export_links:
+            if parser.volver:
+                print(f"No se encontraron retenciones para el código {codigo_retencion}.")
+                return JOB_EMPTY, None
+            print("No se encontró el enlace de exportación en la respuesta")
+            return None, None
+        
+        # 2. Exportación
+        export_url = urljoin(form["action"], export_links[0])
+        with trace_span("http_export"):
+            response = _http_request(sesion, "get", export_url)
+        if response.status != 200 or not response.data:
+            print(f"La exportación devolvió HTTP {response.status}")
+            return None, None
+        
+        # Con la sesión vencida (o un error del portal) la redirección termina en una página HTML con
+        # estado 200: no es la exportación, se repite la consulta con el navegador
+        disposition = response.headers.get("Content-Disposition", "")
+        content_type = response.headers.get("Content-Type", "")
+        if not is_export_response(content_type, disposition):
+            print(f"La exportación no devolvió un archivo (Content-Type: {content_type or 'sin indicar'})")
+            return None, None
+        
+        # Misma extensión que el archivo que descargaría el navegador
+        match = re.search(r'filename="?([^";]+)"?', disposition)
+        extension = os.path.splitext(match.group(1))[1] if match else ".xls"
+        
+        new_path, _, _ = store_export(response.data, output_path, cuit, codigo_retencion, periodo, extension)
+        return JOB_DONE, new_path
+    except Exception as e:
+        print(f"Error al consultar retenciones por HTTP: {str(e)}")
+        return None, None
 
 def close_mis_retenciones_tab(driver):
     """Cerrar la pestaña de Mis Retenciones y volver a la pestaña principal"""
@@ -513,13 +2537,126 @@ def close_mis_retenciones_tab(driver):
         
         # Cambiar a la pestaña original (ARCA)
         driver.switch_to.window(driver.window_handles[0])
-        time.sleep(random.uniform(2.0, 3.0))
+        pause("switch_tab")
         
         return True
     except Exception as e:
         print(f"Error al cerrar la pestaña de Mis Retenciones: {str(e)}")
         return False
 
+def close_extra_tabs(driver):
+    """Cerrar todas las pestañas excepto la principal y volver a ella"""
+    while len(driver.window_handles) > 1:
+        driver.switch_to.window(driver.window_handles[-1])
+        driver.close()
+        pause("close_tab")
+    driver.switch_to.window(driver.window_handles[0])
+
+# Script que clasifica la página actual (formulario, resultados, error, portal o login) en una sola llamada
+_PAGE_STATE_SCRIPT = _POR_XPATH_JS + """
+if (document.getElementById('cuitRetenido') && document.getElementById('impuestos')) return 'form';
+if (porXpath(arguments[0]) || porXpath(arguments[1])) return 'results';
+var texto = document.body ? document.body.textContent : '';
+if (texto.indexOf('AUTHENTICATION_ALREADY_PRESENT') >= 0) return 'auth_error';
+if (document.getElementById('buscadorInput')) return 'portal';
+if (document.getElementById('F1:username') || document.getElementById('F1:password')) return 'login';
+return 'unknown';
+"""
+
+def detect_state(driver):
+    """Estado de la sesión según lo que muestra el navegador (la pestaña de Mis Retenciones, si está abierta)"""
+    try:
+        handles = driver.window_handles
+        try:
+            actual = driver.current_window_handle
+        except Exception:
+            actual = None
+        if len(handles) > 1 and actual != handles[-1]:
+            driver.switch_to.window(handles[-1])
+        elif actual not in handles:
+            driver.switch_to.window(handles[0])
+        pagina = driver.execute_script(_PAGE_STATE_SCRIPT, EXPORTAR_XPATH, VOLVER_XPATH)
+    except Exception:
+        return STATE_UNKNOWN
+    
+    if pagina == "form":
+        return STATE_FORM_READY
+    if pagina == "results":
+        return STATE_RESULTS
+    if pagina == "login":
+        return STATE_LOGGED_OUT
+    if len(handles) > 1:
+        # Pestaña de Mis Retenciones abierta pero sin formulario (401, error o carga incompleta)
+        return STATE_MIS_RET_OPEN
+    return STATE_LOGGED_IN if pagina == "portal" else STATE_UNKNOWN
+
+def recover_session(driver, wait, cuit, clave, objetivo=STATE_FORM_READY, reason="step"):
+    """Llevar la sesión al estado objetivo desde el estado válido más cercano
+    
+    En lugar de volver siempre al login, cada paso avanza o retrocede un estado (volver al
+    formulario, recargar o cerrar la pestaña, navegar, loguearse). Cada incidente se registra
+    como un span "recovery" con el estado de origen, el alcanzado y su duración.
+    """
+    estado = detect_state(driver)
+    if estado == objetivo:
+        return True
+    inicio = estado
+    span = start_span("recovery", driver, reason=reason, from_state=inicio, target=objetivo)
+    record_event("recovery", inicio)
+    
+    pasos = 0
+    intentos = {}
+    bajar_del_formulario = SESSION_STATES.index(objetivo) < SESSION_STATES.index(STATE_MIS_RET_OPEN)
+    while estado != objetivo and pasos < RECOVERY_MAX_STEPS:
+        pasos += 1
+        intentos[estado] = intentos.get(estado, 0) + 1
+        repetido = intentos[estado] > 1
+        try:
+            if estado in (STATE_MIS_RET_OPEN, STATE_FORM_READY, STATE_RESULTS) and bajar_del_formulario:
+                close_extra_tabs(driver)
+            elif estado == STATE_RESULTS:
+                # Volver al formulario: VOLVER si es la página sin datos, Atrás si son resultados
+                volver = driver.find_elements(By.XPATH, VOLVER_XPATH)
+                if volver and not repetido:
+                    volver[0].click()
+                else:
+                    driver.back()
+                wait_page_ready(driver, wait)
+            elif estado == STATE_MIS_RET_OPEN:
+                # Recargar la pestaña una vez (vuelve a pedir el formulario); si no alcanza, cerrarla
+                if repetido:
+                    close_extra_tabs(driver)
+                else:
+                    driver.refresh()
+                    wait_page_ready(driver, wait)
+            elif estado == STATE_LOGGED_IN:
+                if objetivo == STATE_LOGGED_OUT:
+                    if not logout_afip(driver, wait):
+                        reset_driver(driver)
+                        driver.get(LOGIN_URL)
+                elif repetido:
+                    break
+                else:
+                    navigate_to_mis_retenciones(driver, wait, cuit)
+            elif estado == STATE_LOGGED_OUT:
+                if repetido or clave is None:
+                    break
+                with RATE_LIMITER.slot() as operacion:
+                    operacion["signal"] = "ok" if login_afip(driver, cuit, clave, wait) else "error"
+            else:
+                # Página desconocida: puede estar cargando; si persiste, se vuelve al login
+                if repetido:
+                    close_extra_tabs(driver)
+                    driver.get(LOGIN_URL)
+                wait_page_ready(driver, wait)
+        except Exception as e:
+            print(f"Error al recuperar la sesión desde el estado {estado}: {str(e)}")
+        estado = detect_state(driver)
+    
+    registro = end_span(span, "ok" if estado == objetivo else "failed", to_state=estado, steps=pasos)
+    print(f"Recuperación ({reason}): {inicio} -> {estado} en {registro['duration_s']:.1f} s ({pasos} pasos)")
+    return estado == objetivo
+
 def logout_afip(driver, wait):
     """Cerrar sesión en AFIP/ARCA"""
     try:
@@ -528,23 +2665,22 @@ def logout_afip(driver, wait):
         
         # Hacer clic en el icono de usuario
         user_icon = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "//*[@id='userIconoChico']")))
+            (By.XPATH, "//*[@id='userIconoChico']")), key="logout:usuario")
         
         # Mover el mouse al icono de usuario antes de hacer clic
-        actions = ActionChains(driver)
-        actions.move_to_element(user_icon).pause(random.uniform(0.5, 1.0)).perform()
+        hover(driver, user_icon)
         user_icon.click()
-        time.sleep(random.uniform(1.0, 2.0))
+        pause("user_menu")
         
         # Hacer clic en el botón de cerrar sesión
         logout_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "//*[@id='contBtnContribuyente']/div[6]/button/div/div[2]")))
+            (By.XPATH, "//*[@id='contBtnContribuyente']/div[6]/button/div/div[2]")), key="logout:salir")
         
         # Mover el mouse al botón de cerrar sesión antes de hacer clic
-        actions = ActionChains(driver)
-        actions.move_to_element(logout_button).pause(random.uniform(0.5, 1.0)).perform()
+        hover(driver, logout_button)
         logout_button.click()
-        time.sleep(random.uniform(2.0, 3.0))
+        wait_page_ready(driver, wait, logout_button)
+        pause("logout")
         
         print("Sesión cerrada correctamente")
         return True
@@ -552,106 +2688,1406 @@ def logout_afip(driver, wait):
         print(f"Error al cerrar sesión: {str(e)}")
         return False
 
-def main():
-    """Función principal"""
-    # Configuración de rutas
-    excel_path = r"C:\Users\eze\Downloads\CREDENCIALES.xlsx"
-    download_path = r"C:\Users\eze\Downloads"
+def _now():
+    """Fecha y hora actual para los registros persistentes"""
+    return datetime.now().isoformat(timespec="seconds")
+
+class JobManifest:
+    """Manifiesto persistente (SQLite) con el estado de cada trabajo (CUIT, código, período)
     
-    # Códigos de retención a consultar
-    codigos_retencion = ["216", "767"]
+    Permite retomar una corrida interrumpida: los trabajos terminados (con o sin datos) se
+    saltean y solo se reintentan los pendientes o fallidos. Es seguro entre workers. Cada cambio
+    de estado actualiza solo la fila del trabajo (el costo no crece con el tamaño de la corrida).
+    Un manifiesto JSON de versiones anteriores se importa la primera vez.
+    """
     
-    # Verificar que el archivo Excel existe
-    if not os.path.exists(excel_path):
-        print(f"Error: No se encontró el archivo Excel en {excel_path}")
-        return
+    def __init__(self, path):
+        legado = None
+        if _is_json_file(path):
+            # Manifiesto JSON anterior: se importa en una base SQLite al lado
+            legado, path = path, os.path.splitext(path)[0] + ".sqlite"
+        self.path = path
+        self.lock = threading.Lock()
+        # Una sola conexión compartida por los hilos (el lock serializa el acceso)
+        self.con = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            cuit TEXT NOT NULL, codigo TEXT NOT NULL, periodo TEXT NOT NULL,
+            status TEXT NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (cuit, codigo, periodo))""")
+        if legado and not self.con.execute("SELECT 1 FROM jobs LIMIT 1").fetchone():
+            with open(legado, encoding="utf-8") as f:
+                jobs = json.load(f).get("jobs", {})
+            with self.lock:
+                self.con.execute("BEGIN IMMEDIATE")
+                for job in jobs.values():
+                    self._put(job)
+                self.con.execute("COMMIT")
+            print(f"Manifiesto {legado} importado en {path} ({len(jobs)} trabajos)")
     
-    # Leer credenciales
-    credentials = read_credentials(excel_path)
-    if not credentials:
-        print("No se pudieron obtener credenciales válidas. Verifique el archivo Excel.")
-        return
+    @staticmethod
+    def key(cuit, codigo, periodo):
+        return f"{cuit}|{codigo}|{periodo}"
     
-    print(f"Se encontraron {len(credentials)} registros para procesar.")
+    def _get(self, cuit, codigo, periodo):
+        fila = self.con.execute("SELECT data FROM jobs WHERE cuit = ? AND codigo = ? AND periodo = ?",
+                                (cuit, codigo, periodo)).fetchone()
+        return json.loads(fila[0]) if fila else None
+    
+    def _put(self, job):
+        self.con.execute("INSERT OR REPLACE INTO jobs (cuit, codigo, periodo, status, data) VALUES (?, ?, ?, ?, ?)",
+                         (job["cuit"], job["codigo"], job["periodo"], job["status"], json.dumps(job)))
+    
+    def pending_codes(self, cuit, codigos, periodo):
+        """Códigos que todavía no se completaron para el CUIT y el período"""
+        with self.lock:
+            terminados = {codigo for codigo, estado in self.con.execute(
+                "SELECT codigo, status FROM jobs WHERE cuit = ? AND periodo = ?", (cuit, periodo))
+                if estado in JOB_FINAL_STATES}
+        return [codigo for codigo in codigos if codigo not in terminados]
+    
+    def start(self, cuit, codigo, periodo):
+        """Marcar un trabajo como en curso y sumar un intento"""
+        with self.lock:
+            job = self._get(cuit, codigo, periodo) or {
+                "cuit": cuit, "codigo": codigo, "periodo": periodo, "status": JOB_PENDING,
+                "attempts": 0, "output": None, "error": None, "created_at": _now(),
+            }
+            job["status"] = JOB_RUNNING
+            job["attempts"] += 1
+            job["started_at"] = _now()
+            job["updated_at"] = job["started_at"]
+            self._put(job)
+    
+    def finish(self, cuit, codigo, periodo, status, output=None, error=None, sha256=None):
+        """Registrar el resultado de un trabajo (con el hash del archivo, si lo hay)"""
+        with self.lock:
+            job = self._get(cuit, codigo, periodo)
+            if job is None:
+                return
+            job["status"] = status
+            job["output"] = output
+            job["error"] = error
+            if sha256 and sha256 != job.get("sha256"):
+                # Contenido nuevo: hay que volver a consolidarlo
+                job["sha256"] = sha256
+                job.pop("consolidated_at", None)
+            job["updated_at"] = _now()
+            if status in JOB_FINAL_STATES:
+                job["finished_at"] = job["updated_at"]
+            self._put(job)
+    
+    def fail_running(self, cuit, periodo, error):
+        """Marcar como fallidos los trabajos del CUIT (y del período, si se indica) que quedaron en curso"""
+        with self.lock:
+            filas = self.con.execute("SELECT data FROM jobs WHERE cuit = ? AND status = ?",
+                                     (cuit, JOB_RUNNING)).fetchall()
+            self.con.execute("BEGIN IMMEDIATE")
+            for (data,) in filas:
+                job = json.loads(data)
+                if periodo is not None and job["periodo"] != periodo:
+                    continue
+                job["status"] = JOB_FAILED
+                job["error"] = error
+                job["updated_at"] = _now()
+                self._put(job)
+            self.con.execute("COMMIT")
+    
+    def update(self, cuit, codigo, periodo, **campos):
+        """Guardar datos adicionales de un trabajo existente"""
+        with self.lock:
+            job = self._get(cuit, codigo, periodo)
+            if job is None:
+                return
+            job.update(campos)
+            self._put(job)
+    
+    def jobs_with_status(self, status):
+        """Copia de los trabajos que están en el estado indicado"""
+        with self.lock:
+            return [json.loads(data) for (data,) in
+                    self.con.execute("SELECT data FROM jobs WHERE status = ?", (status,))]
+    
+    def summary(self):
+        """Cantidad de trabajos por estado"""
+        with self.lock:
+            return dict(self.con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+def _is_json_file(path):
+    """Si el archivo existe y es JSON (no una base SQLite)"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(1) == b"{"
+    except OSError:
+        return False
+
+def _month_index(periodo):
+    """Número de mes absoluto de un período aaaamm (para restar períodos)"""
+    return int(periodo[:4]) * 12 + int(periodo[4:6])
+
+class WatermarkStore:
+    """Marcas persistentes (JSON) de hasta qué fecha está cubierta cada combinación (CUIT, código)
+    
+    Con ellas una corrida incremental consulta solo el rango que falta. Las combinaciones que
+    vienen vacías hace varios meses se sondean cada vez menos seguido (cada 2, 4, 8... meses,
+    hasta empty_probe_max_interval). Es seguro entre workers.
+    """
+    
+    def __init__(self, path, empty_threshold=3, max_probe_interval=12):
+        self.path = path
+        self.empty_threshold = empty_threshold
+        self.max_probe_interval = max_probe_interval
+        self.lock = threading.Lock()
+        self.marks = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.marks = json.load(f).get("marks", {})
+    
+    @staticmethod
+    def key(cuit, codigo):
+        return f"{cuit}|{codigo}"
+    
+    def _save(self):
+        # Escritura atómica, igual que el manifiesto
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": _now(), "marks": self.marks}, f, indent=1)
+        os.replace(tmp_path, self.path)
+    
+    def _probe_interval(self, racha):
+        """Meses entre sondeos de una combinación con `racha` meses vacíos seguidos"""
+        if racha < self.empty_threshold:
+            return 1
+        return min(self.max_probe_interval, 2 ** (racha - self.empty_threshold + 1))
+    
+    def plan(self, cuit, codigos, months_per_query=1):
+        """Consultas que faltan para el CUIT hasta el mes anterior
+        
+        Devuelve (trabajos, al_día, en_espera): los trabajos son (fecha_desde, fecha_hasta, período,
+        código) como en get_period_ranges; al_día y en_espera cuentan las combinaciones salteadas.
+        """
+        hoy = datetime.now()
+        fin = datetime(hoy.year, hoy.month, 1) - timedelta(days=1)
+        hasta = fin.strftime("%Y%m")
+        trabajos, al_dia, en_espera = [], 0, 0
+        with self.lock:
+            for codigo in codigos:
+                marca = self.marks.get(self.key(cuit, codigo), {})
+                # Sin marca se consulta solo el mes anterior (como una corrida normal)
+                if marca.get("covered_until"):
+                    desde = datetime.fromisoformat(marca["covered_until"]) + timedelta(days=1)
+                else:
+                    desde = datetime(fin.year, fin.month, 1)
+                if desde > fin:
+                    al_dia += 1
+                    continue
+                
+                # Vacía hace tiempo: se espera hasta que toque el próximo sondeo (con datos recientes no se
+                # espera, así se rellenan los huecos que hayan quedado antes del último mes revisado)
+                ultimo = marca.get("last_checked")
+                if ultimo and marca["empty_streak"] >= self.empty_threshold and _month_index(hasta) - _month_index(ultimo) < self._probe_interval(marca["empty_streak"]):
+                    en_espera += 1
+                    continue
+                
+                trabajos.extend((start_date, end_date, periodo, codigo) for start_date, end_date, periodo
+                                in get_period_ranges(desde.strftime("%Y%m"), hasta, months_per_query))
+        return trabajos, al_dia, en_espera
+    
+    def record(self, cuit, codigo, start_date, end_date, estado):
+        """Registrar una consulta terminada (con o sin datos) y avanzar la marca si el rango es contiguo"""
+        inicio = datetime.strptime(start_date, "%d%m%Y")
+        fin = datetime.strptime(end_date, "%d%m%Y")
+        with self.lock:
+            marca = self.marks.setdefault(self.key(cuit, codigo), {
+                "cuit": cuit, "codigo": codigo, "covered_until": None, "empty_streak": 0,
+                "last_data_period": None, "last_checked": None,
+            })
+            # Solo se avanza si no queda un hueco entre lo cubierto y la consulta nueva
+            cubierto = datetime.fromisoformat(marca["covered_until"]) if marca["covered_until"] else None
+            if cubierto is None or inicio <= cubierto + timedelta(days=1):
+                marca["covered_until"] = max(fin, cubierto or fin).date().isoformat()
+            
+            # La racha de meses vacíos solo la mueven los meses posteriores al último revisado: volver a
+            # consultar un período ya visto (--desde repetido, cola de trabajos) no la vuelve a sumar
+            periodo_fin = period_key(end_date)
+            ultimo = marca["last_checked"]
+            if not ultimo or periodo_fin > ultimo:
+                if estado == JOB_EMPTY:
+                    desde = _month_index(period_key(start_date))
+                    if ultimo:
+                        desde = max(desde, _month_index(ultimo) + 1)
+                    marca["empty_streak"] += _month_index(periodo_fin) - desde + 1
+                else:
+                    marca["empty_streak"] = 0
+                    marca["last_data_period"] = periodo_fin
+                marca["last_checked"] = periodo_fin
+            marca["updated_at"] = _now()
+            self._save()
+    
+    def summary(self):
+        """Cantidad de combinaciones con marca y cuántas se sondean con menos frecuencia"""
+        with self.lock:
+            espaciadas = sum(1 for marca in self.marks.values() if marca["empty_streak"] >= self.empty_threshold)
+            return {"combinaciones": len(self.marks), "sondeo_espaciado": espaciadas}
+
+def parse_shard(texto):
+    """Interpretar "i/n" (parte i de n, empezando en 1)"""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", texto or "")
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"shard inválido: {texto} (formato i/n, con 1 <= i <= n)")
+    return int(match.group(1)), int(match.group(2))
+
+def in_shard(cuit, indice, total):
+    """Si el CUIT corresponde a la parte indicada (hash estable: igual en todas las máquinas)"""
+    return zlib.crc32(cuit.encode("ascii")) % total == indice - 1
+
+class WorkQueue:
+    """Cola de trabajos (CUIT, código, período) en SQLite, compartida por varios nodos
+    
+    Cada nodo toma todos los trabajos pendientes de un CUIT con un lease (se hace un solo login)
+    y lo renueva mientras trabaja. Si el nodo se cae, el lease vence y otro nodo retoma el CUIT.
+    """
+    
+    _CLAIMABLE = ("(status = 'pending' OR (status = 'failed' AND attempts < :max_attempts) "
+                  "OR (status = 'running' AND lease_until < :ahora))")
+    
+    def __init__(self, path, lease=300, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.owner_prefix = f"{socket.gethostname()}:{os.getpid()}:"
+        self._stop = threading.Event()
+        with self._connect() as con:
+            con.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                cuit TEXT NOT NULL, codigo TEXT NOT NULL, periodo TEXT NOT NULL,
+                status TEXT NOT NULL, owner TEXT, lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at TEXT,
+                PRIMARY KEY (cuit, codigo, periodo))""")
+    
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: sirve entre hilos y el bloqueo de SQLite ordena a los nodos
+        con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield con
+        finally:
+            con.close()
+    
+    def owner(self, worker_id=None):
+        """Identificador del worker en la cola (máquina, proceso y worker)"""
+        return f"{self.owner_prefix}{worker_id or 1}"
+    
+    def seed(self, cuits, codigos, periodos):
+        """Agregar los trabajos que falten (los que ya existen no se tocan)"""
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany("INSERT OR IGNORE INTO jobs (cuit, codigo, periodo, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                            [(cuit, codigo, periodo, JOB_PENDING, _now())
+                             for cuit in cuits for _, _, periodo in periodos for codigo in codigos])
+            con.execute("COMMIT")
+    
+    def claim(self, owner, cuits):
+        """Tomar los trabajos disponibles de un CUIT (de los que este nodo tiene credenciales)"""
+        parametros = {"max_attempts": self.max_attempts, "ahora": time.time(), "cuits": json.dumps(cuits)}
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute(f"""SELECT cuit FROM jobs
+                WHERE cuit IN (SELECT value FROM json_each(:cuits)) AND {self._CLAIMABLE}
+                ORDER BY attempts, cuit LIMIT 1""", parametros).fetchone()
+            if fila:
+                parametros.update(cuit=fila[0], owner=owner, lease_until=parametros["ahora"] + self.lease,
+                                  running=JOB_RUNNING, updated_at=_now())
+                con.execute(f"""UPDATE jobs SET status = :running, owner = :owner, lease_until = :lease_until,
+                    attempts = attempts + 1, updated_at = :updated_at
+                    WHERE cuit = :cuit AND {self._CLAIMABLE}""", parametros)
+            con.execute("COMMIT")
+        return fila[0] if fila else None
+    
+    def claimed(self, cuit, owner):
+        """Pares (código, período) del CUIT que tiene tomados el worker"""
+        with self._connect() as con:
+            return set(con.execute("SELECT codigo, periodo FROM jobs WHERE cuit = ? AND owner = ? AND status = ?",
+                                   (cuit, owner, JOB_RUNNING)).fetchall())
+    
+    def complete(self, cuit, codigo, periodo, owner, status, error=None):
+        """Registrar el resultado de un trabajo (si el lease sigue siendo del worker)"""
+        with self._connect() as con:
+            con.execute("""UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ?
+                WHERE cuit = ? AND codigo = ? AND periodo = ? AND owner = ?""",
+                        (status, error, _now(), cuit, codigo, periodo, owner))
+    
+    def fail_owned(self, cuit, owner, error):
+        """Marcar como fallidos los trabajos del CUIT que el worker dejó en curso"""
+        with self._connect() as con:
+            con.execute("""UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ?
+                WHERE cuit = ? AND owner = ? AND status = ?""", (JOB_FAILED, error, _now(), cuit, owner, JOB_RUNNING))
+    
+    def release(self, owner):
+        """Devolver a pendientes los trabajos en curso de un worker (solo los suyos: "h:p:1" no es "h:p:10")"""
+        with self._connect() as con:
+            con.execute("""UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL,
+                attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE status = ? AND owner = ?""", (JOB_PENDING, _now(), JOB_RUNNING, owner))
+    
+    def release_process(self):
+        """Devolver a pendientes los trabajos en curso de todos los workers de este proceso
+        
+        owner_prefix termina en ":", así que no alcanza a otro proceso con un pid que empiece igual.
+        """
+        with self._connect() as con:
+            con.execute("""UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL,
+                attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE status = ? AND substr(owner, 1, ?) = ?""",
+                        (JOB_PENDING, _now(), JOB_RUNNING, len(self.owner_prefix), self.owner_prefix))
+    
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                with self._connect() as con:
+                    con.execute("UPDATE jobs SET lease_until = ? WHERE status = ? AND substr(owner, 1, ?) = ?",
+                                (time.time() + self.lease, JOB_RUNNING, len(self.owner_prefix), self.owner_prefix))
+            except Exception as e:
+                print(f"No se pudo renovar el lease de la cola: {str(e)}")
+    
+    def start_heartbeat(self):
+        """Renovar en segundo plano los leases de todos los workers de este proceso"""
+        self._stop.clear()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+    
+    def stop_heartbeat(self):
+        self._stop.set()
+    
+    def summary(self):
+        """Cantidad de trabajos por estado en toda la cola"""
+        with self._connect() as con:
+            return dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def _normalize_column(nombre):
+    """Normalizar el nombre de una columna exportada (minúsculas, sin acentos ni símbolos)"""
+    nombre = unicodedata.normalize("NFKD", str(nombre)).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^0-9a-z]+", "_", nombre.lower()).strip("_")
+
+def _parse_amount(valor):
+    """Convertir un importe con formato argentino (1.234,56) a número"""
+    if isinstance(valor, str):
+        valor = valor.strip().replace("$", "").replace(" ", "")
+        if "," in valor:
+            valor = valor.replace(".", "").replace(",", ".")
+    return valor
+
+class _HtmlTableParser(HTMLParser):
+    """Extraer las filas (texto de th/td) de la primera tabla con datos de un HTML"""
+    
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._row = None
+        self._cell = None
     
-    # Inicializar el driver una sola vez para todos los CUIT
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+    
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+    
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if self._row:
+                self.rows.append(self._row)
+            self._row = None
+
+def _read_html_table(path):
+    """Leer una exportación que en realidad es una tabla HTML (sin depender de lxml)"""
+    import pandas as pd
+    with open(path, "rb") as f:
+        contenido = f.read()
+    match = re.search(rb"charset=[\"']?([\w-]+)", contenido[:1024])
+    parser = _HtmlTableParser()
+    parser.feed(contenido.decode(match.group(1).decode() if match else "latin-1", errors="replace"))
+    if not parser.rows:
+        return pd.DataFrame()
+    encabezado, filas = parser.rows[0], parser.rows[1:]
+    ancho = len(encabezado)
+    return pd.DataFrame([fila[:ancho] + [""] * (ancho - len(fila)) for fila in filas], columns=encabezado, dtype=str)
+
+def read_export_file(path):
+    """Leer un archivo exportado de Mis Retenciones como DataFrame con columnas tipadas"""
+    # pandas se importa recién al consolidar: cargarlo demora el arranque de cada corrida
+    import pandas as pd
+    
+    # El "Excel" del portal puede ser un .xls real, un .xlsx, una tabla HTML o un CSV
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        df = pd.read_csv(path, sep=None, engine="python", dtype=str)
+    else:
+        try:
+            df = pd.read_excel(path, dtype=str)
+        except Exception:
+            with open(path, "rb") as f:
+                inicio = f.read(512).lower()
+            if b"<table" in inicio or b"<html" in inicio:
+                df = _read_html_table(path)
+            else:
+                df = pd.read_csv(path, sep=None, engine="python", dtype=str, encoding="latin-1")
+    
+    df.columns = [_normalize_column(columna) for columna in df.columns]
+    df = df.dropna(how="all")
+    
+    for columna in df.columns:
+        if columna.startswith("fecha"):
+            df[columna] = pd.to_datetime(df[columna], dayfirst=True, errors="coerce")
+        elif any(clave in columna for clave in DATASET_AMOUNT_COLUMNS):
+            df[columna] = pd.to_numeric(df[columna].map(_parse_amount), errors="coerce")
+        else:
+            df[columna] = df[columna].astype("string").str.strip()
+    
+    return df
+
+def _certificate_column(df):
+    """Columna que identifica cada retención (número de certificado o comprobante)"""
+    for candidata in DATASET_CERTIFICATE_COLUMNS:
+        for columna in df.columns:
+            if candidata in columna:
+                return columna
+    return None
+
+def consolidar_archivo(dataset_path, cuit, codigo, periodo, archivo):
+    """Agregar un archivo exportado a su partición (periodo/cuit/codigo) sin duplicar retenciones"""
+    import pandas as pd
+    
+    df = read_export_file(archivo)
+    
+    partition_dir = os.path.join(dataset_path, f"periodo={periodo}", f"cuit={cuit}", f"codigo={codigo}")
+    os.makedirs(partition_dir, exist_ok=True)
+    partition_file = os.path.join(partition_dir, "part-0.parquet")
+    
+    # Se reescribe la partición completa: es chica (un CUIT, un código, un período)
+    if os.path.exists(partition_file):
+        df = pd.concat([pd.read_parquet(partition_file), df], ignore_index=True)
+    
+    clave = _certificate_column(df)
+    df = df.drop_duplicates(subset=[clave] if clave else None, keep="last").reset_index(drop=True)
+    
+    # Escritura atómica para que un lector nunca vea una partición a medio escribir
+    tmp_file = f"{partition_file}.tmp"
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, partition_file)
+    
+    return len(df)
+
+def consolidar_retenciones(manifest, dataset_path):
+    """Consolidar en el dataset Parquet los archivos descargados que todavía no se agregaron"""
+    os.makedirs(dataset_path, exist_ok=True)
+    consolidados = 0
+    
+    for job in manifest.jobs_with_status(JOB_DONE):
+        if job.get("consolidated_at") or not job.get("output") or not os.path.exists(job["output"]):
+            continue
+        try:
+            filas = consolidar_archivo(dataset_path, job["cuit"], job["codigo"], job["periodo"], job["output"])
+            manifest.update(job["cuit"], job["codigo"], job["periodo"], consolidated_at=_now())
+            consolidados += 1
+            print(f"Consolidado {os.path.basename(job['output'])}: {filas} retenciones en la partición")
+        except Exception as e:
+            print(f"Error al consolidar {job['output']}: {str(e)}")
+    
+    print(f"Archivos consolidados en {dataset_path}: {consolidados}")
+    return consolidados
+
+def leer_dataset(dataset_path, columns=None, filters=None):
+    """Leer el dataset consolidado, solo con las columnas y particiones necesarias
+    
+    Ejemplo: leer_dataset(ruta, columns=["importe_retenido"], filters=[("periodo", "=", 202501)])
+    """
+    import pandas as pd
+    return pd.read_parquet(dataset_path, columns=columns, filters=filters)
+
+# Firmas de los formatos binarios de Excel (el resto de las exportaciones son texto: HTML o CSV)
+EXPORT_SIGNATURES = {b"PK\x03\x04": ".xlsx", b"\xd0\xcf\x11\xe0": ".xls"}
+
+def export_extension(origen, extension):
+    """Extensión que corresponde al contenido real de una exportación (ruta o bytes)"""
+    if isinstance(origen, bytes):
+        inicio = origen[:8]
+    else:
+        with open(origen, "rb") as f:
+            inicio = f.read(8)
+    for firma, real in EXPORT_SIGNATURES.items():
+        if inicio.startswith(firma):
+            return real
+    return extension.lower()
+
+def validate_export(origen, extension):
+    """Leer una exportación completa y devolver su cantidad de filas y los totales de importes
+    
+    Lanza ValueError si el archivo no se puede leer o no tiene filas.
+    """
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        raise ValueError("la validación requiere pandas")
+    if export_extension(origen, extension) == ".xls":
+        # Un .xls binario (BIFF) solo se puede leer con xlrd; sin él pandas terminaría leyéndolo como texto
+        try:
+            import xlrd  # noqa: F401
+        except ImportError:
+            raise ValueError("leer un .xls binario requiere el paquete xlrd")
+    temporal = None
+    if isinstance(origen, bytes):
+        descriptor, temporal = tempfile.mkstemp(prefix=".validar_", suffix=extension)
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(origen)
+        origen = temporal
+    try:
+        df = read_export_file(origen)
+    except Exception as e:
+        raise ValueError(f"archivo ilegible: {str(e)}")
+    finally:
+        if temporal:
+            os.remove(temporal)
+    
+    if df.empty:
+        raise ValueError("el archivo no tiene filas")
+    totales = {columna: round(float(df[columna].sum()), 2) for columna in df.columns
+               if any(clave in columna for clave in DATASET_AMOUNT_COLUMNS)}
+    return {"rows": len(df), "totals": totales}
+
+class PostProcessor:
+    """Cola acotada y workers que terminan las descargas mientras el navegador sigue consultando
+    
+    El navegador entrega la carpeta de cada descarga en curso (o el contenido ya leído) y pasa a la
+    consulta siguiente; los workers esperan a que termine, corrigen la extensión según el contenido,
+    opcionalmente la validan (lectura completa, filas y totales) y la guardan con store_export. Una
+    validación fallida no descarta el archivo: se guarda igual y queda como advertencia. Lo que no se
+    puede guardar va a <salida>/_cuarentena. El resultado vuelve por el callback de la tarea. Si la
+    cola se llena, submit bloquea (backpressure) y se mide.
+    """
+    
+    def __init__(self, **config):
+        self._lock = threading.Lock()
+        self.threads = []
+        self.configure(**config)
+    
+    def configure(self, **config):
+        """Aplicar la configuración (los workers se inician con start)"""
+        self.config = dict(DEFAULT_POSTPROCESS)
+        self.config.update(config)
+        self.queue = queue.Queue(maxsize=max(1, self.config["queue_size"]))
+        self.stats = {"archivos": 0, "validados": 0, "advertencias": 0, "errores": 0, "en_cuarentena": 0,
+                      "esperas_por_cola_llena": 0, "espera_total_s": 0.0, "cola_max": 0}
+        self.errors = []
+        self.warnings = []
+    
+    @property
+    def enabled(self):
+        return self.config["enabled"] and bool(self.threads)
+    
+    def start(self):
+        """Iniciar los workers de postproceso"""
+        if not self.config["enabled"] or self.threads:
+            return
+        for numero in range(1, max(1, self.config["workers"]) + 1):
+            hilo = threading.Thread(target=self._run, name=f"postproceso-{numero}", daemon=True)
+            hilo.start()
+            self.threads.append(hilo)
+    
+    def stop(self):
+        """Esperar a que se terminen las tareas en cola y detener los workers"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for hilo in self.threads:
+            hilo.join()
+        self.threads = []
+    
+    def submit(self, callback, output_path, cuit, codigo, periodo, job_dir=None, content=None, extension=".csv",
+               worker_id=None):
+        """Encolar una descarga (carpeta en curso o contenido en bytes); bloquea si la cola está llena"""
+        tarea = {
+            "callback": callback, "output_path": output_path, "cuit": cuit, "codigo": codigo, "periodo": periodo,
+            "job_dir": job_dir, "content": content, "extension": extension, "worker": worker_id,
+            "downloaded": threading.Event(), "done": threading.Event(),
+        }
+        if content is not None:
+            tarea["downloaded"].set()
+        try:
+            self.queue.put_nowait(tarea)
+        except queue.Full:
+            # Backpressure: el navegador espera a que un worker libere lugar
+            inicio = time.monotonic()
+            with trace_span("postprocess_wait"):
+                self.queue.put(tarea)
+            with self._lock:
+                self.stats["esperas_por_cola_llena"] += 1
+                self.stats["espera_total_s"] += time.monotonic() - inicio
+        with self._lock:
+            self.stats["archivos"] += 1
+            self.stats["cola_max"] = max(self.stats["cola_max"], self.queue.qsize())
+        return tarea
+    
+    def _run(self):
+        while True:
+            tarea = self.queue.get()
+            if tarea is None:
+                return
+            self._process(tarea)
+    
+    def _process(self, tarea):
+        """Terminar una tarea: esperar la descarga, validar, normalizar, guardar y avisar"""
+        set_trace_context(worker=tarea["worker"], cuit=tarea["cuit"], codigo=tarea["codigo"],
+                          periodo=tarea["periodo"])
+        estado, archivo, digest, detalle, error = JOB_FAILED, None, None, None, None
+        origen = tarea["content"]
+        try:
+            with trace_span("postprocess") as span:
+                origen, extension = tarea["content"], tarea["extension"]
+                if origen is None:
+                    with trace_span("download") as descarga:
+                        origen = wait_for_download(tarea["job_dir"])
+                        descarga["status"] = "ok" if origen else "timeout"
+                    tarea["downloaded"].set()
+                    if not origen:
+                        raise ValueError(f"no se completó la descarga en {TIMEOUTS['download']} segundos")
+                    extension = os.path.splitext(origen)[1]
+                    if extension.lower() not in (".xls", ".xlsx", ".csv"):
+                        raise ValueError(f"formato inesperado: {os.path.basename(origen)}")
+                
+                # Normalizar: la extensión final es la del contenido real (el "Excel" puede ser otro formato)
+                extension = export_extension(origen, extension)
+                if self.config["validate"]:
+                    # Una validación fallida es una advertencia: el archivo se guarda igual
+                    try:
+                        detalle = validate_export(origen, extension)
+                        span["attrs"]["rows"] = detalle["rows"]
+                        with self._lock:
+                            self.stats["validados"] += 1
+                    except ValueError as e:
+                        detalle = {"validation_warning": str(e)}
+                        print(f"Advertencia al validar {tarea['cuit']} {tarea['codigo']} ({tarea['periodo']}): {str(e)}")
+                        with self._lock:
+                            self.stats["advertencias"] += 1
+                            self.warnings.append(f"{tarea['cuit']}|{tarea['codigo']}|{tarea['periodo']}: {str(e)}")
+                archivo, digest, _ = store_export(origen, tarea["output_path"], tarea["cuit"], tarea["codigo"],
+                                                  tarea["periodo"], extension)
+                estado = JOB_DONE
+        except Exception as e:
+            error = str(e)
+            print(f"Error en el postproceso de {tarea['cuit']} {tarea['codigo']} ({tarea['periodo']}): {error}")
+            record_event("failure", "postprocess")
+            with self._lock:
+                self.stats["errores"] += 1
+                self.errors.append(f"{tarea['cuit']}|{tarea['codigo']}|{tarea['periodo']}: {error}")
+            # Lo descargado no se pierde: queda en cuarentena junto a la salida para revisarlo
+            self._quarantine(tarea, origen)
+        finally:
+            tarea["downloaded"].set()
+            if tarea["job_dir"]:
+                shutil.rmtree(tarea["job_dir"], ignore_errors=True)
+            try:
+                tarea["callback"](estado, archivo, digest, detalle, error)
+            except Exception as e:
+                print(f"Error al registrar el resultado del postproceso: {str(e)}")
+            tarea["done"].set()
+    
+    def _quarantine(self, tarea, origen):
+        """Mover (o escribir) lo descargado a <salida>/_cuarentena cuando no se pudo guardar"""
+        try:
+            if origen is None and tarea["job_dir"] and os.path.isdir(tarea["job_dir"]):
+                # La descarga no terminó: se conserva lo que haya (por ejemplo, el .crdownload)
+                archivos = [os.path.join(tarea["job_dir"], f) for f in os.listdir(tarea["job_dir"])]
+                origen = archivos[0] if archivos else None
+            if origen is None:
+                return
+            carpeta = os.path.join(tarea["output_path"], "_cuarentena")
+            os.makedirs(carpeta, exist_ok=True)
+            prefijo = f"{tarea['cuit']}_{tarea['codigo']}_{tarea['periodo']}_"
+            if isinstance(origen, bytes):
+                destino = os.path.join(carpeta, prefijo + "captura" + tarea["extension"])
+                with open(destino, "wb") as f:
+                    f.write(origen)
+            elif os.path.exists(origen):
+                destino = os.path.join(carpeta, prefijo + os.path.basename(origen))
+                shutil.move(origen, destino)
+            else:
+                return
+            print(f"Archivo guardado en cuarentena: {destino}")
+            with self._lock:
+                self.stats["en_cuarentena"] += 1
+        except Exception as e:
+            print(f"No se pudo guardar el archivo en cuarentena: {str(e)}")
+    
+    @staticmethod
+    def wait(tareas, evento="done", timeout=None):
+        """Esperar a que las tareas indicadas terminen (o a que terminen de descargarse)"""
+        for tarea in tareas:
+            tarea[evento].wait(timeout)
+    
+    def summary(self):
+        """Archivos procesados, advertencias de validación, errores y esperas por cola llena"""
+        with self._lock:
+            resumen = dict(self.stats)
+            resumen["espera_total_s"] = round(resumen["espera_total_s"], 2)
+            if self.errors:
+                resumen["detalle_errores"] = list(self.errors[-10:])
+            if self.warnings:
+                resumen["detalle_advertencias"] = list(self.warnings[-10:])
+            return resumen
+
+# Postproceso activo (ver set_postprocess)
+POSTPROCESS = PostProcessor()
+
+def set_postprocess(overrides=None):
+    """Configurar el postproceso compartido por todos los workers"""
+    POSTPROCESS.configure(**(overrides or {}))
+
+def process_credentials(credentials, codigos_retencion, download_path, output_path=None, worker_id=None, total=None,
+                        engine="browser", manifest=None, periodos=None, work_queue=None, watermarks=None,
+                        months_per_query=1, job_matrix=None):
+    """Procesar una lista de CUIT con un driver y una sesión de login propios
+    
+    Cada CUIT se loguea una sola vez y consulta todos sus períodos (lista de get_period_ranges)
+    en la misma pestaña de Mis Retenciones. Con marcas (watermarks) y sin períodos explícitos,
+    cada combinación consulta solo lo que le falta desde la última corrida. Con matriz de trabajos
+    (build_job_matrix), cada CUIT consulta solo sus códigos y períodos.
+    """
+    etiqueta = f"[Worker {worker_id}] " if worker_id is not None else ""
+    resumen = {"cuits": 0, "cuits_salteados": 0, "consultas_ok": 0, "consultas_sin_datos": 0,
+               "consultas_fallidas": 0, "errores": 0, "combinaciones_al_dia": 0, "combinaciones_en_espera": 0}
+    
+    # Períodos a consultar (por defecto, el mes anterior o lo que indiquen las marcas)
+    incremental = watermarks is not None and not periodos and not work_queue
+    if not periodos:
+        start_date, end_date = get_previous_month_dates()
+        periodos = [(start_date, end_date, period_key(start_date))]
+    
+    # Cada worker tiene su propio driver (y por lo tanto su propio Chrome)
     driver = None
+    owner = work_queue.owner(worker_id) if work_queue else None
+    set_trace_context(worker=worker_id)
+    
+    # Descargas entregadas al postproceso; su resultado se registra desde los hilos de postproceso
+    en_proceso = []
+    resumen_lock = threading.Lock()
+    
+    def registrar(cuit, codigo, periodo, start_date, end_date, estado, archivo, digest=None, detalle=None,
+                  error=None):
+        """Registrar el resultado de una consulta en el manifiesto, la cola, las marcas y el resumen"""
+        if manifest:
+            manifest.finish(cuit, codigo, periodo, estado, archivo,
+                            None if estado in JOB_FINAL_STATES else (error or "consulta"), digest)
+            if detalle:
+                # Filas y totales de la validación, o la advertencia si el archivo no se pudo validar
+                manifest.update(cuit, codigo, periodo, **detalle)
+        if work_queue:
+            work_queue.complete(cuit, codigo, periodo, owner, estado,
+                                None if estado in JOB_FINAL_STATES else (error or "consulta"))
+        if watermarks and estado in JOB_FINAL_STATES:
+            watermarks.record(cuit, codigo, start_date, end_date, estado)
+        
+        with resumen_lock:
+            if estado == JOB_DONE:
+                print(f"{etiqueta}Retenciones para el código {codigo} ({periodo}) consultadas exitosamente.")
+                resumen["consultas_ok"] += 1
+            elif estado == JOB_EMPTY:
+                print(f"{etiqueta}Sin retenciones para el código {codigo} ({periodo}).")
+                resumen["consultas_sin_datos"] += 1
+            else:
+                print(f"{etiqueta}No se pudieron consultar las retenciones para el código {codigo} ({periodo}). Continuando con el siguiente.")
+                resumen["consultas_fallidas"] += 1
     
     try:
-        # Configurar el driver
-        driver = setup_driver(download_path)
+        # Tomar un driver del pool (iniciado de antemano)
+        driver = DRIVER_POOL.acquire(download_path)
         
-        # Configurar espera explícita
-        wait = WebDriverWait(driver, 20)
+        # Configurar espera explícita (con tiempos aprendidos de corridas anteriores, ver WaitPolicy)
+        wait = AdaptiveWait(driver, TIMEOUTS["default"])
         
         # Navegar a la página de AFIP
-        driver.get("https://auth.afip.gob.ar/contribuyente_/login.xhtml")
-        driver.maximize_window()
+        driver.get(LOGIN_URL)
+        if not BROWSER["headless"]:
+            driver.maximize_window()
         
         # Procesar cada CUIT
-        for i, (cuit, clave) in enumerate(credentials):
-            print(f"\nProcesando CUIT: {cuit} ({i+1}/{len(credentials)})")
+        primero = True
+        for i, (cuit, clave) in credentials:
+            print(f"\n{etiqueta}Procesando CUIT: {cuit} ({i+1}/{total})")
+            set_trace_context(cuit=cuit, codigo=None, periodo=None)
+            
+            # Si el manifiesto indica que ya se completaron todos los trabajos, no hace falta ni loguearse.
+            # Con cola de trabajos, se hacen exactamente los que este worker tomó de la cola.
+            # Cada grupo de la matriz de trabajos son códigos con sus períodos (None: los de la corrida).
+            grupos = job_matrix.get(cuit, []) if job_matrix is not None else [(codigos_retencion, None)]
+            tomados = work_queue.claimed(cuit, owner) if work_queue else None
+            pendientes = []
+            for codigos, periodos_grupo in grupos:
+                if work_queue:
+                    pendientes += [(start_date, end_date, periodo, codigo)
+                                   for start_date, end_date, periodo in periodos_grupo or periodos
+                                   for codigo in codigos if (codigo, periodo) in tomados]
+                elif incremental and periodos_grupo is None:
+                    planificados, al_dia, en_espera = watermarks.plan(cuit, codigos, months_per_query)
+                    resumen["combinaciones_al_dia"] += al_dia
+                    resumen["combinaciones_en_espera"] += en_espera
+                    if en_espera:
+                        print(f"{etiqueta}{en_espera} códigos sin datos hace meses: se sondean más adelante.")
+                    pendientes += [(start_date, end_date, periodo, codigo)
+                                   for start_date, end_date, periodo, codigo in planificados
+                                   if not manifest or manifest.pending_codes(cuit, [codigo], periodo)]
+                else:
+                    pendientes += [(start_date, end_date, periodo, codigo)
+                                   for start_date, end_date, periodo in periodos_grupo or periodos
+                                   for codigo in (manifest.pending_codes(cuit, codigos, periodo) if manifest
+                                                  else codigos)]
+            # Orden que cambia un solo campo del formulario entre consultas (ver order_jobs)
+            pendientes = order_jobs(pendientes)
+            if not pendientes:
+                print(f"{etiqueta}El CUIT {cuit} ya fue procesado para todos los períodos. Se saltea.")
+                resumen["cuits_salteados"] += 1
+                continue
+            resumen["cuits"] += 1
             
             try:
                 # Si no es el primer CUIT y ya estamos logueados, cerrar sesión primero
-                if i > 0:
+                if not primero:
                     # Cerrar sesión
-                    if not logout_afip(driver, wait):
-                        print(f"No se pudo cerrar la sesión anterior. Refrescando la página...")
-                        driver.get("https://auth.afip.gob.ar/contribuyente_/login.xhtml")
-                        time.sleep(random.uniform(3.0, 5.0))
+                    with trace_span("logout", driver) as span:
+                        cerrada = logout_afip(driver, wait)
+                        span["status"] = "ok" if cerrada else "failed"
+                    if not cerrada:
+                        print(f"{etiqueta}No se pudo cerrar la sesión anterior. Limpiando el navegador...")
+                        with trace_span("recovery", driver, reason="logout"):
+                            # Sin cookies ni almacenamiento la sesión anterior queda descartada
+                            reset_driver(driver)
+                            driver.get(LOGIN_URL)
+                            pause("recover")
+                primero = False
+                
+                # Reciclar el navegador entre CUIT si acumuló demasiadas consultas o memoria
+                motivo = DRIVER_POOL.recycle_reason(driver)
+                if motivo:
+                    print(f"{etiqueta}Reiniciando el navegador ({motivo}: {driver.jobs_done} consultas)...")
+                    # Las descargas en curso se pierden si se cierra Chrome
+                    PostProcessor.wait(en_proceso, "downloaded", TIMEOUTS["download"])
+                    anterior, driver = driver, None
+                    driver = DRIVER_POOL.recycle(anterior, download_path, motivo)
+                    wait = AdaptiveWait(driver, TIMEOUTS["default"])
+                    driver.get(LOGIN_URL)
+                
+                if manifest:
+                    for _, _, periodo, codigo in pendientes:
+                        manifest.start(cuit, codigo, periodo)
                 
                 # Login en AFIP
-                if not login_afip(driver, cuit, clave, wait):
-                    print(f"No se pudo completar el login para el CUIT {cuit}. Continuando con el siguiente.")
+                with trace_span("login", driver) as span, RATE_LIMITER.slot() as operacion:
+                    logueado = login_afip(driver, cuit, clave, wait)
+                    span["status"] = "ok" if logueado else "failed"
+                    operacion["signal"] = "ok" if logueado else "error"
+                if not logueado:
+                    record_event("failure", "login")
+                    print(f"{etiqueta}No se pudo completar el login para el CUIT {cuit}. Continuando con el siguiente.")
+                    resumen["errores"] += 1
+                    if manifest:
+                        manifest.fail_running(cuit, None, "login")
+                    if work_queue:
+                        work_queue.fail_owned(cuit, owner, "login")
                     continue
                 
                 # Navegar a Mis Retenciones con manejo de errores de autenticación
-                if not navigate_to_mis_retenciones(driver, wait, cuit, max_attempts=3):
-                    print(f"No se pudo navegar a Mis Retenciones para el CUIT {cuit}. Continuando con el siguiente.")
+                with trace_span("navigate", driver) as span:
+                    en_mis_retenciones = navigate_to_mis_retenciones(driver, wait, cuit, max_attempts=3)
+                    span["status"] = "ok" if en_mis_retenciones else "failed"
+                if not en_mis_retenciones:
+                    record_event("failure", "navigate")
+                    print(f"{etiqueta}No se pudo navegar a Mis Retenciones para el CUIT {cuit}. Continuando con el siguiente.")
+                    resumen["errores"] += 1
+                    if manifest:
+                        manifest.fail_running(cuit, None, "navegacion")
+                    if work_queue:
+                        work_queue.fail_owned(cuit, owner, "navegacion")
                     continue
                 
-                # Consultar cada código de retención
-                for codigo in codigos_retencion:
-                    if not consultar_retenciones(driver, wait, cuit, codigo, download_path):
-                        print(f"No se pudieron consultar las retenciones para el código {codigo}. Continuando con el siguiente código.")
+                # Con el engine HTTP se reutiliza la sesión del navegador para consultar sin cargar páginas
+                sesion_http = create_http_session(driver) if engine == "http" else None
+                
+                # Con la consulta combinada, cada período con varios códigos se resuelve en una sola
+                # consulta; si no se puede (por ejemplo, el portal no tiene la opción), se sigue código por código
+                if MULTI_CODE["enabled"] and not sesion_http:
+                    por_rango = {}
+                    for start_date, end_date, periodo, codigo in pendientes:
+                        por_rango.setdefault((start_date, end_date, periodo), []).append(codigo)
+                    pendientes = []
+                    combinar = True
+                    for (start_date, end_date, periodo), codigos in por_rango.items():
+                        if not combinar or len(codigos) < 2:
+                            pendientes += [(start_date, end_date, periodo, codigo) for codigo in codigos]
+                            continue
+                        set_trace_context(codigo=None, periodo=periodo)
+                        span = start_span("consulta", driver, engine=engine, codigos=len(codigos))
+                        resultados = None
+                        # La recuperación va fuera del lugar del limitador (ocupa los suyos)
+                        if (detect_state(driver) == STATE_FORM_READY
+                                or recover_session(driver, wait, cuit, clave, reason="consulta")):
+                            with RATE_LIMITER.slot() as operacion:
+                                resultados = consultar_retenciones_multi(driver, wait, cuit, codigos, download_path,
+                                                                         output_path, start_date, end_date, periodo)
+                                operacion["signal"] = "ok" if resultados else "error"
+                        end_span(span, "ok" if resultados else "failed")
+                        DRIVER_POOL.count_job(driver)
+                        if resultados is None:
+                            print(f"{etiqueta}La consulta combinada ({periodo}) no se pudo hacer. Consultando código por código...")
+                            record_event("retry", "consulta")
+                            combinar = False
+                            pendientes += [(start_date, end_date, periodo, codigo) for codigo in codigos]
+                            continue
+                        for codigo, (estado, archivo) in resultados.items():
+                            registrar(cuit, codigo, periodo, start_date, end_date, estado, archivo,
+                                      file_sha256(archivo) if archivo else None)
+                
+                # Consultar cada período y código pendiente dentro de la misma sesión
+                for start_date, end_date, periodo, codigo in pendientes:
+                    set_trace_context(codigo=codigo, periodo=periodo)
+                    span = start_span("consulta", driver, engine=engine)
+                    estado = None
+                    if sesion_http:
+                        with RATE_LIMITER.slot() as operacion:
+                            estado, archivo = consultar_retenciones_http(sesion_http, cuit, codigo,
+                                                                         output_path or download_path,
+                                                                         start_date, end_date, periodo)
+                            operacion["signal"] = http_signal(sesion_http, estado)
+                        if estado is None:
+                            print(f"{etiqueta}La consulta directa no fue concluyente. Consultando con el navegador...")
+                    if estado is None:
+                        # Si la consulta anterior dejó la pestaña fuera del formulario, se retoma
+                        # desde el estado válido más cercano en lugar de volver a loguearse.
+                        # La recuperación ocupa sus propios lugares del limitador: se hace fuera del
+                        # lugar de la consulta (anidarlos puede bloquear al worker contra sí mismo).
+                        if (detect_state(driver) != STATE_FORM_READY
+                                and not recover_session(driver, wait, cuit, clave, reason="consulta")):
+                            estado, archivo = JOB_FAILED, None
+                        else:
+                            estado, archivo = consultar_con_limite(driver, wait, cuit, codigo, download_path,
+                                                                   output_path, start_date, end_date, periodo,
+                                                                   POSTPROCESS.enabled)
+                            # Falla a mitad de camino (elemento vencido, página de error): se vuelve al
+                            # formulario dentro de la misma pestaña y se repite la consulta una vez
+                            if (estado == JOB_FAILED and detect_state(driver) != STATE_FORM_READY
+                                    and recover_session(driver, wait, cuit, clave, reason="consulta")):
+                                print(f"{etiqueta}Repitiendo la consulta {codigo} ({periodo}) desde el formulario...")
+                                record_event("retry", "consulta")
+                                estado, archivo = consultar_con_limite(driver, wait, cuit, codigo, download_path,
+                                                                       output_path, start_date, end_date,
+                                                                       periodo, POSTPROCESS.enabled)
+                    completada = estado in JOB_FINAL_STATES or estado == JOB_RUNNING
+                    
+                    registro = end_span(span, "ok" if completada else "failed", result=estado)
+                    print(f"{etiqueta}Consulta {codigo} ({periodo}): {registro['duration_s']:.1f} s, "
+                          f"{registro['commands']} comandos WebDriver")
+                    if not completada:
+                        record_event("failure", "consulta")
+                    DRIVER_POOL.count_job(driver)
+                    
+                    if estado == JOB_RUNNING:
+                        # La descarga sigue en el postproceso, que registra el resultado al terminar
+                        en_proceso[:] = [tarea for tarea in en_proceso if not tarea["done"].is_set()]
+                        origen = ({"content": archivo[0], "extension": archivo[1]} if isinstance(archivo, tuple)
+                                  else {"job_dir": archivo})
+                        en_proceso.append(POSTPROCESS.submit(
+                            functools.partial(registrar, cuit, codigo, periodo, start_date, end_date),
+                            output_path or download_path, cuit, codigo, periodo, worker_id=worker_id, **origen))
                     else:
-                        print(f"Retenciones para el código {codigo} consultadas exitosamente.")
+                        registrar(cuit, codigo, periodo, start_date, end_date, estado, archivo,
+                                  file_sha256(archivo) if archivo else None)
                 
                 # Cerrar la pestaña de Mis Retenciones y volver a la pestaña principal
-                if not close_mis_retenciones_tab(driver):
-                    print(f"No se pudo cerrar la pestaña de Mis Retenciones. Continuando con el siguiente CUIT.")
-                    # Si hay un problema, intentar cerrar todas las pestañas excepto la primera
-                    while len(driver.window_handles) > 1:
-                        driver.switch_to.window(driver.window_handles[-1])
-                        driver.close()
-                        time.sleep(1)
-                    driver.switch_to.window(driver.window_handles[0])
+                set_trace_context(codigo=None, periodo=None)
+                with trace_span("close_tab", driver) as span:
+                    cerrada = close_mis_retenciones_tab(driver)
+                    span["status"] = "ok" if cerrada else "failed"
+                if not cerrada:
+                    print(f"{etiqueta}No se pudo cerrar la pestaña de Mis Retenciones. Continuando con el siguiente CUIT.")
+                    # Volver al portal con la sesión abierta (el próximo CUIT la cierra)
+                    recover_session(driver, wait, cuit, None, STATE_LOGGED_IN, reason="close_tab")
                 
             except Exception as e:
-                print(f"Error procesando CUIT {cuit}: {str(e)}")
+                print(f"{etiqueta}Error procesando CUIT {cuit}: {str(e)}")
+                resumen["errores"] += 1
+                record_event("failure", "cuit")
+                if manifest:
+                    manifest.fail_running(cuit, None, str(e))
+                if work_queue:
+                    work_queue.fail_owned(cuit, owner, str(e))
                 
-                # Intentar recuperarse para el siguiente CUIT
+                # Retomar desde el estado más cercano para el siguiente CUIT: con la sesión abierta
+                # alcanza con volver al portal (el próximo CUIT la cierra); si no, se vuelve al login
                 try:
-                    # Cerrar todas las pestañas excepto la primera
-                    while len(driver.window_handles) > 1:
-                        driver.switch_to.window(driver.window_handles[-1])
-                        driver.close()
-                        time.sleep(1)
-                    driver.switch_to.window(driver.window_handles[0])
-                    
-                    # Volver a la página de inicio de AFIP
-                    driver.get("https://auth.afip.gob.ar/contribuyente_/login.xhtml")
-                    time.sleep(random.uniform(3.0, 5.0))
+                    estado_sesion = detect_state(driver)
+                    objetivo = (STATE_LOGGED_OUT if estado_sesion in (STATE_LOGGED_OUT, STATE_UNKNOWN)
+                                else STATE_LOGGED_IN)
+                    if not recover_session(driver, wait, cuit, None, objetivo, reason="error"):
+                        if not recover_session(driver, wait, cuit, None, STATE_LOGGED_OUT, reason="error"):
+                            raise RuntimeError("el navegador no llega a ningún estado válido")
+                    primero = detect_state(driver) == STATE_LOGGED_OUT
+                    pause("recover")
                 except Exception as e:
-                    print(f"Error al intentar recuperarse: {str(e)}")
+                    print(f"{etiqueta}Error al intentar recuperarse: {str(e)}")
+                    # El navegador quedó inutilizable: se reemplaza por uno del pool
+                    try:
+                        with trace_span("recovery", reason="driver"):
+                            PostProcessor.wait(en_proceso, "downloaded", TIMEOUTS["download"])
+                            anterior, driver = driver, None
+                            driver = DRIVER_POOL.replace(anterior, download_path)
+                            wait = AdaptiveWait(driver, TIMEOUTS["default"])
+                            driver.get(LOGIN_URL)
+                        primero = True
+                    except Exception as e:
+                        print(f"{etiqueta}No se pudo obtener otro navegador: {str(e)}")
+                        raise
     except Exception as e:
-        print(f"Error general: {str(e)}")
+        print(f"{etiqueta}Error general: {str(e)}")
+        resumen["errores"] += 1
     finally:
-        # Cerrar el navegador al finalizar todos los CUIT
+        # Devolver el navegador al pool (limpio) al finalizar todos los CUIT, sin cortar descargas en curso
+        PostProcessor.wait(en_proceso, "downloaded", TIMEOUTS["download"])
         if driver:
-            driver.quit()
+            DRIVER_POOL.release(driver)
+        # Lo que haya quedado tomado vuelve a la cola para otro worker o nodo (una vez registrado
+        # lo que quedaba en el postproceso)
+        PostProcessor.wait(en_proceso)
+        if work_queue:
+            work_queue.release(owner)
+    
+    return resumen
+
+def consultar_con_limite(*args, **kwargs):
+    """consultar_retenciones ocupando un lugar del limitador solo mientras dura la consulta
+    
+    La recuperación de la sesión (recover_session) ocupa sus propios lugares, así que se hace
+    antes o después de llamar a esta función, nunca dentro.
+    """
+    with RATE_LIMITER.slot() as operacion:
+        estado, archivo = consultar_retenciones(*args, **kwargs)
+        operacion["signal"] = "ok" if estado in JOB_FINAL_STATES or estado == JOB_RUNNING else "error"
+    return estado, archivo
+
+def _iter_queue(cola):
+    """Consumir elementos de una cola compartida hasta vaciarla"""
+    while True:
+        try:
+            yield cola.get_nowait()
+        except queue.Empty:
+            return
+
+def _iter_work_queue(work_queue, owner, credentials):
+    """Tomar CUIT de la cola de trabajos hasta que no queden disponibles"""
+    indices = {cuit: i for i, (cuit, _) in enumerate(credentials)}
+    claves = dict(credentials)
+    while True:
+        cuit = work_queue.claim(owner, list(claves))
+        if cuit is None:
+            return
+        yield indices[cuit], (cuit, claves[cuit])
+
+def run_parallel(credentials, codigos_retencion, output_path, num_workers, engine="browser", manifest=None,
+                 periodos=None, work_queue=None, watermarks=None, months_per_query=1, job_matrix=None):
+    """Procesar los CUIT con un pool de workers, cada uno con su propio Chrome y carpeta de descargas"""
+    num_workers = max(1, min(num_workers, len(credentials)))
+    print(f"Iniciando {num_workers} workers en paralelo...")
+    
+    # Cola compartida: cada worker toma el siguiente CUIT libre, así se reparte
+    # la carga aunque algunos CUIT tarden más que otros
+    cola = queue.Queue()
+    for item in enumerate(credentials):
+        cola.put(item)
+    
+    resumen_total = {"cuits": 0, "cuits_salteados": 0, "consultas_ok": 0, "consultas_sin_datos": 0,
+                     "consultas_fallidas": 0, "errores": 0, "combinaciones_al_dia": 0,
+                     "combinaciones_en_espera": 0}
+    worker_paths = []
+    
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {}
+        for worker_id in range(1, num_workers + 1):
+            # Carpeta de descargas propia para que los workers no se pisen los archivos
+            worker_path = os.path.join(output_path, f"_descargas_worker_{worker_id}")
+            os.makedirs(worker_path, exist_ok=True)
+            worker_paths.append(worker_path)
+            
+            # Con cola de trabajos compartida, cada worker toma sus CUIT de ahí
+            origen = (_iter_work_queue(work_queue, work_queue.owner(worker_id), credentials) if work_queue
+                      else _iter_queue(cola))
+            future = executor.submit(process_credentials, origen, codigos_retencion,
+                                     worker_path, output_path, worker_id, len(credentials), engine, manifest,
+                                     periodos, work_queue, watermarks, months_per_query, job_matrix)
+            futures[future] = worker_id
+        
+        # La falla de un worker no afecta al resto: solo se registra
+        for future in as_completed(futures):
+            worker_id = futures[future]
+            try:
+                resumen = future.result()
+            except Exception as e:
+                print(f"[Worker {worker_id}] Finalizó con error: {str(e)}")
+                resumen_total["errores"] += 1
+                continue
+            
+            print(f"[Worker {worker_id}] Finalizado: {resumen}")
+            for clave, valor in resumen.items():
+                resumen_total[clave] += valor
+    
+    # Eliminar las carpetas de descarga de los workers si quedaron vacías
+    for worker_path in worker_paths:
+        try:
+            os.rmdir(worker_path)
+        except OSError:
+            pass
+    
+    return resumen_total
+
+def main():
+    """Función principal"""
+    global LOGIN_URL
+    
+    parser = argparse.ArgumentParser(description="Descarga de Mis Retenciones (ARCA) para varios CUIT")
+    parser.add_argument("--config", help="Archivo JSON con la configuración (rutas, códigos, ritmo, tiempos)")
+    parser.add_argument("--credenciales",
+                        help="Origen de las credenciales: .xlsx, .csv, .jsonl, env:VARIABLE o secret:ruta")
+    parser.add_argument("--workers", type=int,
+                        help="Cantidad de navegadores en paralelo (por defecto 1)")
+    parser.add_argument("--headless", action="store_true", default=None,
+                        help="Ejecutar Chrome sin ventana y con recursos estáticos bloqueados")
+    parser.add_argument("--desde", help="Primer período a consultar (aaaamm); por defecto, el mes anterior")
+    parser.add_argument("--hasta", help="Último período a consultar (aaaamm); por defecto, igual a --desde")
+    parser.add_argument("--dataset",
+                        help="Carpeta del dataset Parquet donde consolidar los archivos descargados")
+    parser.add_argument("--trace", help="Archivo JSON-lines donde registrar los tiempos de cada paso")
+    parser.add_argument("--manifest",
+                        help="Manifiesto SQLite de la corrida (por defecto, en la carpeta de descargas)")
+    parser.add_argument("--engine", choices=["browser", "http"],
+                        help="'browser' usa el formulario; 'http' consulta directo con la sesión del navegador")
+    parser.add_argument("--shard", help="Procesar solo la parte i de n de los CUIT (formato i/n, por ejemplo 2/4)")
+    parser.add_argument("--queue",
+                        help="Cola de trabajos SQLite compartida: varios nodos toman CUIT sin repetirlos")
+    parser.add_argument("--extraccion", choices=["export", "capture", "table"],
+                        help="'export' descarga el Excel; 'capture' lo trae en memoria sin pasar por disco; "
+                             "'table' lee la tabla de resultados (con paginado) sin descargar")
+    parser.add_argument("--todos-los-impuestos", action="store_true", default=None,
+                        help="Una sola consulta por período con la opción de todos los impuestos, separada por código")
+    parser.add_argument("--pacing", choices=sorted(PACING_PROFILES),
+                        help="Perfil de ritmo: 'conservative' (pausas humanas) o 'fast' (solo esperas por condición)")
+    args = parser.parse_args()
+    
+    config = load_config(args.config)
+    if args.credenciales is not None:
+        config["excel_path"] = args.credenciales
+    if args.workers is not None:
+        config["workers"] = args.workers
+    if args.pacing is not None:
+        config["pacing"] = args.pacing
+    if args.desde is not None:
+        config["periodo_desde"] = args.desde
+        config["periodo_hasta"] = args.hasta or args.desde
+    elif args.hasta is not None:
+        parser.error("--hasta requiere --desde")
+    for periodo in (args.desde, args.hasta):
+        if periodo is not None:
+            try:
+                parse_period(periodo)
+            except ValueError as e:
+                parser.error(str(e))
+    if args.dataset is not None:
+        config["dataset_path"] = args.dataset
+    if args.trace is not None:
+        config["trace_path"] = args.trace
+    if args.manifest is not None:
+        config["manifest_path"] = args.manifest
+    if args.engine is not None:
+        config["engine"] = args.engine
+    if args.extraccion is not None:
+        config["extraction"] = args.extraccion
+    if args.shard is not None:
+        config["shard"] = args.shard
+    if args.queue is not None:
+        config["queue_path"] = args.queue
+    if args.todos_los_impuestos:
+        config["multi_code"] = dict(config["multi_code"], enabled=True)
+    if args.headless:
+        config["headless"] = True
+        config["block_resources"] = True
+    
+    # Página de login (la real de ARCA o un sitio simulado para pruebas)
+    LOGIN_URL = config["login_url"]
+    
+    # Ritmo de navegación y tiempos máximos de espera
+    set_pacing(config["pacing"], config["pacing_overrides"], config["timeouts"])
+    
+    # Limitador compartido por los workers (ritmo y concurrencia contra el portal)
+    set_rate_limit(config["rate_limit"], config["workers"])
+    
+    # Modo del navegador (con o sin ventana, bloqueo de recursos) y pool de drivers
+    set_browser_options(config["headless"], config["block_resources"], config["blocked_urls"])
+    set_driver_pool(config["driver_pool"])
+    
+    # Resultados: exportar el Excel o leer la tabla de la página
+    set_extraction(config["extraction"], config["max_result_pages"])
+    
+    # Postproceso en segundo plano de las descargas (validar, normalizar y guardar)
+    set_postprocess(config["postprocess"])
+    
+    # Consulta única para todos los códigos de cada período (separada localmente)
+    set_multi_code(config["multi_code"])
+    
+    # Configuración de rutas
+    credentials_source = config["excel_path"]
+    download_path = config["download_path"]
+    
+    # Códigos de retención a consultar
+    codigos_retencion = config["codigos_retencion"]
+    
+    # Leer credenciales (normalizadas, validadas y sin repetidos)
+    credentials = read_credentials(credentials_source)
+    if not credentials:
+        print(f"No se pudieron obtener credenciales válidas. Verifique el origen {credentials_source}.")
+        return
+    
+    print(f"Se encontraron {len(credentials)} registros para procesar.")
+    
+    # Partición estable entre máquinas: cada nodo con --shard i/n procesa solo sus CUIT
+    if config["shard"]:
+        try:
+            indice, partes = parse_shard(config["shard"])
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return
+        credentials = [(cuit, clave) for cuit, clave in credentials if in_shard(cuit, indice, partes)]
+        print(f"Shard {indice}/{partes}: {len(credentials)} CUIT para este nodo.")
+        if not credentials:
+            return
+    
+    # Períodos a consultar: rango pedido (partido en consultas que acepte el portal) o mes anterior
+    periodos = None
+    if config["periodo_desde"]:
+        try:
+            periodos = get_period_ranges(config["periodo_desde"], config["periodo_hasta"] or config["periodo_desde"],
+                                         config["meses_por_consulta"])
+        except ValueError as e:
+            print(f"Error en el rango de períodos de la configuración: {e}")
+            return
+        if not periodos:
+            print("El rango de períodos está vacío. Verifique --desde y --hasta.")
+            return
+        print(f"Se consultarán {len(periodos)} períodos: {periodos[0][2]} a {periodos[-1][2]}")
+    
+    # Matriz de trabajos: códigos y períodos por CUIT (sin especificación, todos con codigos_retencion)
+    try:
+        job_matrix = build_job_matrix(config["jobs"], [cuit for cuit, _ in credentials], codigos_retencion,
+                                      config["meses_por_consulta"])
+    except ValueError as e:
+        print(f"Error en la especificación de trabajos: {e}")
+        return
+    if job_matrix is not None:
+        print(f"Especificación de trabajos: {len(job_matrix)} CUIT con trabajos asignados.")
+    
+    # Esperas con tiempos aprendidos de las corridas anteriores (se actualizan al terminar)
+    set_wait_policy(config["wait_stats_path"] or os.path.join(download_path, "mis_retenciones_latencias.json"),
+                    config["wait_policy"])
+    
+    # Trazas de tiempos por paso (se agregan al archivo en cada corrida)
+    configure_tracing(config["trace_path"] or os.path.join(download_path, "mis_retenciones_traces.jsonl"))
+    
+    # Cola de trabajos compartida: se cargan los trabajos que falten y se toman de a un CUIT con lease
+    work_queue = None
+    if config["queue_path"]:
+        if not periodos:
+            start_date, end_date = get_previous_month_dates()
+            periodos = [(start_date, end_date, period_key(start_date))]
+        work_queue = WorkQueue(config["queue_path"], config["queue_lease"], config["queue_max_attempts"])
+        if job_matrix is None:
+            work_queue.seed([cuit for cuit, _ in credentials], codigos_retencion, periodos)
+        else:
+            for cuit, grupos in job_matrix.items():
+                for codigos, periodos_grupo in grupos:
+                    work_queue.seed([cuit], codigos, periodos_grupo or periodos)
+        work_queue.start_heartbeat()
+        print(f"Cola de trabajos {config['queue_path']}: {work_queue.summary()}")
+    
+    # Iniciar los navegadores en segundo plano (uno por worker más los repuestos)
+    DRIVER_POOL.warm(max(1, min(config["workers"], len(credentials))) + DRIVER_POOL.config["spares"])
+    
+    # Manifiesto de trabajos: permite retomar una corrida interrumpida sin repetir lo ya hecho
+    manifest_path = config["manifest_path"]
+    if not manifest_path:
+        manifest_path = os.path.join(download_path, "mis_retenciones_manifest.sqlite")
+        # Manifiesto de versiones anteriores (JSON): se importa si todavía no hay base
+        anterior = os.path.join(download_path, "mis_retenciones_manifest.json")
+        if not os.path.exists(manifest_path) and os.path.exists(anterior):
+            manifest_path = anterior
+    manifest = JobManifest(manifest_path)
+    
+    # Marcas por (CUIT, código): se actualizan siempre; sin rango explícito deciden qué consultar
+    watermarks = None
+    if config["incremental"]:
+        watermarks = WatermarkStore(config["watermarks_path"]
+                                    or os.path.join(download_path, "mis_retenciones_watermarks.json"),
+                                    config["empty_probe_after"], config["empty_probe_max_interval"])
+    
+    POSTPROCESS.start()
+    try:
+        if config["workers"] > 1:
+            resumen = run_parallel(credentials, codigos_retencion, download_path, config["workers"], config["engine"],
+                                   manifest, periodos, work_queue, watermarks, config["meses_por_consulta"],
+                                   job_matrix)
+        else:
+            # Un solo driver para todos los CUIT
+            origen = (_iter_work_queue(work_queue, work_queue.owner(), credentials) if work_queue
+                      else enumerate(credentials))
+            resumen = process_credentials(origen, codigos_retencion, download_path,
+                                          total=len(credentials), engine=config["engine"], manifest=manifest,
+                                          periodos=periodos, work_queue=work_queue, watermarks=watermarks,
+                                          months_per_query=config["meses_por_consulta"], job_matrix=job_matrix)
+    finally:
+        # Terminar lo que quede en el postproceso y cerrar todos los navegadores del pool
+        POSTPROCESS.stop()
+        DRIVER_POOL.close()
+        # Guardar las latencias observadas para ajustar las esperas de la próxima corrida
+        try:
+            WAITS.save()
+        except OSError as e:
+            print(f"No se pudieron guardar las latencias: {str(e)}")
+        # Devolver a la cola lo que este proceso haya dejado tomado (por ejemplo, al interrumpirlo)
+        if work_queue:
+            work_queue.stop_heartbeat()
+            work_queue.release_process()
+    
+    print(f"\nResumen: {resumen}")
+    print(f"Estado del manifiesto: {manifest.summary()}")
+    print_trace_summary()
+    print(f"Limitador: {RATE_LIMITER.summary()}")
+    print(f"Navegadores: {DRIVER_POOL.summary()}")
+    if POSTPROCESS.config["enabled"]:
+        print(f"Postproceso: {POSTPROCESS.summary()}")
+    if WAITS.enabled:
+        print(f"Esperas aprendidas: {WAITS.summary()}")
+    if work_queue:
+        print(f"Cola de trabajos: {work_queue.summary()}")
+    if watermarks:
+        print(f"Marcas incrementales: {watermarks.summary()}")
     
+    # Consolidar lo descargado en el dataset columnar (particionado por período, CUIT y código)
+    if config["dataset_path"]:
+        consolidar_retenciones(manifest, config["dataset_path"])
+    manifest.close()
+    close_tracing()
     print("\nProceso completado.")
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+"""Benchmark de MIS RET v1.py contra el sitio simulado de mock_arca.py
+
+Corre main() con 1, 10 y 100 CUIT sintéticos (configurable) contra el mock local y reporta la
+latencia por CUIT (p50, p95, máximo, a partir de las trazas) y el throughput de cada corrida.
+
+Uso: python benchmark_mis_ret.py --sizes 1 10 100 --workers 4 --latency 0.05 --headless
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from mock_arca import start_mock_server
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MIS RET v1.py")
+
+# Pasos de primer nivel que componen el tiempo de un CUIT en las trazas
+CUIT_STEPS = ("logout", "login", "navigate", "consulta", "close_tab", "recovery")
+
+
+def load_script():
+    """Importar MIS RET v1.py como módulo (el nombre tiene espacios)"""
+    spec = importlib.util.spec_from_file_location("mis_ret_v1", SCRIPT_PATH)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def synthetic_cuits(cantidad, semilla=0):
+    """CUIT sintéticos con dígito verificador válido"""
+    generador = random.Random(semilla)
+    pesos = [5, 4, 3, 2, 7, 6, 5, 4, 3, 2]
+    cuits = set()
+    while len(cuits) < cantidad:
+        base = "20" + f"{generador.randint(10000000, 99999999)}"
+        resto = 11 - sum(int(digito) * peso for digito, peso in zip(base, pesos)) % 11
+        if resto == 10:
+            continue
+        cuits.add(base + str(0 if resto == 11 else resto))
+    return sorted(cuits)
+
+
+def write_credentials(path, cuits):
+    """Planilla de credenciales con las columnas que espera el script"""
+    import pandas as pd
+    pd.DataFrame({"CUIT": cuits, "Clave": ["clave-mock"] * len(cuits)}).to_excel(path, index=False)
+
+
+def _percentile(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return 0.0
+    indice = max(0, -(-p * len(valores) // 100) - 1)
+    return valores[int(indice)]
+
+
+def run_case(modulo, login_url, cantidad, args, carpeta):
+    """Correr main() con N CUIT y medir latencia por CUIT y throughput"""
+    caso = os.path.join(carpeta, f"caso_{cantidad}")
+    descargas = os.path.join(caso, "descargas")
+    os.makedirs(descargas, exist_ok=True)
+
+    excel_path = os.path.join(caso, "CREDENCIALES.xlsx")
+    write_credentials(excel_path, synthetic_cuits(cantidad))
+
+    trace_path = os.path.join(caso, "traces.jsonl")
+    config = {
+        "login_url": login_url,
+        "excel_path": excel_path,
+        "download_path": descargas,
+        "manifest_path": os.path.join(caso, "manifest.sqlite"),
+        "trace_path": trace_path,
+        "workers": args.workers,
+        "pacing": args.pacing,
+        "headless": args.headless,
+        "block_resources": args.headless,
+        "extraction": args.extraction,
+        "multi_code": {"enabled": args.multi_code},
+    }
+    config_path = os.path.join(caso, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+    sys.argv = [SCRIPT_PATH, "--config", config_path]
+    inicio = time.monotonic()
+    modulo.main()
+    duracion = time.monotonic() - inicio
+
+    # Latencia por CUIT: suma de sus pasos de primer nivel en las trazas
+    por_cuit = {}
+    with open(trace_path, encoding="utf-8") as f:
+        for linea in f:
+            span = json.loads(linea)
+            if span.get("cuit") and span["step"] in CUIT_STEPS:
+                por_cuit[span["cuit"]] = por_cuit.get(span["cuit"], 0.0) + span["duration_s"]
+    latencias = list(por_cuit.values())
+
+    return {
+        "cuits": cantidad,
+        "workers": args.workers,
+        "wall_s": round(duracion, 2),
+        "cuits_por_minuto": round(cantidad / duracion * 60, 2) if duracion else 0.0,
+        "p50_cuit_s": round(_percentile(latencias, 50), 2),
+        "p95_cuit_s": round(_percentile(latencias, 95), 2),
+        "max_cuit_s": round(max(latencias), 2) if latencias else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de MIS RET v1.py contra el mock de ARCA")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="Cantidades de CUIT a probar")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pacing", default="fast", choices=["fast", "conservative"])
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--extraction", default="export", choices=["export", "capture", "table"])
+    parser.add_argument("--multi-code", action="store_true", help="Una consulta por período para todos los códigos")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia del mock por respuesta (s)")
+    parser.add_argument("--auth-error-rate", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    servidor, login_url = start_mock_server(latency=args.latency, auth_error_rate=args.auth_error_rate,
+                                            fail_rate=args.fail_rate)
+    modulo = load_script()
+    resultados = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_misret_") as carpeta:
+            for cantidad in args.sizes:
+                resultados.append(run_case(modulo, login_url, cantidad, args, carpeta))
+    finally:
+        servidor.shutdown()
+
+    print("\nResultados del benchmark:")
+    print(f"{'CUIT':>6}{'workers':>9}{'total s':>10}{'CUIT/min':>10}{'p50 s':>8}{'p95 s':>8}{'máx s':>8}")
+    for r in resultados:
+        print(f"{r['cuits']:>6}{r['workers']:>9}{r['wall_s']:>10.1f}{r['cuits_por_minuto']:>10.1f}"
+              f"{r['p50_cuit_s']:>8.2f}{r['p95_cuit_s']:>8.2f}{r['max_cuit_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
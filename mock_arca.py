@@ -0,0 +1,356 @@
+"""Sitio local que imita las páginas de ARCA / Mis Retenciones que usa MIS RET v1.py
+
+Reproduce los elementos de los que depende el script (login en dos pasos, buscador del portal,
+pestaña nueva de Mis Retenciones, formulario de consulta, página sin datos con VOLVER, página
+de resultados con el enlace de exportación, error 401 AUTHENTICATION_ALREADY_PRESENT y cierre
+de sesión) con latencia configurable e inyección de fallas.
+
+Uso: python mock_arca.py --port 8765 --latency 0.2 --auth-error-rate 0.1
+Después, en la configuración: "login_url": "http://127.0.0.1:8765/contribuyente_/login.xhtml"
+"""
+import argparse
+import hashlib
+import html
+import random
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Impuestos que ofrece el select "impuestos" (código, descripción)
+IMPUESTOS = [
+    ("216", "IVA - Retenciones"),
+    ("217", "Ganancias - Retenciones"),
+    ("767", "SICORE - Retenciones y Percepciones"),
+]
+
+# Valor de la opción que consulta todos los impuestos juntos
+TODOS_LOS_IMPUESTOS = "*"
+
+# Parámetros del mock (se pueden cambiar por línea de comandos o desde el benchmark)
+MOCK_CONFIG = {
+    "latency": 0.0,          # segundos agregados a cada respuesta
+    "jitter": 0.0,           # variación aleatoria (+/-) de la latencia
+    "auth_error_rate": 0.0,  # probabilidad de 401 AUTHENTICATION_ALREADY_PRESENT al abrir Mis Retenciones
+    "fail_rate": 0.0,        # probabilidad de error 500 en la consulta
+    "empty_rate": 0.5,       # proporción de consultas (CUIT, código, período) sin datos
+    "max_rows": 20,          # máximo de retenciones por consulta con datos
+    "page_size": 10,         # filas por página de resultados (con enlace "Siguiente")
+}
+
+# Sesiones activas: token -> CUIT
+SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# Estructura de tablas anidadas de la página real: las XPath absolutas del script pasan por acá
+_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body><table><tbody><tr><td>
+<table><tbody>
+<tr><td>ARCA - Mis Retenciones</td></tr>
+<tr><td><table><tbody>
+<tr><td>Menú</td></tr>
+<tr><td>&nbsp;</td><td><table><tbody><tr><td>
+{content}
+</td></tr></tbody></table></td></tr>
+</tbody></table></td></tr>
+</tbody></table>
+</td></tr></tbody></table></body></html>"""
+
+
+def _rows_for(cuit, codigo, desde, hasta):
+    """Retenciones sintéticas y deterministas para una consulta"""
+    if codigo == TODOS_LOS_IMPUESTOS:
+        # Las mismas filas que las consultas por código, una a continuación de la otra
+        return [fila for codigo, _ in IMPUESTOS for fila in _rows_for(cuit, codigo, desde, hasta)]
+    semilla = int(hashlib.sha256(f"{cuit}|{codigo}|{desde}|{hasta}".encode()).hexdigest(), 16)
+    generador = random.Random(semilla)
+    if generador.random() < MOCK_CONFIG["empty_rate"]:
+        return []
+
+    filas = []
+    for numero in range(generador.randint(1, MOCK_CONFIG["max_rows"])):
+        base = generador.randint(10000, 5000000) / 100
+        filas.append({
+            "cuit_agente": f"30{generador.randint(100000000, 999999999)}",
+            "impuesto": codigo,
+            "regimen": str(generador.choice([210, 212, 214, 831, 832])),
+            "fecha_retencion": desde,
+            "certificado": f"{codigo}{semilla % 100000:05d}{numero:04d}",
+            "importe": f"{base * 0.03:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."),
+        })
+    return filas
+
+
+class MockArcaHandler(BaseHTTPRequestHandler):
+    """Atiende las páginas del login, el portal y Mis Retenciones"""
+
+    server_version = "MockARCA/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- utilidades -----------------------------------------------------------------------
+
+    def _delay(self):
+        demora = MOCK_CONFIG["latency"] + random.uniform(-MOCK_CONFIG["jitter"], MOCK_CONFIG["jitter"])
+        if demora > 0:
+            time.sleep(demora)
+
+    def _cuit(self):
+        for parte in self.headers.get("Cookie", "").split(";"):
+            nombre, _, valor = parte.strip().partition("=")
+            if nombre == "MOCKSESSION":
+                with _SESSIONS_LOCK:
+                    return SESSIONS.get(valor)
+        return None
+
+    def _form(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        datos = parse_qs(self.rfile.read(largo).decode("utf-8")) if largo else {}
+        return {clave: valores[0] for clave, valores in datos.items()}
+
+    def _send(self, body, status=200, content_type="text/html; charset=utf-8", headers=None):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, location, headers=None):
+        self.send_response(303)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+
+    # --- ruteo ----------------------------------------------------------------------------
+
+    def do_GET(self):
+        self._delay()
+        url = urlparse(self.path)
+        rutas = {
+            "/contribuyente_/login.xhtml": self._login_page,
+            "/portal": self._portal_page,
+            "/mr/form": self._mis_retenciones_form,
+            "/mr/resultados": self._resultados,
+            "/mr/exportar": self._exportar,
+        }
+        rutas.get(url.path, self._not_found)(parse_qs(url.query))
+
+    def do_POST(self):
+        self._delay()
+        url = urlparse(self.path)
+        rutas = {
+            "/contribuyente_/siguiente": self._login_siguiente,
+            "/contribuyente_/ingresar": self._login_ingresar,
+            "/logout": self._logout,
+            "/mr/consulta": self._consulta,
+        }
+        rutas.get(url.path, self._not_found)(self._form())
+
+    def _not_found(self, _datos):
+        self._send("<html><body>404</body></html>", status=404)
+
+    # --- login en dos pasos ---------------------------------------------------------------
+
+    def _login_page(self, _query):
+        self._send("""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Acceso</title></head><body>
+<form id="F1" method="post" action="/contribuyente_/siguiente">
+<input type="text" id="F1:username" name="F1:username">
+<input type="submit" id="F1:btnSiguiente" value="Siguiente">
+</form></body></html>""")
+
+    def _login_siguiente(self, datos):
+        cuit = html.escape(datos.get("F1:username", ""))
+        self._send(f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Acceso</title></head><body>
+<form id="F1" method="post" action="/contribuyente_/ingresar">
+<input type="hidden" name="F1:username" value="{cuit}">
+<p>CUIT {cuit}</p>
+<input type="password" id="F1:password" name="F1:password">
+<input type="submit" id="F1:btnIngresar" value="Ingresar">
+</form></body></html>""")
+
+    def _login_ingresar(self, datos):
+        cuit = datos.get("F1:username", "")
+        if not cuit or not datos.get("F1:password"):
+            self._login_siguiente(datos)
+            return
+        token = secrets.token_hex(16)
+        with _SESSIONS_LOCK:
+            SESSIONS[token] = cuit
+        self._redirect("/portal", {"Set-Cookie": f"MOCKSESSION={token}; Path=/"})
+
+    def _logout(self, _datos):
+        for parte in self.headers.get("Cookie", "").split(";"):
+            nombre, _, valor = parte.strip().partition("=")
+            if nombre == "MOCKSESSION":
+                with _SESSIONS_LOCK:
+                    SESSIONS.pop(valor, None)
+        self._redirect("/contribuyente_/login.xhtml", {"Set-Cookie": "MOCKSESSION=; Path=/; Max-Age=0"})
+
+    # --- portal con buscador ----------------------------------------------------------------
+
+    def _portal_page(self, _query):
+        if not self._cuit():
+            self._redirect("/contribuyente_/login.xhtml")
+            return
+        botones = "".join(f"<div><button type='button'><div><div>Opción {n}</div></div></button></div>"
+                          for n in range(1, 6))
+        self._send(f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Portal</title></head><body>
+<div id="userIconoChico" onclick="document.getElementById('contBtnContribuyente').style.display='block'">Usuario</div>
+<div id="contBtnContribuyente" style="display:none">{botones}
+<div><button type="button" onclick="document.getElementById('salir').submit()"><div><div>Icono</div><div>Cerrar sesión</div></div></button></div>
+</div>
+<form id="salir" method="post" action="/logout"></form>
+<input type="text" id="buscadorInput" autocomplete="off">
+<div id="resultados"></div>
+<script>
+document.getElementById('buscadorInput').addEventListener('input', function() {{
+    var lista = document.getElementById('resultados');
+    if (this.value.toUpperCase().indexOf('MIS RET') >= 0) {{
+        lista.innerHTML = '<div id="rbt-menu-item-0"><a href="/mr/form" target="_blank"><div><div><div><div><p>Mis Retenciones</p></div></div></div></div></a></div>'
+            + '<div id="rbt-menu-item-1"><a href="#"><div><div><div><div><p>Mis Retenciones - Reclamos</p></div></div></div></div></a></div>';
+    }} else {{
+        lista.innerHTML = '';
+    }}
+}});
+</script>
+</body></html>""")
+
+    # --- Mis Retenciones ------------------------------------------------------------------
+
+    def _mis_retenciones_form(self, _query):
+        cuit = self._cuit()
+        if not cuit or random.random() < MOCK_CONFIG["auth_error_rate"]:
+            self._send("<html><body><h1>HTTP Status 401 - AUTHENTICATION_ALREADY_PRESENT</h1></body></html>",
+                       status=401)
+            return
+
+        impuestos = "".join(f"<option value='{codigo}'>{codigo} - {descripcion}</option>"
+                            for codigo, descripcion in IMPUESTOS)
+        impuestos += f"<option value='{TODOS_LOS_IMPUESTOS}'>Todos los impuestos</option>"
+        # Las filas del formulario respetan las posiciones de las XPath (fechas en tr[8], Consultar en tr[13])
+        filas = ["<tr><td colspan='2'>Consulta de retenciones</td></tr>"] * 13
+        filas[1] = (f"<tr><td>CUIT retenido</td><td><select id='cuitRetenido' name='cuitRetenido'>"
+                    f"<option value=''>Seleccione</option><option value='{cuit}'>{cuit} - CONTRIBUYENTE MOCK</option>"
+                    f"</select></td></tr>")
+        filas[3] = (f"<tr><td>Impuesto</td><td><select id='impuestos' name='impuestos'>"
+                    f"<option value=''>Seleccione</option>{impuestos}</select></td></tr>")
+        filas[7] = ("<tr><td>Fecha</td><td><input type='text' name='fechaDesde' maxlength='10'>"
+                    "<input type='text' name='fechaHasta' maxlength='10'></td></tr>")
+        filas[12] = "<tr><td colspan='2'><input type='submit' name='consultar' value='Consultar'></td></tr>"
+        contenido = (f"<form method='post' action='/mr/consulta'><input type='hidden' name='token' value='mock'>"
+                     f"<table><tbody><tr><td>Filtros</td></tr></tbody></table>"
+                     f"<table><tbody>{''.join(filas)}</tbody></table></form>")
+        self._send(_PAGE_TEMPLATE.format(title="Mis Retenciones", content=contenido))
+
+    def _consulta(self, datos):
+        cuit = self._cuit()
+        if not cuit:
+            self._send("<html><body><h1>HTTP Status 401 - AUTHENTICATION_ALREADY_PRESENT</h1></body></html>",
+                       status=401)
+            return
+        if random.random() < MOCK_CONFIG["fail_rate"]:
+            self._send("<html><body>Error interno</body></html>", status=500)
+            return
+
+        codigo = datos.get("impuestos", "")
+        desde, hasta = datos.get("fechaDesde", ""), datos.get("fechaHasta", "")
+        self._results_page(datos.get("cuitRetenido", cuit), codigo, desde, hasta, 1)
+
+    def _resultados(self, query):
+        # Páginas siguientes de una consulta (enlace "Siguiente")
+        if not self._cuit():
+            self._send("<html><body>401</body></html>", status=401)
+            return
+        datos = {clave: valores[0] for clave, valores in query.items()}
+        self._results_page(datos.get("cuit", ""), datos.get("codigo", ""), datos.get("desde", ""),
+                           datos.get("hasta", ""), int(datos.get("pagina", "1")))
+
+    def _results_page(self, cuit, codigo, desde, hasta, pagina):
+        filas = _rows_for(cuit, codigo, desde, hasta)
+
+        if not filas:
+            contenido = ("<table><tbody><tr><td>No se han encontrado datos</td></tr></tbody></table>"
+                         "<table><tbody><tr><td>&nbsp;</td></tr>"
+                         "<tr><td><input type='button' value='VOLVER' onclick='history.back()'></td></tr>"
+                         "</tbody></table>")
+            self._send(_PAGE_TEMPLATE.format(title="Sin datos", content=contenido))
+            return
+
+        columnas = list(filas[0])
+        tamanio = MOCK_CONFIG["page_size"]
+        paginas = max(1, -(-len(filas) // tamanio))
+        encabezado = "".join(f"<th>{columna}</th>" for columna in columnas)
+        cuerpo = "".join("<tr>" + "".join(f"<td>{fila[columna]}</td>" for columna in columnas) + "</tr>"
+                         for fila in filas[(pagina - 1) * tamanio:pagina * tamanio])
+        consulta = f"cuit={cuit}&codigo={codigo}&desde={desde}&hasta={hasta}"
+        # Paginado en las primeras celdas de la barra de herramientas (la exportación sigue en td[8])
+        herramientas = [f"<td>Página {pagina} de {paginas}</td>"] + ["<td>&nbsp;</td>"] * 6
+        if pagina < paginas:
+            herramientas[1] = f"<td><a href='/mr/resultados?{consulta}&pagina={pagina + 1}'>Siguiente</a></td>"
+        herramientas = "".join(herramientas)
+        contenido = (f"<table><tbody><tr><td>Resultados: {len(filas)}</td></tr></tbody></table>"
+                     f"<table><tbody><tr>{encabezado}</tr>{cuerpo}</tbody></table>"
+                     f"<table><tbody><tr><td>&nbsp;</td><td><table><tbody><tr>{herramientas}"
+                     f"<td><a href='/mr/exportar?{consulta}'>Exportar a Excel</a></td>"
+                     f"</tr></tbody></table></td></tr></tbody></table>")
+        self._send(_PAGE_TEMPLATE.format(title="Resultados", content=contenido))
+
+    def _exportar(self, query):
+        if not self._cuit():
+            self._send("<html><body>401</body></html>", status=401)
+            return
+        datos = {clave: valores[0] for clave, valores in query.items()}
+        filas = _rows_for(datos.get("cuit", ""), datos.get("codigo", ""), datos.get("desde", ""), datos.get("hasta", ""))
+        columnas = list(filas[0]) if filas else []
+        # Igual que muchos sistemas Java, el "Excel" es una tabla HTML con extensión .xls
+        tabla = ("<table><tr>" + "".join(f"<th>{columna}</th>" for columna in columnas) + "</tr>"
+                 + "".join("<tr>" + "".join(f"<td>{fila[columna]}</td>" for columna in columnas) + "</tr>"
+                           for fila in filas)
+                 + "</table>")
+        nombre = f"MisRetenciones_{datetime.now():%Y%m%d%H%M%S%f}.xls"
+        self._send(f"<html><body>{tabla}</body></html>", content_type="application/vnd.ms-excel",
+                   headers={"Content-Disposition": f'attachment; filename="{nombre}"'})
+
+
+def start_mock_server(port=0, **config):
+    """Levantar el sitio simulado en un hilo y devolver (servidor, URL de login)"""
+    MOCK_CONFIG.update(config)
+    servidor = ThreadingHTTPServer(("127.0.0.1", port), MockArcaHandler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}/contribuyente_/login.xhtml"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sitio local que imita ARCA / Mis Retenciones")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos agregados a cada respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación aleatoria de la latencia")
+    parser.add_argument("--auth-error-rate", type=float, default=0.0,
+                        help="Probabilidad de 401 AUTHENTICATION_ALREADY_PRESENT al abrir Mis Retenciones")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probabilidad de error 500 en la consulta")
+    parser.add_argument("--empty-rate", type=float, default=0.5, help="Proporción de consultas sin datos")
+    args = parser.parse_args()
+
+    servidor, login_url = start_mock_server(args.port, latency=args.latency, jitter=args.jitter,
+                                            auth_error_rate=args.auth_error_rate, fail_rate=args.fail_rate,
+                                            empty_rate=args.empty_rate)
+    print(f"Mock de ARCA escuchando. URL de login: {login_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Fixtures comunes de las pruebas"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PATH = os.path.join(REPO_DIR, "MIS RET v1.py")
+
+# mock_arca.py está en la raíz del repositorio
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture(scope="session")
+def mis_ret():
+    """Importar MIS RET v1.py como módulo (el nombre tiene espacios)"""
+    spec = importlib.util.spec_from_file_location("mis_ret_v1", SCRIPT_PATH)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture
+def arca():
+    """Sitio simulado de ARCA en un puerto libre; devuelve el módulo mock_arca y la URL base"""
+    import mock_arca
+    configuracion = dict(mock_arca.MOCK_CONFIG)
+    servidor, login_url = mock_arca.start_mock_server(0)
+    try:
+        yield mock_arca, login_url.split("/contribuyente_/")[0]
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        mock_arca.MOCK_CONFIG.clear()
+        mock_arca.MOCK_CONFIG.update(configuracion)
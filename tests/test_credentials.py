@@ -0,0 +1,13 @@
+"""Pruebas de normalize_cuit (formato y dígito verificador)"""
+import pytest
+
+
+@pytest.mark.parametrize("valor", ["20111111112", "20-11111111-2", " 20.11111111.2 ", 20111111112, 20111111112.0,
+                                   "20111111112.0"])
+def test_formatos_aceptados(mis_ret, valor):
+    assert mis_ret.normalize_cuit(valor) == "20111111112"
+
+
+@pytest.mark.parametrize("valor", ["20111111113", "2011111111", "201111111120", "20-1111111A-2", "", None])
+def test_cuit_invalido(mis_ret, valor):
+    assert mis_ret.normalize_cuit(valor) is None
@@ -0,0 +1,91 @@
+"""Pruebas de la consulta directa por HTTP (engine "http") contra el sitio simulado de mock_arca"""
+import os
+from urllib.parse import urlencode
+
+import pytest
+import urllib3
+
+CUIT = "20111111112"
+DESDE, HASTA, PERIODO = "01012024", "31012024", "202401"
+
+
+def _login(base):
+    """Iniciar sesión en el mock y devolver sus cookies (lo que copiaría create_http_session)"""
+    respuesta = urllib3.request("POST", f"{base}/contribuyente_/ingresar",
+                                body=urlencode({"F1:username": CUIT, "F1:password": "clave"}),
+                                headers={"Content-Type": "application/x-www-form-urlencoded"}, redirect=False)
+    nombre, _, resto = respuesta.headers["Set-Cookie"].partition("=")
+    return {nombre: resto.split(";", 1)[0]}
+
+
+def _sesion(mock_arca, base, cookies):
+    """Sesión HTTP con el formulario de Mis Retenciones del mock, como la arma create_http_session"""
+    return {
+        "form": {
+            "action": f"{base}/mr/consulta",
+            "method": "post",
+            "fields": [["token", "mock"], ["cuitRetenido", ""], ["impuestos", ""],
+                       ["fechaDesde", ""], ["fechaHasta", ""]],
+            "cuit_field": "cuitRetenido",
+            "cuit_options": [["", "Seleccione"], [CUIT, f"{CUIT} - CONTRIBUYENTE MOCK"]],
+            "impuesto_field": "impuestos",
+            "impuesto_options": [["", "Seleccione"]] + [[codigo, f"{codigo} - {descripcion}"]
+                                                        for codigo, descripcion in mock_arca.IMPUESTOS],
+            "desde_field": "fechaDesde",
+            "hasta_field": "fechaHasta",
+            "submit": ["consultar", "Consultar"],
+        },
+        "cookies": cookies,
+        "headers": {"User-Agent": "pytest", "Referer": f"{base}/mr/form"},
+    }
+
+
+def test_consulta_con_datos_guarda_la_exportacion(mis_ret, arca, tmp_path):
+    mock_arca, base = arca
+    mock_arca.MOCK_CONFIG["empty_rate"] = 0.0
+    sesion = _sesion(mock_arca, base, _login(base))
+    estado, archivo = mis_ret.consultar_retenciones_http(sesion, CUIT, "216", str(tmp_path), DESDE, HASTA, PERIODO)
+    assert estado == mis_ret.JOB_DONE
+    assert archivo == mis_ret.export_path(str(tmp_path), CUIT, "216", PERIODO, ".xls")
+    with open(archivo, "rb") as f:
+        assert b"<table>" in f.read()
+    assert mis_ret.http_signal(sesion, estado) == "ok"
+
+
+def test_consulta_sin_datos(mis_ret, arca, tmp_path):
+    mock_arca, base = arca
+    mock_arca.MOCK_CONFIG["empty_rate"] = 1.0
+    sesion = _sesion(mock_arca, base, _login(base))
+    assert mis_ret.consultar_retenciones_http(sesion, CUIT, "767", str(tmp_path), DESDE, HASTA,
+                                              PERIODO) == (mis_ret.JOB_EMPTY, None)
+    assert os.listdir(tmp_path) == []
+
+
+def test_sesion_vencida_vuelve_al_navegador(mis_ret, arca, tmp_path):
+    mock_arca, base = arca
+    sesion = _sesion(mock_arca, base, {"MOCKSESSION": "vencida"})
+    assert mis_ret.consultar_retenciones_http(sesion, CUIT, "216", str(tmp_path), DESDE, HASTA,
+                                              PERIODO) == (None, None)
+    # El limitador lo toma como un rechazo de la sesión, no como un éxito
+    assert mis_ret.http_signal(sesion, None) == "auth_error"
+
+
+def test_error_del_portal_pide_bajar_el_ritmo(mis_ret, arca, tmp_path):
+    mock_arca, base = arca
+    mock_arca.MOCK_CONFIG["fail_rate"] = 1.0
+    sesion = _sesion(mock_arca, base, _login(base))
+    assert mis_ret.consultar_retenciones_http(sesion, CUIT, "216", str(tmp_path), DESDE, HASTA,
+                                              PERIODO) == (None, None)
+    assert mis_ret.http_signal(sesion, None) == "error"
+
+
+@pytest.mark.parametrize("content_type, disposition, esperado", [
+    ("application/vnd.ms-excel", "", True),
+    ("text/html; charset=utf-8", 'attachment; filename="MisRetenciones.xls"', True),
+    ("text/csv", None, True),
+    # Página de login o de error servida con 200 tras una redirección
+    ("text/html; charset=utf-8", "", False),
+    ("", "inline", False),
+])
+def test_is_export_response(mis_ret, content_type, disposition, esperado):
+    assert mis_ret.is_export_response(content_type, disposition) is esperado
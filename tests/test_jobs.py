@@ -0,0 +1,32 @@
+"""Pruebas del orden de las consultas y del reparto de CUIT entre nodos"""
+import pytest
+
+
+def test_order_jobs_cambia_un_solo_campo_por_consulta(mis_ret):
+    enero = ("01012024", "31012024", "202401")
+    febrero = ("01022024", "29022024", "202402")
+    trabajos = [febrero + ("767",), enero + ("767",), enero + ("216",), febrero + ("216",), enero + ("216",)]
+    assert mis_ret.order_jobs(trabajos) == [
+        enero + ("216",), enero + ("767",),
+        # El período siguiente empieza por el último código: solo cambian las fechas
+        febrero + ("767",), febrero + ("216",),
+    ]
+
+
+def test_parse_shard(mis_ret):
+    assert mis_ret.parse_shard("2/4") == (2, 4)
+    assert mis_ret.parse_shard(" 1 / 1 ") == (1, 1)
+
+
+@pytest.mark.parametrize("texto", ["0/4", "5/4", "2", "a/b", "", None])
+def test_parse_shard_invalido(mis_ret, texto):
+    with pytest.raises(ValueError):
+        mis_ret.parse_shard(texto)
+
+
+def test_cada_cuit_cae_en_una_sola_parte(mis_ret):
+    cuits = [f"20{numero:08d}1" for numero in range(200)]
+    for cuit in cuits:
+        assert sum(mis_ret.in_shard(cuit, indice, 3) for indice in (1, 2, 3)) == 1
+    # El reparto no deja partes vacías
+    assert all(any(mis_ret.in_shard(cuit, indice, 3) for cuit in cuits) for indice in (1, 2, 3))
@@ -0,0 +1,43 @@
+"""Pruebas de JobManifest (estado persistente de cada trabajo)"""
+import json
+
+
+def test_trabajos_terminados_no_quedan_pendientes(mis_ret, tmp_path):
+    manifest = mis_ret.JobManifest(str(tmp_path / "manifest.sqlite"))
+    manifest.start("20111111112", "216", "202401")
+    manifest.start("20111111112", "767", "202401")
+    manifest.finish("20111111112", "216", "202401", mis_ret.JOB_DONE, "a.xls", sha256="abc")
+    assert manifest.pending_codes("20111111112", ["216", "767"], "202401") == ["767"]
+    
+    manifest.fail_running("20111111112", None, "login")
+    assert manifest.summary() == {mis_ret.JOB_DONE: 1, mis_ret.JOB_FAILED: 1}
+    manifest.close()
+
+
+def test_el_estado_persiste_entre_corridas(mis_ret, tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = mis_ret.JobManifest(path)
+    manifest.start("20111111112", "216", "202401")
+    manifest.finish("20111111112", "216", "202401", mis_ret.JOB_DONE, "a.xls", sha256="abc")
+    manifest.update("20111111112", "216", "202401", consolidated_at="2024-02-01T00:00:00")
+    manifest.close()
+    
+    manifest = mis_ret.JobManifest(path)
+    manifest.start("20111111112", "216", "202401")
+    manifest.finish("20111111112", "216", "202401", mis_ret.JOB_DONE, "a.xls", sha256="def")
+    job, = manifest.jobs_with_status(mis_ret.JOB_DONE)
+    assert job["attempts"] == 2
+    # Contenido nuevo: hay que volver a consolidarlo
+    assert "consolidated_at" not in job
+    manifest.close()
+
+
+def test_importa_un_manifiesto_json_anterior(mis_ret, tmp_path):
+    anterior = tmp_path / "manifest.json"
+    anterior.write_text(json.dumps({"jobs": {"20111111112|216|202401": {
+        "cuit": "20111111112", "codigo": "216", "periodo": "202401", "status": mis_ret.JOB_DONE, "attempts": 1,
+    }}}), encoding="utf-8")
+    manifest = mis_ret.JobManifest(str(anterior))
+    assert manifest.path == str(tmp_path / "manifest.sqlite")
+    assert manifest.pending_codes("20111111112", ["216"], "202401") == []
+    manifest.close()
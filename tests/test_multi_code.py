@@ -0,0 +1,28 @@
+"""Pruebas de split_records_by_code (separar la consulta combinada por código)"""
+import pytest
+
+
+def _registro(impuesto, importe="100,00"):
+    return {"impuesto": impuesto, "importe_retenido": importe}
+
+
+def test_separa_por_codigo(mis_ret):
+    registros = [_registro("216"), _registro("767 - IVA"), _registro("216 - IVA"), _registro("2160")]
+    separados = mis_ret.split_records_by_code(registros, ["216", "767"], columna="impuesto")
+    assert separados == {"216": [registros[0], registros[2]], "767": [registros[1]]}
+
+
+def test_codigos_sin_registros_quedan_vacios(mis_ret):
+    separados = mis_ret.split_records_by_code([_registro("217 - Ganancias")], ["216", "217"], columna="impuesto")
+    assert separados == {"216": [], "217": [_registro("217 - Ganancias")]}
+
+
+def test_valor_sin_codigo_no_se_puede_separar(mis_ret):
+    # Si el portal muestra solo la descripción no hay forma de saber el código: no debe quedar todo vacío
+    with pytest.raises(ValueError):
+        mis_ret.split_records_by_code([_registro("Ganancias")], ["217"], columna="impuesto")
+
+
+def test_sin_columna_de_impuesto(mis_ret):
+    with pytest.raises(ValueError):
+        mis_ret.split_records_by_code([{"cuit": "20111111112"}], ["216"], columna="impuesto")
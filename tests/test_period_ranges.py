@@ -0,0 +1,42 @@
+"""Pruebas de get_period_ranges (rangos de períodos aaaamm a consultas ddmmaaaa)"""
+from datetime import datetime
+
+import pytest
+
+
+def _periodo(meses):
+    """Período aaaamm desplazado N meses desde el actual (negativo hacia atrás)"""
+    hoy = datetime.now()
+    indice = hoy.year * 12 + hoy.month - 1 + meses
+    return f"{indice // 12}{indice % 12 + 1:02d}"
+
+
+def test_un_mes_por_consulta(mis_ret):
+    assert mis_ret.get_period_ranges("202401", "202403") == [
+        ("01012024", "31012024", "202401"),
+        ("01022024", "29022024", "202402"),
+        ("01032024", "31032024", "202403"),
+    ]
+
+
+def test_varios_meses_por_consulta(mis_ret):
+    assert mis_ret.get_period_ranges("202311", "202403", 3) == [
+        ("01112023", "31012024", "202311-202401"),
+        ("01022024", "31032024", "202402-202403"),
+    ]
+
+
+def test_hasta_futuro_termina_hoy(mis_ret):
+    rangos = mis_ret.get_period_ranges(_periodo(-1), _periodo(3))
+    assert [periodo for _, _, periodo in rangos] == [_periodo(-1), _periodo(0)]
+    assert rangos[-1][1] == datetime.now().strftime("%d%m%Y")
+
+
+def test_rango_futuro_queda_vacio(mis_ret):
+    assert mis_ret.get_period_ranges(_periodo(1), _periodo(2)) == []
+
+
+@pytest.mark.parametrize("periodo", ["202513", "202500", "2025", "2025-1", "abcdef"])
+def test_periodo_invalido(mis_ret, periodo):
+    with pytest.raises(ValueError):
+        mis_ret.get_period_ranges(periodo, periodo)
@@ -0,0 +1,66 @@
+"""Pruebas de AdaptiveRateLimiter (AIMD sobre ritmo y concurrencia)"""
+import time
+
+import pytest
+
+
+@pytest.fixture
+def limitador(mis_ret):
+    return mis_ret.AdaptiveRateLimiter(rate=10.0, burst=100, max_rate=20.0, increase=0.1, decrease=0.5,
+                                       max_concurrency=4, success_streak=2, cooldown=0.0, target_latency=5.0)
+
+
+def test_exito_sube_el_ritmo_de_a_poco(limitador):
+    for _ in range(3):
+        with limitador.slot():
+            pass
+    assert limitador.rate == pytest.approx(10.3)
+
+
+def test_error_baja_ritmo_y_concurrencia(limitador):
+    with limitador.slot() as operacion:
+        operacion["signal"] = "error"
+    assert limitador.rate == pytest.approx(5.0)
+    assert limitador.concurrency == 3
+    assert limitador.summary()["errors"] == 1
+    
+    # La concurrencia se recupera de a una tras success_streak éxitos seguidos
+    for _ in range(2):
+        with limitador.slot():
+            pass
+    assert limitador.concurrency == 4
+
+
+def test_auth_error_abre_una_pausa(mis_ret):
+    limitador = mis_ret.AdaptiveRateLimiter(burst=100, cooldown=30.0)
+    with limitador.slot() as operacion:
+        operacion["signal"] = "auth_error"
+    assert limitador.cooldown_until > time.monotonic() + 20
+    assert limitador.summary()["auth_errors"] == 1
+
+
+def test_excepcion_dentro_del_lugar_cuenta_como_error(limitador):
+    with pytest.raises(RuntimeError):
+        with limitador.slot():
+            raise RuntimeError("falla")
+    assert limitador.summary()["errors"] == 1
+    assert limitador.in_flight == 0
+
+
+def test_las_pausas_de_ritmo_no_cuentan_como_lentitud(mis_ret, monkeypatch):
+    limitador = mis_ret.AdaptiveRateLimiter(burst=100, target_latency=0.05)
+    monkeypatch.setitem(mis_ret.PACING, "prueba", (0.1, 0.1))
+    with limitador.slot():
+        mis_ret.pause("prueba")
+    assert limitador.summary()["slow"] == 0
+    
+    with limitador.slot():
+        time.sleep(0.1)
+    assert limitador.summary()["slow"] == 1
+
+
+def test_concurrencia_por_defecto_segun_workers(mis_ret):
+    assert mis_ret.AdaptiveRateLimiter().concurrency == 1
+    limitador = mis_ret.AdaptiveRateLimiter()
+    limitador.reset(8)
+    assert limitador.concurrency == 8
@@ -0,0 +1,37 @@
+"""Pruebas de store_export (destino final de las exportaciones, sin copias ni duplicados)"""
+import os
+
+
+def test_guarda_bytes_en_su_carpeta(mis_ret, tmp_path):
+    destino, digest, cambio = mis_ret.store_export(b"contenido", str(tmp_path), "20111111112", "216", "202401", ".xls")
+    assert destino == os.path.join(str(tmp_path), "202401", "20111111112", "20111111112_MisRetenciones_216_202401.xls")
+    assert cambio
+    with open(destino, "rb") as f:
+        assert f.read() == b"contenido"
+    # Sin temporales a medio escribir
+    assert os.listdir(os.path.dirname(destino)) == [os.path.basename(destino)]
+
+
+def test_mismo_contenido_no_se_reescribe(mis_ret, tmp_path):
+    destino, digest, _ = mis_ret.store_export(b"contenido", str(tmp_path), "20111111112", "216", "202401", ".xls")
+    modificado = os.stat(destino).st_mtime_ns
+    
+    descarga = tmp_path / "descarga.xls"
+    descarga.write_bytes(b"contenido")
+    otra_vez, otro_digest, cambio = mis_ret.store_export(str(descarga), str(tmp_path), "20111111112", "216",
+                                                         "202401", ".xls")
+    assert (otra_vez, otro_digest, cambio) == (destino, digest, False)
+    assert os.stat(destino).st_mtime_ns == modificado
+    # La descarga repetida se descarta
+    assert not descarga.exists()
+
+
+def test_contenido_nuevo_reemplaza_al_anterior(mis_ret, tmp_path):
+    mis_ret.store_export(b"enero", str(tmp_path), "20111111112", "216", "202401", ".xls")
+    descarga = tmp_path / "descarga.xls"
+    descarga.write_bytes(b"enero corregido")
+    destino, _, cambio = mis_ret.store_export(str(descarga), str(tmp_path), "20111111112", "216", "202401", ".xls")
+    assert cambio
+    with open(destino, "rb") as f:
+        assert f.read() == b"enero corregido"
+    assert not descarga.exists()
@@ -0,0 +1,20 @@
+"""Pruebas del archivo de spans (configure_tracing / close_tracing)"""
+import json
+
+
+def test_reconfigurar_y_cerrar_no_deja_archivos_abiertos(mis_ret, tmp_path):
+    mis_ret.configure_tracing(str(tmp_path / "primera.jsonl"))
+    primero = mis_ret._TRACE["file"]
+    mis_ret.configure_tracing(str(tmp_path / "segunda.jsonl"))
+    assert primero.closed
+    
+    with mis_ret.trace_span("paso"):
+        pass
+    segundo = mis_ret._TRACE["file"]
+    mis_ret.close_tracing()
+    assert segundo.closed and mis_ret._TRACE["file"] is None
+    # El resumen de la corrida sigue disponible después de cerrar el archivo
+    assert "paso" in mis_ret._TRACE["spans"]
+    
+    registro, = [json.loads(linea) for linea in (tmp_path / "segunda.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert registro["step"] == "paso"
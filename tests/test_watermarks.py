@@ -0,0 +1,97 @@
+"""Pruebas de WatermarkStore (marcas incrementales por CUIT y código), sin navegador"""
+from datetime import datetime
+
+import pytest
+
+CUIT = "20111111112"
+
+
+@pytest.fixture
+def store(mis_ret, tmp_path):
+    return mis_ret.WatermarkStore(str(tmp_path / "watermarks.json"), empty_threshold=3, max_probe_interval=12)
+
+
+def _mes_anterior(meses_atras=1):
+    """Período aaaamm de hace N meses"""
+    hoy = datetime.now()
+    indice = hoy.year * 12 + hoy.month - 1 - meses_atras
+    return f"{indice // 12}{indice % 12 + 1:02d}"
+
+
+def _rango(mis_ret, periodo):
+    """(fecha_desde, fecha_hasta) ddmmaaaa de un mes completo"""
+    start_date, end_date, _ = mis_ret.get_period_ranges(periodo, periodo)[0]
+    return start_date, end_date
+
+
+def test_sin_marca_se_consulta_el_mes_anterior(mis_ret, store):
+    trabajos, al_dia, en_espera = store.plan(CUIT, ["216", "767"])
+    assert [(periodo, codigo) for _, _, periodo, codigo in trabajos] == [(_mes_anterior(), "216"),
+                                                                           (_mes_anterior(), "767")]
+    assert (al_dia, en_espera) == (0, 0)
+
+
+def test_marca_al_dia_no_planifica_consultas(mis_ret, store):
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior()), mis_ret.JOB_DONE)
+    trabajos, al_dia, en_espera = store.plan(CUIT, ["216"])
+    assert trabajos == []
+    assert (al_dia, en_espera) == (1, 0)
+
+
+def test_se_consulta_solo_el_rango_sin_cubrir(mis_ret, store):
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(3)), mis_ret.JOB_DONE)
+    trabajos, _, _ = store.plan(CUIT, ["216"])
+    assert [periodo for _, _, periodo, _ in trabajos] == [_mes_anterior(2), _mes_anterior(1)]
+
+
+def test_un_hueco_no_avanza_la_marca(mis_ret, store):
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(3)), mis_ret.JOB_DONE)
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(1)), mis_ret.JOB_DONE)
+    trabajos, _, _ = store.plan(CUIT, ["216"])
+    assert _mes_anterior(2) in [periodo for _, _, periodo, _ in trabajos]
+
+
+def test_repetir_un_mes_vacio_no_suma_racha(mis_ret, store):
+    rango = _rango(mis_ret, _mes_anterior())
+    for _ in range(3):
+        store.record(CUIT, "216", *rango, mis_ret.JOB_EMPTY)
+    assert store.marks[store.key(CUIT, "216")]["empty_streak"] == 1
+
+
+def test_rango_solapado_suma_solo_los_meses_nuevos(mis_ret, store):
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(3)), mis_ret.JOB_EMPTY)
+    start_date, _ = _rango(mis_ret, _mes_anterior(3))
+    _, end_date = _rango(mis_ret, _mes_anterior(1))
+    store.record(CUIT, "216", start_date, end_date, mis_ret.JOB_EMPTY)
+    assert store.marks[store.key(CUIT, "216")]["empty_streak"] == 3
+
+
+def test_datos_reinician_la_racha(mis_ret, store):
+    for meses_atras in (3, 2):
+        store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(meses_atras)), mis_ret.JOB_EMPTY)
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(1)), mis_ret.JOB_DONE)
+    marca = store.marks[store.key(CUIT, "216")]
+    assert marca["empty_streak"] == 0
+    assert marca["last_data_period"] == _mes_anterior(1)
+
+
+def test_combinacion_vacia_se_sondea_con_menos_frecuencia(mis_ret, store):
+    # Tres meses vacíos (umbral): el próximo sondeo es dos meses después del último revisado
+    for meses_atras in (4, 3, 2):
+        store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior(meses_atras)), mis_ret.JOB_EMPTY)
+    trabajos, _, en_espera = store.plan(CUIT, ["216"])
+    assert trabajos == [] and en_espera == 1
+
+    marca = store.marks[store.key(CUIT, "216")]
+    marca["last_checked"] = _mes_anterior(3)
+    marca["covered_until"] = (datetime.strptime(_rango(mis_ret, _mes_anterior(3))[1], "%d%m%Y")).date().isoformat()
+    trabajos, _, en_espera = store.plan(CUIT, ["216"])
+    assert en_espera == 0
+    assert [periodo for _, _, periodo, _ in trabajos] == [_mes_anterior(2), _mes_anterior(1)]
+
+
+def test_las_marcas_persisten(mis_ret, store):
+    store.record(CUIT, "216", *_rango(mis_ret, _mes_anterior()), mis_ret.JOB_EMPTY)
+    otra = mis_ret.WatermarkStore(store.path)
+    assert otra.marks == store.marks
+    assert otra.summary() == {"combinaciones": 1, "sondeo_espaciado": 0}
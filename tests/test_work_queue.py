@@ -0,0 +1,54 @@
+"""Pruebas de WorkQueue (cola de trabajos compartida en SQLite)"""
+import time
+
+import pytest
+
+PERIODOS = [("01012024", "31012024", "202401"), ("01022024", "29022024", "202402")]
+
+
+@pytest.fixture
+def cola(mis_ret, tmp_path):
+    cola = mis_ret.WorkQueue(str(tmp_path / "cola.sqlite"), lease=60, max_attempts=2)
+    cola.seed(["20111111112", "27222222223"], ["216", "767"], PERIODOS)
+    return cola
+
+
+def test_claim_toma_todos_los_trabajos_de_un_cuit(mis_ret, cola):
+    owner = cola.owner(1)
+    cuit = cola.claim(owner, ["20111111112"])
+    assert cuit == "20111111112"
+    assert cola.claimed(cuit, owner) == {(codigo, periodo) for codigo in ("216", "767") for _, _, periodo in PERIODOS}
+    # Otro worker no puede tomar el mismo CUIT mientras dure el lease
+    assert cola.claim(cola.owner(2), ["20111111112"]) is None
+
+
+def test_complete_y_fail_owned(mis_ret, cola):
+    owner = cola.owner(1)
+    cuit = cola.claim(owner, ["20111111112"])
+    cola.complete(cuit, "216", "202401", owner, mis_ret.JOB_DONE)
+    cola.fail_owned(cuit, owner, "login")
+    assert cola.summary() == {mis_ret.JOB_DONE: 1, mis_ret.JOB_FAILED: 3, mis_ret.JOB_PENDING: 4}
+    # Los fallidos se vuelven a tomar hasta max_attempts
+    assert cola.claim(owner, ["20111111112"]) == cuit
+    cola.fail_owned(cuit, owner, "login")
+    assert cola.claim(owner, ["20111111112"]) is None
+
+
+def test_release_solo_devuelve_los_trabajos_del_worker(mis_ret, cola):
+    cola.claim(cola.owner(1), ["20111111112"])
+    cola.claim(cola.owner(10), ["27222222223"])
+    cola.release(cola.owner(1))
+    assert cola.claimed("27222222223", cola.owner(10))
+    assert cola.summary() == {mis_ret.JOB_PENDING: 4, mis_ret.JOB_RUNNING: 4}
+    
+    cola.release_process()
+    assert cola.summary() == {mis_ret.JOB_PENDING: 8}
+
+
+def test_lease_vencido_lo_retoma_otro_nodo(mis_ret, tmp_path):
+    cola = mis_ret.WorkQueue(str(tmp_path / "cola.sqlite"), lease=0.05)
+    cola.seed(["20111111112"], ["216"], PERIODOS[:1])
+    assert cola.claim("nodo-a:1:1", ["20111111112"]) == "20111111112"
+    time.sleep(0.1)
+    assert cola.claim("nodo-b:2:1", ["20111111112"]) == "20111111112"
+    assert cola.claimed("20111111112", "nodo-b:2:1") == {("216", "202401")}